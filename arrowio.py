@@ -0,0 +1,445 @@
+#!/usr/bin/env python3
+
+# Copyright © 2021-2022 Helmholtz Centre Potsdam GFZ German Research Centre for
+# Geosciences, Potsdam, Germany
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+"""
+Module to read & write the exposure as GeoParquet or Arrow IPC files.
+
+For chained runs (earthquake and then tsunami for example) the
+output of one run is the exposure of the next one. With GeoJSON we
+would have to write & parse the text in every step, so for those
+we can use typed columnar files instead.
+
+The geometry is stored as WKB (with the GeoParquet metadata).
+The nested expo & transitions dicts are stored with one list column
+per key (expo.Taxonomy, expo.Damage, expo.Buildings, ...).
+"""
+
+import json
+import os
+
+import geopandas
+import pandas
+import pyproj
+import shapely.wkb
+
+import geojsonio
+
+try:
+    import pyarrow
+    import pyarrow.ipc
+    import pyarrow.parquet
+except ImportError:
+    # pyarrow is optional, we only need it for those file formats.
+    pyarrow = None
+
+# We need ParquetFile.iter_batches.
+PYARROW_MIN_VERSION = (3, 0)
+
+# geopandas can convert to & from WKB since version 0.9,
+# for older versions we use shapely.
+HAS_GEOPANDAS_WKB = hasattr(geopandas.GeoSeries, "from_wkb")
+# pyproj can write & read PROJJSON since version 2.4.
+HAS_PROJJSON = hasattr(pyproj.CRS, "to_json_dict")
+
+PARQUET_EXTENSIONS = [".parquet", ".geoparquet"]
+ARROW_EXTENSIONS = [".arrow", ".feather", ".ipc"]
+
+# Columns with dicts of lists that we store as one list column per key.
+NESTED_COLUMNS = ["expo", "transitions"]
+
+GEO_METADATA_KEY = b"geo"
+GEOPARQUET_VERSION = "1.0.0"
+
+
+def get_file_format(filename):
+    """
+    Return parquet or arrow for the filename.
+
+    Returns None for all the other files (GeoJSON for example).
+    """
+    extension = os.path.splitext(filename)[1].lower()
+    if extension in PARQUET_EXTENSIONS:
+        return "parquet"
+    if extension in ARROW_EXTENSIONS:
+        return "arrow"
+    return None
+
+
+def is_arrow_file(filename):
+    """Return true if we read & write the file with this module."""
+    return get_file_format(filename) is not None
+
+
+def check_pyarrow():
+    """
+    Fail with a clear message if pyarrow is not installed
+    (or too old).
+    """
+    if pyarrow is None:
+        raise Exception(
+            "pyarrow is needed to read & write GeoParquet/Arrow files"
+        )
+    version = tuple(int(x) for x in pyarrow.__version__.split(".")[:2])
+    if version < PYARROW_MIN_VERSION:
+        raise Exception(
+            "pyarrow >= {0} is needed to read & write GeoParquet/Arrow "
+            "files, but {1} is installed".format(
+                ".".join(str(x) for x in PYARROW_MIN_VERSION),
+                pyarrow.__version__,
+            )
+        )
+
+
+def get_column_types():
+    """
+    Return the arrow types for the columns that we know.
+
+    This way the types are the same in all the batches, even if
+    a batch has no values for a column (like a batch without any
+    transitions).
+    """
+    float_list = pyarrow.list_(pyarrow.float64())
+    int_list = pyarrow.list_(pyarrow.int64())
+    str_list = pyarrow.list_(pyarrow.string())
+    return {
+        "loss_value": pyarrow.float64(),
+        "cum_loss_value": pyarrow.float64(),
+        "expo.Taxonomy": str_list,
+        "expo.Damage": str_list,
+        "expo.Buildings": float_list,
+        "transitions.taxonomy": str_list,
+        "transitions.from_damage_state": int_list,
+        "transitions.to_damage_state": int_list,
+        "transitions.n_buildings": float_list,
+        "transitions.replacement_costs_usd_bdg": float_list,
+    }
+
+
+def to_arrow_array(values, column_type=None):
+    """
+    Create the arrow array for the values of a column.
+
+    If we can't infer a type as there are no values at all,
+    we use strings (or lists of floats for the nested columns).
+    """
+    array = pyarrow.array(values, type=column_type, from_pandas=True)
+    if pyarrow.types.is_null(array.type):
+        array = array.cast(pyarrow.string())
+    elif pyarrow.types.is_list(array.type) and pyarrow.types.is_null(
+        array.type.value_type
+    ):
+        array = array.cast(pyarrow.list_(pyarrow.float64()))
+    return array
+
+
+def to_list(values):
+    """
+    Return the values of a nested column as list.
+
+    Some exposure files have dicts (with the row numbers as keys)
+    instead of lists. We only need the values in their order.
+    """
+    if isinstance(values, dict):
+        return list(values.values())
+    return values
+
+
+def flatten_nested_columns(dataframe):
+    """
+    Return a dict with the columns of the dataframe (without geometry).
+
+    The nested columns are split into one list column per key (in
+    the order in which we see the keys first).
+    """
+    columns = {}
+    geometry_name = dataframe.geometry.name
+    for column in dataframe.columns:
+        if column == geometry_name:
+            continue
+        if column not in NESTED_COLUMNS:
+            columns[column] = dataframe[column]
+            continue
+        dicts = dataframe[column].tolist()
+        keys = dict.fromkeys(key for value in dicts for key in value.keys())
+        for key in keys:
+            columns[column + "." + key] = [
+                to_list(value.get(key)) for value in dicts
+            ]
+    return columns
+
+
+def unflatten_nested_columns(dataframe):
+    """
+    Combine the list columns of the nested columns into dicts again.
+
+    A null value means that the dict of the cell had no such key.
+    """
+    columns = {}
+    nested_columns = {}
+    for column in dataframe.columns:
+        prefix, dot, key = column.partition(".")
+        if dot and prefix in NESTED_COLUMNS:
+            if prefix not in nested_columns:
+                nested_columns[prefix] = []
+                # We keep the position of the column.
+                columns[prefix] = None
+            nested_columns[prefix].append((key, dataframe[column].tolist()))
+        else:
+            columns[column] = dataframe[column]
+    for column, keys_and_values in nested_columns.items():
+        columns[column] = [
+            {
+                key: values[i].tolist()
+                for key, values in keys_and_values
+                if values[i] is not None
+            }
+            for i in range(len(dataframe))
+        ]
+    return pandas.DataFrame(columns, index=dataframe.index)
+
+
+def create_geo_metadata(geometry_name, crs):
+    """Create the GeoParquet metadata for the geometry column."""
+    if crs is not None:
+        crs = pyproj.CRS.from_user_input(crs)
+        if HAS_PROJJSON:
+            crs = crs.to_json_dict()
+        else:
+            # GeoParquet wants PROJJSON, but older pyproj versions
+            # can't write it. The readers (as ours) accept WKT too.
+            crs = crs.to_wkt()
+    return {
+        "version": GEOPARQUET_VERSION,
+        "primary_column": geometry_name,
+        "columns": {
+            geometry_name: {
+                "encoding": "WKB",
+                "geometry_types": [],
+                "crs": crs,
+            }
+        },
+    }
+
+
+def get_crs(column_metadata):
+    """Return the crs of the geometry column."""
+    if "crs" not in column_metadata:
+        # If there is no crs given, it is OGC:CRS84.
+        return geojsonio.DEFAULT_CRS
+    crs = column_metadata["crs"]
+    if crs is None:
+        return None
+    if isinstance(crs, dict):
+        if not HAS_PROJJSON:
+            raise Exception(
+                "pyproj >= 2.4 is needed to read the PROJJSON crs of the file"
+            )
+        return pyproj.CRS.from_json_dict(crs)
+    return pyproj.CRS.from_user_input(crs)
+
+
+def to_wkb(geometries):
+    """Return the WKB of the geometries (None for missing ones)."""
+    if HAS_GEOPANDAS_WKB:
+        return geometries.to_wkb()
+    return [
+        None if geometry is None else shapely.wkb.dumps(geometry)
+        for geometry in geometries
+    ]
+
+
+def from_wkb(values, crs):
+    """Return the geoseries for the WKB values."""
+    if HAS_GEOPANDAS_WKB:
+        return geopandas.GeoSeries.from_wkb(values, crs=crs)
+    return geopandas.GeoSeries(
+        [
+            None if value is None else shapely.wkb.loads(value)
+            for value in values
+        ],
+        index=values.index,
+        crs=crs,
+    )
+
+
+def dataframe_to_table(dataframe):
+    """Convert the geodataframe to an arrow table with WKB geometries."""
+    column_types = get_column_types()
+    arrays = {
+        column: to_arrow_array(values, column_types.get(column))
+        for column, values in flatten_nested_columns(dataframe).items()
+    }
+    arrays["geometry"] = pyarrow.array(
+        to_wkb(dataframe.geometry), type=pyarrow.binary(), from_pandas=True
+    )
+    table = pyarrow.table(arrays)
+    geo_metadata = create_geo_metadata("geometry", dataframe.crs)
+    return table.replace_schema_metadata(
+        {GEO_METADATA_KEY: json.dumps(geo_metadata)}
+    )
+
+
+def get_geo_metadata(schema):
+    """Return the GeoParquet metadata of the schema."""
+    metadata = schema.metadata or {}
+    if GEO_METADATA_KEY not in metadata:
+        raise Exception("The file has no GeoParquet metadata")
+    return json.loads(metadata[GEO_METADATA_KEY])
+
+
+def table_to_dataframe(table, geo_metadata):
+    """
+    Convert the arrow table (or record batch) to a geodataframe.
+
+    The columns are in the same order as with geopandas.read_file
+    (geometry last).
+    """
+    geometry_name = geo_metadata["primary_column"]
+    column_metadata = geo_metadata["columns"][geometry_name]
+    if column_metadata.get("encoding", "WKB") != "WKB":
+        raise Exception(
+            "Geometry encoding {0} is not supported".format(
+                column_metadata["encoding"]
+            )
+        )
+    dataframe = table.to_pandas()
+    geometry = from_wkb(dataframe[geometry_name], crs=get_crs(column_metadata))
+    dataframe = unflatten_nested_columns(
+        dataframe.drop(columns=[geometry_name])
+    )
+    return geopandas.GeoDataFrame(dataframe, geometry=geometry)
+
+
+def read_exposure(filename):
+    """Read the whole exposure from the GeoParquet/Arrow file."""
+    check_pyarrow()
+    if get_file_format(filename) == "parquet":
+        table = pyarrow.parquet.read_table(filename)
+    else:
+        with pyarrow.memory_map(filename) as source:
+            table = pyarrow.ipc.open_file(source).read_all()
+    return table_to_dataframe(table, get_geo_metadata(table.schema))
+
+
+def read_exposure_batches(filename, batch_size):
+    """
+    Read the exposure from the GeoParquet/Arrow file in batches.
+
+    Yields one geodataframe for each batch.
+    """
+    check_pyarrow()
+    if get_file_format(filename) == "parquet":
+        parquet_file = pyarrow.parquet.ParquetFile(filename)
+        geo_metadata = get_geo_metadata(parquet_file.schema_arrow)
+        for batch in parquet_file.iter_batches(batch_size=batch_size):
+            yield table_to_dataframe(batch, geo_metadata)
+    else:
+        with pyarrow.memory_map(filename) as source:
+            reader = pyarrow.ipc.open_file(source)
+            geo_metadata = get_geo_metadata(reader.schema)
+            # The record batches in the file can have any size,
+            # so we split them (without copying the data).
+            for i in range(reader.num_record_batches):
+                record_batch = reader.get_batch(i)
+                for offset in range(0, record_batch.num_rows, batch_size):
+                    yield table_to_dataframe(
+                        record_batch.slice(offset, batch_size), geo_metadata
+                    )
+
+
+class ExposureWriter:
+    """
+    Writes the geodataframes of the batches into one GeoParquet/Arrow file.
+
+    The schema of the file is the one of the first batch, so all
+    the batches must have the same columns.
+    """
+
+    def __init__(self, output_file):
+        check_pyarrow()
+        self.output_file = output_file
+        self._writer = None
+        self._schema = None
+        self._closed = False
+
+    def _open(self, schema):
+        """Open the file for the schema."""
+        self._schema = schema
+        if get_file_format(self.output_file) == "parquet":
+            self._writer = pyarrow.parquet.ParquetWriter(
+                self.output_file, schema
+            )
+        else:
+            self._writer = pyarrow.ipc.new_file(self.output_file, schema)
+
+    def write(self, dataframe):
+        """Append the cells of the dataframe to the file."""
+        table = dataframe_to_table(dataframe)
+        if self._writer is None:
+            self._open(table.schema)
+        elif table.schema != self._schema:
+            try:
+                table = table.cast(self._schema)
+            except (ValueError, pyarrow.ArrowInvalid) as error:
+                raise Exception(
+                    "All the batches must have the same columns "
+                    + "to write them into one file"
+                ) from error
+        self._writer.write_table(table)
+
+    def close(self):
+        """
+        Close the output file.
+
+        If there was no batch at all, we write a file without any cells.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        if self._writer is None:
+            self._open(
+                dataframe_to_table(
+                    geopandas.GeoDataFrame(geometry=[], crs=None)
+                ).schema
+            )
+        self._writer.close()
+
+    def abort(self):
+        """
+        Close the output file & remove it.
+
+        If the run fails halfway, we don't want to leave a valid
+        file with only some of the cells.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        try:
+            if self._writer is not None:
+                self._writer.close()
+        finally:
+            if os.path.exists(self.output_file):
+                os.unlink(self.output_file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
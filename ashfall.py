@@ -40,9 +40,12 @@ class Ashfall:
         gdf = geopandas.read_file(filename)
         return cls(gdf=gdf, column=column, name=name, unit=unit)
 
-    def to_intensity_provider(self):
+    def to_intensity_provider(self, workers=1):
         """
         Creates the intensity provider.
+
+        The workers are used for the batch queries
+        (-1 for all the cpus).
         """
         intensity_data_wrapper = (
             intensitydatawrapper.GeopandasDataFrameWrapperWithColumnUnit(
@@ -54,4 +57,5 @@ class Ashfall:
         )
         return intensityprovider.IntensityProvider(
             intensity_data_wrapper,
+            workers=workers,
         )
@@ -26,247 +26,506 @@ import numpy
 import pandas
 import shapely
 
+import exposuretable
+
+
+def dx_to_int(ds):
+    """Transform a D3 to 3."""
+    return int(ds[1:])
 
-class CustomColumnGenerator:
-    """
-    Generator for custom columns.
 
-    Shapefile column names are very limited so we create c1, c2, ...
-    and provide information to store the "real" names of those
-    columns somewhere else.
+def to_python_number(value):
     """
+    Convert the numpy scalars for json.dumps.
 
-    def __init__(self, prefix):
-        """Init the generator with a prefix."""
-        self.prefix = prefix
-        self.count = 1
-        self.custom_column_names = {}
-        self.custom_cols = {}
+    numpy.float64 is a python float already, but the numpy ints
+    (and float32) are not.
+    """
+    if isinstance(value, numpy.generic):
+        return value.item()
+    raise TypeError("{0} is not a number".format(repr(value)))
 
-    def set_value_for_custom_column(self, long_name, id, value):
-        """
-        Set the value for a custom column.
 
-        We use the id as mabye not all the rows have an entry
-        for the specific custom column.
-        """
-        if long_name in self.custom_column_names.keys():
-            col_name = self.custom_column_names[long_name]
-        else:
-            col_name = self._create_new_col()
-            self.custom_column_names[long_name] = col_name
-        self.custom_cols.setdefault(col_name, {})
-        self.custom_cols[col_name][id] = value
-
-    def _create_new_col(self):
-        """Generate a new column name and increase the counter."""
-        col_name = f"{self.prefix}{self.count}"
-        self.count += 1
-        return col_name
-
-    def full_columns(self, id_array):
-        """Return a dict with full lists for all the custom columns."""
-        results = {}
-        for col_name, value_dict_by_id in self.custom_cols.items():
-            results[col_name] = []
-            for id in id_array:
-                results[col_name].append(self.custom_cols[col_name].get(id))
-        return results
-
-    def get_custom_column_mapping(self):
-        """Return the mapping of the long names to the custom names."""
-        return {v: k for k, v in self.custom_column_names.items()}
-
-
-def compute_mean_transition(transitions_dict):
+def to_json_numbers(values):
     """
-    Compute the mean transitions.
+    Return the json text for each of the numbers.
 
-    Pseudo-code was provided by Michael Langbein (DLR).
+    A single json.dumps call for all of them is a lot faster
+    than one call per number (and numbers don't contain ",").
+    The ints stay ints, so we get the same text as with json.dumps
+    for the single numbers.
     """
-    n_buildings = numpy.array(transitions_dict["n_buildings"])
-    from_damage_state = numpy.array(transitions_dict["from_damage_state"])
-    to_damage_state = numpy.array(transitions_dict["to_damage_state"])
-    if len(n_buildings) == 0:
-        return 0
+    if len(values) == 0:
+        return numpy.array([], dtype=object)
+    if isinstance(values, numpy.ndarray):
+        values = values.tolist()
+    text = json.dumps(values, separators=(",", ":"), default=to_python_number)
+    return numpy.array(text[1:-1].split(","), dtype=object)
 
-    mean_damage_state_diff = (
-        n_buildings * to_damage_state - n_buildings * from_damage_state
-    ).mean()
-    return mean_damage_state_diff
 
+def to_json_dicts(group_ids, n_groups, keys, values):
+    """
+    Return the json text of one dict for each group.
 
-def dx_to_int(ds):
-    """Transform a D3 to 3."""
-    return int(ds[1:])
+    The int keys & the values are given per entry. The entries of
+    a group must be in the order that we want for the dict.
+    We build the text ourselves, as calling json.dumps for
+    every dict is too slow. The format is the same.
+    """
+    unique_keys, key_codes = numpy.unique(keys, return_inverse=True)
+    key_texts = numpy.array(
+        ['"' + str(key) + '": ' for key in unique_keys.tolist()],
+        dtype=object,
+    )
+    items = key_texts[key_codes] + to_json_numbers(values)
+    order = numpy.argsort(group_ids, kind="stable")
+    boundaries = numpy.searchsorted(
+        group_ids[order], numpy.arange(n_groups + 1)
+    ).tolist()
+    sorted_items = items[order].tolist()
+    return [
+        "{" + ", ".join(sorted_items[start:end]) + "}"
+        for start, end in zip(boundaries[:-1], boundaries[1:])
+    ]
+
+
+def last_rows_of_groups(group_ids, n_groups):
+    """Return the index of the last row for each group."""
+    last_rows = numpy.zeros(n_groups, dtype=numpy.int64)
+    last_rows[group_ids] = numpy.arange(len(group_ids))
+    return last_rows
+
+
+def sums_by_cell(cells, n_cells, values):
+    """Sum the values of each cell."""
+    # Without any values bincount would give us ints.
+    return numpy.bincount(cells, weights=values, minlength=n_cells).astype(
+        numpy.float64
+    )
 
 
-def compute_weighted_damage(expo_dict):
+class Summary:
     """
-    Compute the weighted damage.
+    Summary of the updated exposure for the visualization.
 
-    Pseudo-code was provided by Michael Langbein (DLR).
+    We collect the transitions and the expo data of the features
+    in flat lists. Those are reduced with grouped array operations
+    to the columns of the cells & running totals for the meta summary
+    (for every dataframe that we add & at the end). This way we don't
+    need to keep all the transitions & expo data of a batched run.
     """
-    buildings = numpy.array(expo_dict["Buildings"])
-    damage_raw = [dx_to_int(x) for x in expo_dict["Damage"]]
-    damage = numpy.array(damage_raw)
-    buildings_sum = buildings.sum()
-    if buildings_sum != 0:
-        weighted_damage = (buildings * damage).sum() / buildings.sum()
-    else:
-        weighted_damage = 0
-    return weighted_damage
 
+    def __init__(self):
+        self.ids = []
+        self.geometries = []
+        # The loss value is one of the main components for the
+        # visualization. The cum loss value is the one aggregated over
+        # multiple runs.
+        self.loss_values = []
+        self.cum_loss_values = []
+        self.loss_unit = None
+        self.cum_loss_unit = None
+
+        # The entries of the cells that we didn't reduce yet.
+        # The cells are counted from the first of those cells.
+        self._n_reduced_cells = 0
+
+        # One entry per transition.
+        self.transition_cells = []
+        self.transition_from_damage_states = []
+        self.transition_to_damage_states = []
+        self.transition_n_buildings = []
+
+        # One entry per taxonomy & damage state in the expo.
+        self.expo_cells = []
+        self.expo_taxonomies = []
+        self.expo_damages = []
+        self.expo_buildings = []
+
+        # The columns of the cells that we reduced already.
+        self.n_buildings = []
+        self.mean_transitions = []
+        self.weighted_damages = []
+        # One entry per value for the custom columns
+        # (as cell, is_taxonomy, long name & json text).
+        self.custom_entries = []
+
+        # The running totals for the meta summary.
+        self.total_transition_matrix = {}
+        self.total_buildings_by_damage_state = {}
+
+        # The computed columns & meta summary (until we add more).
+        self._result = None
+
+    def add_feature(self, properties, geometry):
+        """Add the properties & the (shapely) geometry of a feature."""
+        self._result = None
+        cell = len(self.ids) - self._n_reduced_cells
+        self.ids.append(properties["gid"])
+        self.geometries.append(geometry)
+
+        self.loss_values.append(properties["loss_value"])
+        self.cum_loss_values.append(properties["cum_loss_value"])
+
+        if self.loss_unit is None and properties["loss_unit"]:
+            self.loss_unit = properties["loss_unit"]
+
+        if self.cum_loss_unit is None and properties["cum_loss_unit"]:
+            self.cum_loss_unit = properties["cum_loss_unit"]
 
-def main():
-    """Run the main function to create a shapefile."""
-    if len(sys.argv) < 2:
-        print(
-            "Usage python3 create_shapefile.py <jsonfile>",
-            file=sys.stderr,
+        transitions_dict = properties["transitions"]
+        n_buildings = transitions_dict["n_buildings"]
+        self.transition_cells.extend([cell] * len(n_buildings))
+        self.transition_from_damage_states.extend(
+            transitions_dict["from_damage_state"]
         )
-        exit(1)
-    filename_json_in = sys.argv[1]
+        self.transition_to_damage_states.extend(
+            transitions_dict["to_damage_state"]
+        )
+        self.transition_n_buildings.extend(n_buildings)
 
-    with open(filename_json_in) as infile:
-        data_in = json.load(infile)
+        expo_dict = properties["expo"]
+        buildings = expo_dict["Buildings"]
+        self.expo_cells.extend([cell] * len(buildings))
+        self.expo_taxonomies.extend(expo_dict["Taxonomy"])
+        self.expo_damages.extend(expo_dict["Damage"])
+        self.expo_buildings.extend(buildings)
 
-    ids = []
-    geometries = []
-    # The loss value is one of the main components for the visualization.
-    # The cum loss value is the one aggregated over multiple runs.
-    loss_values = []
-    cum_loss_values = []
-    # Another column for the visualization is the mean transiton value
-    mean_transitions = []
-    # And the weighted damage
-    weighted_damages = []
-    n_buildings = []
-
-    loss_unit = None
-    cum_loss_unit = None
-    total = {
-        "loss_value": 0,
-        "cum_loss": 0,
-        "transition_matrix_from_damage_state": {},
-        "buildings_by_damage_state": {},
-    }
-    custom_cols = CustomColumnGenerator(prefix="c")
+    def add_dataframe(self, dataframe):
+        """
+        Add all the cells of the updated exposure dataframe.
 
-    for feature in data_in["features"]:
-        properties = feature["properties"]
-        gid = properties["gid"]
-        ids.append(gid)
+        This way we don't need to read the merged output again.
+        """
+        columns = [c for c in dataframe.columns if c != "geometry"]
+        for properties, geometry in zip(
+            dataframe[columns].to_dict("records"),
+            dataframe.geometry.tolist(),
+        ):
+            self.add_feature(properties, geometry)
+        self._reduce()
 
-        json_geometry = feature["geometry"]
-        geometry = shapely.geometry.shape(json_geometry)
-        geometries.append(geometry)
+    def compute(self):
+        """
+        Compute the columns for the shapefile & the meta summary.
 
-        loss_values.append(properties["loss_value"])
-        total["loss_value"] += properties["loss_value"]
-        cum_loss_values.append(properties["cum_loss_value"])
-        total["cum_loss"] += properties["cum_loss_value"]
+        Returns a dict with the columns (without the geometry)
+        and the dict for the meta_summary.json.
+        """
+        if self._result is None:
+            self._result = self._compute()
+        return self._result
+
+    def _compute(self):
+        """Compute the columns & the meta summary for all the cells."""
+        self._reduce()
+
+        custom_columns, custom_column_mapping = self._custom_columns(
+            cells=[entry[0] for entry in self.custom_entries],
+            is_taxonomy=[entry[1] for entry in self.custom_entries],
+            names=[entry[2] for entry in self.custom_entries],
+            texts=[entry[3] for entry in self.custom_entries],
+        )
 
-        if loss_unit is None and properties["loss_unit"]:
-            loss_unit = properties["loss_unit"]
+        total = {
+            "loss_value": sum(self.loss_values),
+            "cum_loss": sum(self.cum_loss_values),
+            "transition_matrix_from_damage_state": (
+                self.total_transition_matrix
+            ),
+            "buildings_by_damage_state": self.total_buildings_by_damage_state,
+        }
+        columns = {
+            "id": self.ids,
+            "loss_value": self.loss_values,
+            "cum_loss": self.cum_loss_values,
+            "buildings": self.n_buildings,
+            "m_tran": self.mean_transitions,
+            "w_damage": self.weighted_damages,
+            **custom_columns,
+        }
+        meta_summary = {
+            "custom_columns": custom_column_mapping,
+            "loss_unit": self.loss_unit,
+            "total": total,
+            "cum_loss_unit": self.cum_loss_unit,
+        }
+        return columns, meta_summary
 
-        if cum_loss_unit is None and properties["cum_loss_unit"]:
-            cum_loss_unit = properties["cum_loss_unit"]
+    def _reduce(self):
+        """
+        Reduce the entries of the cells that we added since the last
+        call to the columns of those cells & add them to the totals.
+        """
+        first_cell = self._n_reduced_cells
+        n_cells = len(self.ids) - first_cell
+        if n_cells == 0:
+            return
+
+        # Transitions
+        t_cells = numpy.array(self.transition_cells, dtype=numpy.int64)
+        t_from = numpy.array(
+            self.transition_from_damage_states, dtype=numpy.int64
+        )
+        t_to = numpy.array(self.transition_to_damage_states, dtype=numpy.int64)
+        t_n = numpy.array(self.transition_n_buildings, dtype=numpy.float64)
+
+        # The mean transitions (pseudo-code was provided by
+        # Michael Langbein (DLR)) as mean of
+        # n_buildings * to_damage_state - n_buildings * from_damage_state.
+        n_transitions = numpy.bincount(t_cells, minlength=n_cells)
+        transition_sums = sums_by_cell(
+            t_cells, n_cells, t_n * t_to - t_n * t_from
+        )
+        mean_transitions = transition_sums / numpy.maximum(n_transitions, 1)
 
-        transitions_dict = properties["transitions"]
-        expo_dict = properties["expo"]
-        mean_transitions.append(compute_mean_transition(transitions_dict))
-        weighted_damages.append(compute_weighted_damage(expo_dict))
-        # Next is to create transition matrix
-        transition_matrix = {}
+        # The transition matrix per cell & for all cells.
+        group_ids, n_groups = exposuretable.group_by_first_appearance(
+            t_cells, t_from, t_to
+        )
+        first_rows = exposuretable.first_rows_of_groups(group_ids, n_groups)
+        transitions_per_group = exposuretable.sum_by_group(
+            group_ids, n_groups, t_n
+        )
+        matrix_ids, n_matrices = exposuretable.group_by_first_appearance(
+            t_cells[first_rows], t_from[first_rows]
+        )
+        first_groups = exposuretable.first_rows_of_groups(
+            matrix_ids, n_matrices
+        )
+        matrix_texts = to_json_dicts(
+            matrix_ids,
+            n_matrices,
+            t_to[first_rows],
+            transitions_per_group.tolist(),
+        )
+        matrix_cells = t_cells[first_rows][first_groups]
+        matrix_names = [
+            f"Transitions from damage state {from_ds}"
+            for from_ds in t_from[first_rows][first_groups].tolist()
+        ]
+
+        total_ids, n_totals = exposuretable.group_by_first_appearance(
+            t_from, t_to
+        )
+        first_total_rows = exposuretable.first_rows_of_groups(
+            total_ids, n_totals
+        )
         for from_ds, to_ds, n in zip(
-            transitions_dict["from_damage_state"],
-            transitions_dict["to_damage_state"],
-            transitions_dict["n_buildings"],
+            t_from[first_total_rows].tolist(),
+            t_to[first_total_rows].tolist(),
+            exposuretable.sum_by_group(total_ids, n_totals, t_n).tolist(),
+        ):
+            matrix_row = self.total_transition_matrix.setdefault(from_ds, {})
+            matrix_row[to_ds] = matrix_row.get(to_ds, 0.0) + n
+
+        # Expo data
+        e_cells = numpy.array(self.expo_cells, dtype=numpy.int64)
+        taxonomy_codes, taxonomies = pandas.factorize(
+            pandas.Series(self.expo_taxonomies, dtype=object)
+        )
+        damage_codes, damage_names = pandas.factorize(
+            pandas.Series(self.expo_damages, dtype=object)
+        )
+        e_damage = numpy.array(
+            [dx_to_int(ds) for ds in damage_names], dtype=numpy.int64
+        )[damage_codes]
+        e_buildings = numpy.array(self.expo_buildings, dtype=numpy.float64)
+
+        # The weighted damage (pseudo-code was provided by
+        # Michael Langbein (DLR)).
+        buildings_sums = sums_by_cell(e_cells, n_cells, e_buildings)
+        damage_sums = sums_by_cell(e_cells, n_cells, e_buildings * e_damage)
+        has_buildings = buildings_sums != 0
+        weighted_damages = numpy.where(
+            has_buildings,
+            damage_sums / numpy.where(has_buildings, buildings_sums, 1.0),
+            0.0,
+        )
+
+        # The buildings per taxonomy & damage state. If a cell has the
+        # same taxonomy & damage state twice, the last one wins.
+        group_ids, n_groups = exposuretable.group_by_first_appearance(
+            e_cells, taxonomy_codes, e_damage
+        )
+        first_rows = exposuretable.first_rows_of_groups(group_ids, n_groups)
+        last_rows = last_rows_of_groups(group_ids, n_groups)
+        taxonomy_ids, n_taxonomies = exposuretable.group_by_first_appearance(
+            e_cells[first_rows], taxonomy_codes[first_rows]
+        )
+        first_groups = exposuretable.first_rows_of_groups(
+            taxonomy_ids, n_taxonomies
+        )
+        taxonomy_texts = to_json_dicts(
+            taxonomy_ids,
+            n_taxonomies,
+            e_damage[first_rows],
+            [self.expo_buildings[row] for row in last_rows.tolist()],
+        )
+        taxonomy_cells = e_cells[first_rows][first_groups]
+        names_by_taxonomy = numpy.array(
+            [
+                f"Buildings in {taxonomy} per damage state"
+                for taxonomy in taxonomies
+            ],
+            dtype=object,
+        )
+        taxonomy_names = names_by_taxonomy[
+            taxonomy_codes[first_rows][first_groups]
+        ].tolist()
+        buildings_per_taxonomy = exposuretable.sum_by_group(
+            taxonomy_ids, n_taxonomies, e_buildings[last_rows]
+        )
+        n_buildings = sums_by_cell(
+            taxonomy_cells, n_cells, buildings_per_taxonomy
+        )
+
+        total_ids, n_totals = exposuretable.group_by_first_appearance(e_damage)
+        first_total_rows = exposuretable.first_rows_of_groups(
+            total_ids, n_totals
+        )
+        for damage_state, buildings in zip(
+            e_damage[first_total_rows].tolist(),
+            exposuretable.sum_by_group(
+                total_ids, n_totals, e_buildings
+            ).tolist(),
         ):
-            transition_matrix.setdefault(from_ds, {})
-            transition_matrix[from_ds].setdefault(to_ds, 0)
-            transition_matrix[from_ds][to_ds] += n
-            # And also the same for the total transitions
-            total["transition_matrix_from_damage_state"].setdefault(
-                from_ds, {}
+            self.total_buildings_by_damage_state[damage_state] = (
+                self.total_buildings_by_damage_state.get(damage_state, 0.0)
+                + buildings
             )
-            total["transition_matrix_from_damage_state"][from_ds].setdefault(
-                to_ds, 0
+
+        self.n_buildings.extend(n_buildings.tolist())
+        self.mean_transitions.extend(mean_transitions.tolist())
+        self.weighted_damages.extend(weighted_damages.tolist())
+        self.custom_entries.extend(
+            zip(
+                (matrix_cells + first_cell).tolist(),
+                [0] * n_matrices,
+                matrix_names,
+                matrix_texts,
             )
-            total["transition_matrix_from_damage_state"][from_ds][to_ds] += n
-
-        for k, v in transition_matrix.items():
-            custom_col_long_name = f"Transitions from damage state {k}"
-            custom_col_value = json.dumps(v)
-            custom_cols.set_value_for_custom_column(
-                long_name=custom_col_long_name,
-                id=gid,
-                value=custom_col_value,
+        )
+        self.custom_entries.extend(
+            zip(
+                (taxonomy_cells + first_cell).tolist(),
+                [1] * n_taxonomies,
+                taxonomy_names,
+                taxonomy_texts,
             )
+        )
 
-        # After that we want to store the buildings per tax & damage state
-        buildings_by_tax_and_ds = {}
-        for taxonomy, damage, number in zip(
-            expo_dict["Taxonomy"],
-            expo_dict["Damage"],
-            expo_dict["Buildings"],
-        ):
-            damage = dx_to_int(damage)
-            buildings_by_tax_and_ds.setdefault(taxonomy, {})
-            buildings_by_tax_and_ds[taxonomy].setdefault(damage, {})
-            buildings_by_tax_and_ds[taxonomy][damage] = number
-            # And update the total
-            total["buildings_by_damage_state"].setdefault(damage, 0)
-            total["buildings_by_damage_state"][damage] += number
-        for (
-            taxonomy,
-            buildings_by_ds,
-        ) in buildings_by_tax_and_ds.items():
-            custom_col_long_name = f"Buildings in {taxonomy} per damage state"
-            custom_col_value = json.dumps(buildings_by_ds)
-            custom_cols.set_value_for_custom_column(
-                long_name=custom_col_long_name,
-                id=gid,
-                value=custom_col_value,
+        # And we don't need the entries anymore.
+        self._n_reduced_cells = len(self.ids)
+        for entries in [
+            self.transition_cells,
+            self.transition_from_damage_states,
+            self.transition_to_damage_states,
+            self.transition_n_buildings,
+            self.expo_cells,
+            self.expo_taxonomies,
+            self.expo_damages,
+            self.expo_buildings,
+        ]:
+            entries.clear()
+
+    def _custom_columns(self, cells, is_taxonomy, names, texts):
+        """
+        Create the custom columns c1, c2, ...
+
+        Shapefile column names are very limited, so we number them
+        in the order in which we see the long names first (cell by
+        cell, the transitions before the taxonomies).
+        Returns the columns & the mapping of the custom names
+        to the long names.
+        """
+        # The entries are already in the right order within the
+        # cells & the kind of the entry.
+        order = numpy.lexsort(
+            (numpy.arange(len(cells)), is_taxonomy, cells)
+        ).tolist()
+        codes, long_names = pandas.factorize(
+            pandas.Series([names[i] for i in order], dtype=object)
+        )
+        texts = numpy.array([texts[i] for i in order] + [None], dtype=object)
+        # The values are stored by the id of the cell, so that the
+        # last value wins for duplicated ids.
+        id_codes, unique_ids = pandas.factorize(
+            pandas.Series(self.ids, dtype=object)
+        )
+        entry_id_codes = id_codes[numpy.array(cells, dtype=numpy.int64)[order]]
+        values = numpy.full(
+            (len(long_names), len(unique_ids)), len(order), dtype=numpy.int64
+        )
+        values[codes, entry_id_codes] = numpy.arange(len(order))
+
+        custom_columns = {}
+        custom_column_mapping = {}
+        for index, long_name in enumerate(long_names):
+            col_name = f"c{index + 1}"
+            custom_columns[col_name] = texts[values[index][id_codes]].tolist()
+            custom_column_mapping[col_name] = long_name
+        return custom_columns, custom_column_mapping
+
+    def to_geodataframe(self):
+        """Return the geodataframe for the shapefile."""
+        columns, _ = self.compute()
+        return self._to_geodataframe(columns)
+
+    def _to_geodataframe(self, columns):
+        """Create the geodataframe with the computed columns."""
+        gdf = geopandas.GeoDataFrame(
+            pandas.DataFrame(columns), geometry=self.geometries
+        )
+        gdf.crs = {"init": "EPSG:4326"}
+        return gdf
+
+    def get_meta_summary(self):
+        """Return the data for the meta_summary.json."""
+        _, meta_summary = self.compute()
+        return meta_summary
+
+    def write(self, directory):
+        """Write the summary.shp & the meta_summary.json."""
+        columns, meta_summary = self.compute()
+        gdf = self._to_geodataframe(columns)
+
+        for ending in ["shp", "cpg", "dbf", "prj", "shx"]:
+            filename = os.path.join(directory, "summary." + ending)
+            if os.path.exists(filename):
+                os.unlink(filename)
+
+        gdf.to_file(os.path.join(directory, "summary.shp"))
+
+        with open(
+            os.path.join(directory, "meta_summary.json"), "w"
+        ) as outfile:
+            json.dump(
+                meta_summary,
+                outfile,
+                separators=(",", ":"),
             )
-        buildings = sum(
-            [sum(inner.values()) for inner in buildings_by_tax_and_ds.values()]
+
+
+def main():
+    """Run the main function to create a shapefile."""
+    if len(sys.argv) < 2:
+        print(
+            "Usage python3 create_shapefile.py <jsonfile>",
+            file=sys.stderr,
         )
-        n_buildings.append(buildings)
-
-    df = pandas.DataFrame(
-        {
-            "id": ids,
-            "loss_value": loss_values,
-            "cum_loss": cum_loss_values,
-            "buildings": n_buildings,
-            "m_tran": mean_transitions,
-            "w_damage": weighted_damages,
-            **custom_cols.full_columns(ids),
-        }
-    )
-    gdf = geopandas.GeoDataFrame(df, geometry=geometries)
-    gdf.crs = {"init": "EPSG:4326"}
-
-    for ending in ["shp", "cpg", "dbf", "prj", "shx"]:
-        filename = "summary." + ending
-        if os.path.exists(filename):
-            os.unlink(filename)
-
-    gdf.to_file("summary.shp")
-
-    with open("meta_summary.json", "w") as outfile:
-        json.dump(
-            {
-                "custom_columns": custom_cols.get_custom_column_mapping(),
-                "loss_unit": loss_unit,
-                "total": total,
-                "cum_loss_unit": cum_loss_unit,
-            },
-            outfile,
-            separators=(",", ":"),
+        exit(1)
+    filename_json_in = sys.argv[1]
+
+    with open(filename_json_in) as infile:
+        data_in = json.load(infile)
+
+    summary = Summary()
+    for feature in data_in["features"]:
+        summary.add_feature(
+            feature["properties"], shapely.geometry.shape(feature["geometry"])
         )
+    summary.write(".")
 
 
 if __name__ == "__main__":
@@ -21,17 +21,38 @@ Please use -h for usage.
 """
 
 import argparse
-import glob
 import os
 
-import fragility
-import gpdexposure
+import executors
 import intensityprovider
-import loss
 import shakemap
 import tellus
 
 
+def create_loss_provider():
+    """Create the loss provider with the local loss data (in USD)."""
+    current_dir = os.path.dirname(os.path.realpath(__file__))
+    return tellus.create_loss_provider(current_dir)
+
+
+def create_intensity_provider(intensity_file, workers=1):
+    """Create the intensity provider for the shakemap file."""
+    intensity_provider = shakemap.Shakemaps.from_file(
+        intensity_file
+    ).to_intensity_provider(workers=workers)
+    # add aliases
+    # ID for inundation (out of the maximum wave height)
+    # SA_01 and SA_03 out of the PGA
+    return intensityprovider.AliasIntensityProvider(
+        intensity_provider,
+        aliases={
+            "SA_01": ["PGA"],
+            "SA_03": ["PGA"],
+            "ID": ["MWH", "INUN_MEAN_POLY"],
+        },
+    )
+
+
 def main():
     """
     Runs the main method, which reads from
@@ -47,7 +68,11 @@ def main():
         "intensity_file",
         help="File with hazard intensities, for example a shakemap",
     )
-    argparser.add_argument("exposure_file", help="File with the exposure data")
+    argparser.add_argument(
+        "exposure_file",
+        help="File with the exposure data (GeoJSON, or GeoParquet/Arrow "
+        + "for .parquet/.arrow files)",
+    )
     argparser.add_argument(
         "exposure_schema",
         help="The actual schema for the exposure data",
@@ -58,35 +83,22 @@ def main():
     argparser.add_argument(
         "--merged_output_file",
         default="output_merged.json",
-        help="Filename for the merged output from all others",
+        help="Filename for the merged output from all others "
+        + "(GeoParquet/Arrow for .parquet/.arrow files, GeoJSON otherwise)",
     )
-    current_dir = os.path.dirname(os.path.realpath(__file__))
-    loss_data_dir = os.path.join(current_dir, "loss_data")
-    files = glob.glob(os.path.join(loss_data_dir, "*.json"))
-
-    loss_provider = loss.LossProvider.from_files(files, "USD")
+    tellus.add_common_arguments(argparser)
+    loss_provider = create_loss_provider()
 
     args = argparser.parse_args()
 
-    intensity_provider = shakemap.Shakemaps.from_file(
-        args.intensity_file
-    ).to_intensity_provider()
-    # add aliases
-    # ID for inundation (out of the maximum wave height)
-    # SA_01 and SA_03 out of the PGA
-    intensity_provider = intensityprovider.AliasIntensityProvider(
-        intensity_provider,
-        aliases={
-            "SA_01": ["PGA"],
-            "SA_03": ["PGA"],
-            "ID": ["MWH", "INUN_MEAN_POLY"],
-        },
+    intensity_provider = create_intensity_provider(
+        args.intensity_file, workers=tellus.get_query_workers(args)
+    )
+    fragility_provider = tellus.create_fragility_provider(
+        args.fragilty_file, args
     )
-    fragility_provider = fragility.Fragility.from_file(
-        args.fragilty_file
-    ).to_fragility_provider()
 
-    old_exposure = gpdexposure.read_exposure(args.exposure_file)
+    old_exposure, exposure_batches = tellus.read_exposure_for_args(args)
 
     worker = tellus.Child(
         intensity_provider,
@@ -95,6 +107,13 @@ def main():
         args.exposure_schema,
         loss_provider,
         args,
+        engine=args.engine,
+        damage_epsilon=args.damage_epsilon,
+        pruning_epsilon=args.pruning_epsilon,
+        executor=executors.create_executor(args.executor, args.workers),
+        exposure_batches=exposure_batches,
+        summary_directory=args.summary_directory,
+        mapping_cache=args.mapping_cache,
     )
     worker.run()
 
@@ -0,0 +1,271 @@
+#!/usr/bin/env python3
+
+# Copyright © 2021-2022 Helmholtz Centre Potsdam GFZ German Research Centre for
+# Geosciences, Potsdam, Germany
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+"""
+Runs a chain of hazards (earthquake -> tsunami -> ...) in one process.
+
+Otherwise we would run deus and then neptunus (or deus again) on the
+merged output, and we would write & read the exposure in every step.
+Here we keep the updated exposure in memory for the next stage.
+
+The stages are given in a json file with a list like this:
+
+    [
+        {
+            "name": "earthquake",
+            "hazard": "shakemap",
+            "intensity_file": "shakemap.xml",
+            "fragility_file": "fragility_sara.json"
+        },
+        {
+            "name": "tsunami",
+            "hazard": "raster",
+            "intensity_file": "tsunami.tiff",
+            "intensity_name": "MWH",
+            "intensity_unit": "m",
+            "fragility_file": "fragility_suppasri.json"
+        }
+    ]
+
+The hazards are shakemap (as for deus), raster (as for neptunus)
+and ashfall (as for volcanus, with an intensity_column).
+Relative paths are relative to the stages file.
+
+Please use -h for usage.
+"""
+
+import argparse
+import json
+import os
+
+import create_shapefile
+import deus
+import executors
+import fragility
+import gpdexposure
+import neptunus
+import tellus
+import volcanus
+
+
+def create_shakemap_intensity_provider(stage, workers=1):
+    """Create the intensity provider for a shakemap stage."""
+    return deus.create_intensity_provider(
+        stage["intensity_file"], workers=workers
+    )
+
+
+def create_raster_intensity_provider(stage, workers=1):
+    """
+    Create the intensity provider for a raster stage.
+
+    The raster is read by pixel index, so there are no
+    queries that could use the workers.
+    """
+    return neptunus.create_intensity_provider(
+        stage["intensity_file"],
+        stage["intensity_name"],
+        stage["intensity_unit"],
+    )
+
+
+def create_ashfall_intensity_provider(stage, workers=1):
+    """Create the intensity provider for an ashfall stage."""
+    return volcanus.create_intensity_provider(
+        stage["intensity_file"], stage["intensity_column"], workers=workers
+    )
+
+
+INTENSITY_PROVIDER_FACTORIES = {
+    "shakemap": create_shakemap_intensity_provider,
+    "raster": create_raster_intensity_provider,
+    "ashfall": create_ashfall_intensity_provider,
+}
+
+
+def read_stages(stages_file):
+    """
+    Read the list of stages from the json file.
+
+    The file paths are made relative to the directory of the file.
+    Stages without a name get the name of their intensity file.
+    """
+    with open(stages_file) as infile:
+        stages = json.load(infile)
+    base_dir = os.path.dirname(os.path.abspath(stages_file))
+    for stage in stages:
+        hazard = stage.get("hazard", "shakemap")
+        if hazard not in INTENSITY_PROVIDER_FACTORIES.keys():
+            raise Exception("Hazard {0} is not supported".format(hazard))
+        stage["hazard"] = hazard
+        for key in ["intensity_file", "fragility_file"]:
+            stage[key] = os.path.join(base_dir, stage[key])
+        if "name" not in stage:
+            stage["name"] = os.path.splitext(
+                os.path.basename(stage["intensity_file"])
+            )[0]
+    return stages
+
+
+def run_chain(
+    exposure,
+    exposure_schema,
+    stages,
+    schema_mapper,
+    loss_provider,
+    engine="columnar",
+    damage_epsilon=0.0,
+    executor=None,
+    pruning_epsilon=0.0,
+    query_workers=1,
+    fragility_options=None,
+):
+    """
+    Run the update of the exposure for all the stages.
+
+    The result of each stage is the exposure of the next one (with
+    the schema of the fragility functions of the stage). The loss of a
+    stage is the loss_value, the cum_loss_value is the sum over this
+    and all the earlier stages.
+    The query_workers are used for the batch queries of the intensity
+    providers, the fragility_options are given to
+    Fragility.to_fragility_provider (see tellus.get_fragility_options).
+    Yields the stage, the fragility provider & the updated exposure
+    after each stage.
+    """
+    if fragility_options is None:
+        fragility_options = {}
+    for stage in stages:
+        intensity_provider = INTENSITY_PROVIDER_FACTORIES[stage["hazard"]](
+            stage, workers=query_workers
+        )
+        fragility_provider = fragility.Fragility.from_file(
+            stage["fragility_file"]
+        ).to_fragility_provider(**fragility_options)
+        exposure = gpdexposure.update_exposure_transitions_and_losses(
+            exposure,
+            exposure_schema,
+            schema_mapper,
+            intensity_provider,
+            fragility_provider,
+            loss_provider,
+            engine=engine,
+            damage_epsilon=damage_epsilon,
+            executor=executor,
+            pruning_epsilon=pruning_epsilon,
+        )
+        exposure_schema = fragility_provider.schema
+        yield stage, fragility_provider, exposure
+
+
+def main():
+    """
+    Runs all the stages & writes the outputs of the stages and
+    the final updated exposure.
+    """
+    argparser = argparse.ArgumentParser(
+        description="Updates the exposure model and the damage "
+        + "classes of the Buildings for a chain of hazards"
+    )
+    argparser.add_argument(
+        "exposure_file",
+        help="File with the exposure data (GeoJSON, or GeoParquet/Arrow "
+        + "for .parquet/.arrow files)",
+    )
+    argparser.add_argument(
+        "exposure_schema",
+        help="The actual schema for the exposure data",
+    )
+    argparser.add_argument(
+        "stages_file",
+        help="Json file with the list of the stages (see the docstring "
+        + "of deus_chain.py)",
+    )
+    argparser.add_argument(
+        "--merged_output_file",
+        default="output_merged.json",
+        help="Filename for the exposure after the last stage "
+        + "(GeoParquet/Arrow for .parquet/.arrow files, GeoJSON otherwise)",
+    )
+    argparser.add_argument(
+        "--stage_output_directory",
+        default=None,
+        help="If given, write the updated exposure after each stage "
+        + "into this directory (<number>_<name of the stage>.json)",
+    )
+    tellus.add_common_arguments(argparser, single_run=False)
+    argparser.add_argument(
+        "--summary_directory",
+        default=None,
+        help="If given, write the summary.shp & the meta_summary.json "
+        + "for the exposure after the last stage into this directory",
+    )
+    args = argparser.parse_args()
+
+    stages = read_stages(args.stages_file)
+    if not stages:
+        raise Exception("There must be at least one stage")
+
+    current_dir = os.path.dirname(os.path.realpath(__file__))
+    schema_mapper = tellus.create_schema_mapper(current_dir)
+    loss_provider = deus.create_loss_provider()
+    exposure = gpdexposure.read_exposure(args.exposure_file)
+
+    if args.stage_output_directory is not None:
+        if not os.path.exists(args.stage_output_directory):
+            os.makedirs(args.stage_output_directory)
+
+    for number, (stage, fragility_provider, exposure) in enumerate(
+        run_chain(
+            exposure,
+            args.exposure_schema,
+            stages,
+            schema_mapper,
+            loss_provider,
+            engine=args.engine,
+            damage_epsilon=args.damage_epsilon,
+            pruning_epsilon=args.pruning_epsilon,
+            executor=executors.create_executor(args.executor, args.workers),
+            query_workers=tellus.get_query_workers(args),
+            fragility_options=tellus.get_fragility_options(args),
+        ),
+        start=1,
+    ):
+        tellus.print_cache_statistics(
+            fragility_provider, prefix="{0}: ".format(stage["name"])
+        )
+        if args.stage_output_directory is not None:
+            tellus.write_result(
+                os.path.join(
+                    args.stage_output_directory,
+                    "{0}_{1}.json".format(number, stage["name"]),
+                ),
+                exposure,
+            )
+
+    tellus.write_result(args.merged_output_file, exposure)
+
+    if args.summary_directory is not None:
+        summary = create_shapefile.Summary()
+        summary.add_dataframe(exposure)
+        summary.write(args.summary_directory)
+
+
+if __name__ == "__main__":
+    import multiprocessing
+
+    multiprocessing.set_start_method("spawn")
+    main()
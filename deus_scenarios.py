@@ -0,0 +1,237 @@
+#!/usr/bin/env python3
+
+# Copyright © 2021-2022 Helmholtz Centre Potsdam GFZ German Research Centre for
+# Geosciences, Potsdam, Germany
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+"""
+Runs deus for several scenarios (intensity files) with the same exposure.
+
+For ensemble studies we want to run deus with many shakemaps.
+Here we read the exposure, the schema mapping, the fragility & the
+loss data only once, split the exposure once and use the same
+workers for all of the scenarios.
+
+Please use -h for usage.
+"""
+
+import argparse
+import glob
+import os
+
+import geopandas
+import numpy
+import pandas
+
+import deus
+import executors
+import gpdexposure
+import tellus
+
+
+def expand_intensity_files(patterns):
+    """
+    Return the intensity files for the (glob) patterns.
+
+    Patterns without any matching file are used as they are, so that
+    we get a clear error message when we read them.
+    """
+    intensity_files = []
+    for pattern in patterns:
+        matches = sorted(glob.glob(pattern))
+        if matches:
+            intensity_files.extend(matches)
+        else:
+            intensity_files.append(pattern)
+    return intensity_files
+
+
+def get_scenario_names(intensity_files):
+    """Return the names of the scenarios (the file names without ending)."""
+    names = [
+        os.path.splitext(os.path.basename(intensity_file))[0]
+        for intensity_file in intensity_files
+    ]
+    if len(set(names)) != len(names):
+        raise Exception(
+            "The intensity files must have different names, "
+            + "as we use them for the output files"
+        )
+    return names
+
+
+def compute_loss_statistics(cells, loss_values_by_scenario, percentiles):
+    """
+    Compute the mean & the percentiles of the loss per cell.
+
+    The cells are the gid, the loss_unit & the geometry of the
+    result of one scenario. All the loss vectors must be for
+    those cells in the same order (as they are updated from the
+    same exposure).
+    """
+    loss_values = numpy.array(loss_values_by_scenario, dtype=numpy.float64)
+    columns = {
+        "gid": cells["gid"].tolist(),
+        "loss_mean": loss_values.mean(axis=0),
+    }
+    for percentile in percentiles:
+        columns["loss_p{0:g}".format(percentile)] = numpy.percentile(
+            loss_values, percentile, axis=0
+        )
+    columns["loss_unit"] = cells["loss_unit"].tolist()
+    return geopandas.GeoDataFrame(
+        pandas.DataFrame(columns),
+        geometry=cells.geometry.tolist(),
+        crs=cells.crs,
+    )
+
+
+def create_executor(name, workers):
+    """
+    Create the executor for the scenarios.
+
+    With processes we keep the pool for all the scenarios, so
+    that we start the workers only once.
+    """
+    if name == "processes":
+        return executors.PersistentProcessExecutor(workers)
+    return executors.create_executor(name, workers)
+
+
+def main():
+    """
+    Runs the update of the exposure for all the intensity files
+    and writes one output file per scenario.
+
+    We read the intensity files & write the outputs one scenario
+    after the other, so that we only hold one of them in memory.
+    """
+    argparser = argparse.ArgumentParser(
+        description="Updates the exposure model and the damage "
+        + "classes of the Buildings for several scenarios"
+    )
+    argparser.add_argument(
+        "exposure_file",
+        help="File with the exposure data (GeoJSON, or GeoParquet/Arrow "
+        + "for .parquet/.arrow files)",
+    )
+    argparser.add_argument(
+        "exposure_schema",
+        help="The actual schema for the exposure data",
+    )
+    argparser.add_argument(
+        "fragilty_file", help="File with the fragility function data"
+    )
+    argparser.add_argument(
+        "intensity_files",
+        nargs="+",
+        help="Files (or glob patterns) with hazard intensities, "
+        + "for example shakemaps - one for each scenario",
+    )
+    argparser.add_argument(
+        "--output_directory",
+        default=".",
+        help="Directory for the output files",
+    )
+    argparser.add_argument(
+        "--output_suffix",
+        default="_merged.json",
+        help="The output file for each scenario is the name of the "
+        + "intensity file (without ending) with this suffix",
+    )
+    argparser.add_argument(
+        "--statistics_file",
+        default=None,
+        help="If given, write the mean & the percentiles of the loss "
+        + "per cell over all the scenarios into this file",
+    )
+    argparser.add_argument(
+        "--percentiles",
+        default=[5.0, 50.0, 95.0],
+        type=float,
+        nargs="+",
+        help="Percentiles of the loss for the statistics file",
+    )
+    tellus.add_common_arguments(argparser, single_run=False)
+    args = argparser.parse_args()
+
+    intensity_files = expand_intensity_files(args.intensity_files)
+    scenario_names = get_scenario_names(intensity_files)
+
+    current_dir = os.path.dirname(os.path.realpath(__file__))
+    schema_mapper = tellus.create_schema_mapper(current_dir)
+    loss_provider = deus.create_loss_provider()
+    fragility_provider = tellus.create_fragility_provider(
+        args.fragilty_file, args
+    )
+    query_workers = tellus.get_query_workers(args)
+    intensity_providers = (
+        deus.create_intensity_provider(intensity_file, workers=query_workers)
+        for intensity_file in intensity_files
+    )
+    exposure = gpdexposure.read_exposure(args.exposure_file)
+
+    if not os.path.exists(args.output_directory):
+        os.makedirs(args.output_directory)
+
+    # For the statistics we only keep the loss values of the cells.
+    cells = None
+    loss_values_by_scenario = []
+
+    executor = create_executor(args.executor, args.workers)
+    try:
+        results = gpdexposure.update_exposure_for_scenarios(
+            exposure,
+            args.exposure_schema,
+            schema_mapper,
+            intensity_providers,
+            fragility_provider,
+            loss_provider,
+            engine=args.engine,
+            damage_epsilon=args.damage_epsilon,
+            pruning_epsilon=args.pruning_epsilon,
+            executor=executor,
+        )
+        for scenario_name, result in zip(scenario_names, results):
+            tellus.write_result(
+                os.path.join(
+                    args.output_directory, scenario_name + args.output_suffix
+                ),
+                result,
+            )
+            if args.statistics_file is not None:
+                if cells is None:
+                    cells = result[["gid", "loss_unit", "geometry"]]
+                loss_values_by_scenario.append(
+                    result["loss_value"].to_numpy(dtype=numpy.float64)
+                )
+    finally:
+        if isinstance(executor, executors.PersistentProcessExecutor):
+            executor.close()
+
+    if args.statistics_file is not None:
+        tellus.write_result(
+            args.statistics_file,
+            compute_loss_statistics(
+                cells, loss_values_by_scenario, args.percentiles
+            ),
+        )
+
+    tellus.print_cache_statistics(fragility_provider)
+
+
+if __name__ == "__main__":
+    import multiprocessing
+
+    multiprocessing.set_start_method("spawn")
+    main()
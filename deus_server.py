@@ -0,0 +1,396 @@
+#!/usr/bin/env python3
+
+# Copyright © 2021-2022 Helmholtz Centre Potsdam GFZ German Research Centre for
+# Geosciences, Potsdam, Germany
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+"""
+Runs deus as long running server.
+
+For small regions most of the time of a deus run is spent to start
+python, to import the libraries and to read the schema mapping and
+loss data. Here we do that only once & keep the worker processes
+running. The jobs are sent as json via http (on a local port or a
+unix socket):
+
+    curl -X POST http://localhost:8090/jobs -d '{
+        "intensity_file": "shakemap.xml",
+        "exposure_file": "exposure.json",
+        "exposure_schema": "SARA_v1.0",
+        "fragility_file": "fragility_sara.json",
+        "merged_output_file": "output_merged.json"
+    }'
+
+The hazard is shakemap by default, but it can be any of the hazards
+of deus_chain (with their additional parameters). Optional parameters
+are the summary_directory, the engine, the damage_epsilon, the
+pruning_epsilon, the function_cache_size, the quantization, the
+max_tabulation_error & the tabulation_file.
+The jobs run one after another. The result of a job contains the
+counters of the fragility function caches for this job.
+
+Please use -h for usage.
+"""
+
+import argparse
+import http.server
+import json
+import os
+import socketserver
+import sys
+import time
+
+import create_shapefile
+import deus
+import deus_chain
+import executors
+import fragility
+import gpdexposure
+import tellus
+
+REQUIRED_JOB_PARAMETERS = [
+    "intensity_file",
+    "exposure_file",
+    "exposure_schema",
+    "fragility_file",
+    "merged_output_file",
+]
+
+# The additional parameters that the hazards need for their
+# intensity providers.
+REQUIRED_HAZARD_PARAMETERS = {
+    "shakemap": [],
+    "raster": ["intensity_name", "intensity_unit"],
+    "ashfall": ["intensity_column"],
+}
+
+
+def get_missing_parameters(job):
+    """Return the required parameters that are not in the job."""
+    hazard = job.get("hazard", "shakemap")
+    required = REQUIRED_JOB_PARAMETERS + REQUIRED_HAZARD_PARAMETERS.get(
+        hazard, []
+    )
+    return [parameter for parameter in required if parameter not in job]
+
+
+class JobRunner:
+    """
+    Runs the jobs with the reference data that we load only once.
+
+    The fragility providers are cached by the path & the
+    modification time of their files (and the options for the
+    fragility functions).
+    """
+
+    def __init__(
+        self,
+        executor,
+        engine="columnar",
+        damage_epsilon=0.0,
+        pruning_epsilon=0.0,
+        function_cache_size=fragility.FUNCTION_CACHE_SIZE,
+        quantization=None,
+        max_tabulation_error=None,
+        tabulation_file=None,
+    ):
+        current_dir = os.path.dirname(os.path.realpath(__file__))
+        self.schema_mapper = tellus.create_schema_mapper(current_dir)
+        self.loss_provider = deus.create_loss_provider()
+        self.executor = executor
+        self.engine = engine
+        self.damage_epsilon = damage_epsilon
+        self.pruning_epsilon = pruning_epsilon
+        self.function_cache_size = function_cache_size
+        self.quantization = quantization
+        self.max_tabulation_error = max_tabulation_error
+        self.tabulation_file = tabulation_file
+        self.fragility_providers = {}
+
+    def get_fragility_options(self, job):
+        """
+        Return the options for the fragility provider of the job
+        (see tellus.get_fragility_options).
+        """
+        return tellus.get_fragility_options(
+            argparse.Namespace(
+                function_cache_size=job.get(
+                    "function_cache_size", self.function_cache_size
+                ),
+                quantization=job.get("quantization", self.quantization),
+                max_tabulation_error=job.get(
+                    "max_tabulation_error", self.max_tabulation_error
+                ),
+                tabulation_file=job.get(
+                    "tabulation_file", self.tabulation_file
+                ),
+            )
+        )
+
+    def get_fragility_provider(self, fragility_file, fragility_options=None):
+        """Return the (cached) fragility provider for the file."""
+        if fragility_options is None:
+            fragility_options = self.get_fragility_options({})
+        key = (
+            os.path.abspath(fragility_file),
+            os.path.getmtime(fragility_file),
+            tuple(sorted(fragility_options.items())),
+        )
+        if key not in self.fragility_providers:
+            self.fragility_providers[key] = fragility.Fragility.from_file(
+                fragility_file
+            ).to_fragility_provider(**fragility_options)
+        return self.fragility_providers[key]
+
+    def run_job(self, job):
+        """
+        Run the job (a dict with the same parameters as deus).
+
+        Returns a dict with some information about the result.
+        """
+        start_time = time.time()
+        hazard = job.get("hazard", "shakemap")
+        if hazard not in deus_chain.INTENSITY_PROVIDER_FACTORIES.keys():
+            raise Exception("Hazard {0} is not supported".format(hazard))
+        intensity_provider = deus_chain.INTENSITY_PROVIDER_FACTORIES[hazard](
+            job
+        )
+        fragility_provider = self.get_fragility_provider(
+            job["fragility_file"], self.get_fragility_options(job)
+        )
+        exposure = gpdexposure.read_exposure(job["exposure_file"])
+        # The provider is shared between the jobs, so we only
+        # report the counters of this job.
+        cache_statistics = fragility_provider.get_cache_statistics()
+
+        result_exposure = gpdexposure.update_exposure_transitions_and_losses(
+            exposure,
+            job["exposure_schema"],
+            self.schema_mapper,
+            intensity_provider,
+            fragility_provider,
+            self.loss_provider,
+            engine=job.get("engine", self.engine),
+            damage_epsilon=job.get("damage_epsilon", self.damage_epsilon),
+            executor=self.executor,
+            pruning_epsilon=job.get("pruning_epsilon", self.pruning_epsilon),
+        )
+        tellus.write_result(job["merged_output_file"], result_exposure)
+
+        summary_directory = job.get("summary_directory")
+        if summary_directory is not None:
+            summary = create_shapefile.Summary()
+            summary.add_dataframe(result_exposure)
+            summary.write(summary_directory)
+
+        return {
+            "merged_output_file": job["merged_output_file"],
+            "cells": len(result_exposure),
+            "seconds": time.time() - start_time,
+            "cache_statistics": dict(
+                fragility.get_cache_statistics_difference(
+                    fragility_provider.get_cache_statistics(),
+                    cache_statistics,
+                )._asdict()
+            ),
+        }
+
+
+class JobRequestHandler(http.server.BaseHTTPRequestHandler):
+    """
+    Handles the http requests for the server.
+
+    POST /jobs runs a job, GET /health tells that the server is up.
+    The job runner is the one of the server.
+    """
+
+    def send_json(self, status, data):
+        """Send the data as json response."""
+        body = json.dumps(data).encode("utf-8")
+        self.send_response(status)
+        self.send_header("Content-Type", "application/json")
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def do_GET(self):
+        """Handle the health check."""
+        if self.path != "/health":
+            self.send_json(404, {"error": "Not found"})
+            return
+        self.send_json(200, {"status": "ok"})
+
+    def do_POST(self):
+        """Run a job."""
+        if self.path != "/jobs":
+            self.send_json(404, {"error": "Not found"})
+            return
+        try:
+            length = int(self.headers.get("Content-Length", 0))
+            job = json.loads(self.rfile.read(length))
+        except ValueError as error:
+            self.send_json(400, {"error": "Invalid json: " + str(error)})
+            return
+        if not isinstance(job, dict):
+            self.send_json(400, {"error": "The job must be a json object"})
+            return
+        missing_parameters = get_missing_parameters(job)
+        if missing_parameters:
+            self.send_json(
+                400,
+                {
+                    "error": "Missing parameters: "
+                    + ", ".join(missing_parameters)
+                },
+            )
+            return
+        try:
+            result = self.server.job_runner.run_job(job)
+        except Exception as error:
+            self.send_json(500, {"error": str(error)})
+            return
+        self.send_json(200, result)
+
+
+class UnixHttpServer(socketserver.UnixStreamServer):
+    """Http server on a unix socket."""
+
+    def get_request(self):
+        request, _ = super().get_request()
+        # The request handler expects a host & a port for the logging.
+        return request, ("unix", 0)
+
+
+def create_server(job_runner, host="127.0.0.1", port=8090, unix_socket=None):
+    """
+    Create the server for the job runner.
+
+    If the unix_socket is given, we use it instead of the host & port.
+    """
+    if unix_socket is not None:
+        if os.path.exists(unix_socket):
+            os.unlink(unix_socket)
+        server = UnixHttpServer(unix_socket, JobRequestHandler)
+    else:
+        server = http.server.HTTPServer((host, port), JobRequestHandler)
+    server.job_runner = job_runner
+    return server
+
+
+def main():
+    """Runs the server until it is interrupted."""
+    argparser = argparse.ArgumentParser(
+        description="Runs deus as server with warm reference data"
+    )
+    argparser.add_argument(
+        "--host", default="127.0.0.1", help="Host to listen on"
+    )
+    argparser.add_argument(
+        "--port", default=8090, type=int, help="Port to listen on"
+    )
+    argparser.add_argument(
+        "--unix_socket",
+        default=None,
+        help="If given, listen on this unix socket instead of the port",
+    )
+    argparser.add_argument(
+        "--fragility_files",
+        default=[],
+        nargs="*",
+        help="Fragility files to load already at the start",
+    )
+    argparser.add_argument(
+        "--engine",
+        default="columnar",
+        choices=gpdexposure.ENGINES,
+        help="Default engine to update the exposure",
+    )
+    argparser.add_argument(
+        "--damage_epsilon",
+        default=0.0,
+        type=float,
+        help="Default for the damage epsilon (see deus.py)",
+    )
+    argparser.add_argument(
+        "--pruning_epsilon",
+        default=0.0,
+        type=float,
+        help="Default for the pruning epsilon (see deus.py)",
+    )
+    argparser.add_argument(
+        "--function_cache_size",
+        default=fragility.FUNCTION_CACHE_SIZE,
+        type=int,
+        help="Default for the function cache size (see deus.py)",
+    )
+    argparser.add_argument(
+        "--quantization",
+        default=None,
+        type=float,
+        help="Default for the quantization (see deus.py)",
+    )
+    argparser.add_argument(
+        "--max_tabulation_error",
+        default=None,
+        type=float,
+        help="Default for the max tabulation error (see deus.py)",
+    )
+    argparser.add_argument(
+        "--tabulation_file",
+        default=None,
+        help="Default for the tabulation file (see deus.py)",
+    )
+    argparser.add_argument(
+        "--workers",
+        default=None,
+        type=int,
+        help="Number of worker processes (default: number of cpus)",
+    )
+    args = argparser.parse_args()
+
+    with executors.PersistentProcessExecutor(args.workers) as executor:
+        job_runner = JobRunner(
+            executor,
+            engine=args.engine,
+            damage_epsilon=args.damage_epsilon,
+            pruning_epsilon=args.pruning_epsilon,
+            function_cache_size=args.function_cache_size,
+            quantization=args.quantization,
+            max_tabulation_error=args.max_tabulation_error,
+            tabulation_file=args.tabulation_file,
+        )
+        for fragility_file in args.fragility_files:
+            job_runner.get_fragility_provider(fragility_file)
+
+        server = create_server(
+            job_runner,
+            host=args.host,
+            port=args.port,
+            unix_socket=args.unix_socket,
+        )
+        print("deus server is ready", file=sys.stderr)
+        try:
+            server.serve_forever()
+        except KeyboardInterrupt:
+            pass
+        finally:
+            server.server_close()
+            if args.unix_socket is not None:
+                os.unlink(args.unix_socket)
+
+
+if __name__ == "__main__":
+    import multiprocessing
+
+    multiprocessing.set_start_method("spawn")
+    main()
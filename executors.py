@@ -0,0 +1,270 @@
+#!/usr/bin/env python3
+
+# Copyright © 2021-2022 Helmholtz Centre Potsdam GFZ German Research Centre for
+# Geosciences, Potsdam, Germany
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+"""
+Module with the executors to run the update of the
+exposure chunks.
+
+All executors support the map_updater(updater, chunks) method
+that returns the results of updater.update_df for all the chunks
+(in the same order as the chunks).
+"""
+
+import concurrent.futures
+import itertools
+import multiprocessing
+import os
+import pickle
+import signal
+import tempfile
+
+# The updater for the worker processes.
+# It is set once per worker by the pool initializer, so that we
+# don't need to send all the providers with every chunk.
+WORKER_UPDATER = None
+# The key of the updater that a worker of the persistent pool has
+# unpickled last.
+WORKER_UPDATER_KEY = None
+
+
+class SerialExecutor:
+    """Executor that runs all the chunks one after another."""
+
+    def __init__(self, workers=None):
+        self.workers = 1
+
+    def map_updater(self, updater, chunks):
+        """Run the update for all of the chunks."""
+        return [updater.update_df(chunk) for chunk in chunks]
+
+
+class ThreadExecutor:
+    """
+    Executor that runs the chunks in a thread pool.
+
+    This doesn't need to pickle the updater & the chunks, but it
+    only helps when most of the time is spent in numpy
+    (as the rest of the work is limited by the gil).
+    """
+
+    def __init__(self, workers=None):
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        self.workers = workers
+
+    def map_updater(self, updater, chunks):
+        """Run the update for all of the chunks."""
+        with concurrent.futures.ThreadPoolExecutor(self.workers) as pool:
+            return list(pool.map(updater.update_df, chunks))
+
+
+class ProcessExecutor:
+    """
+    Executor that runs the chunks in a multiprocessing pool.
+
+    The updater is sent just once to each worker.
+    The tasks contain only the chunks.
+    """
+
+    def __init__(self, workers=None):
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        self.workers = workers
+
+    def map_updater(self, updater, chunks):
+        """Run the update for all of the chunks."""
+        with multiprocessing.Pool(
+            self.workers, initializer=init_worker, initargs=(updater,)
+        ) as pool:
+            # We take the chunks in the order they are finished, but
+            # we want to give them back in the order of the input.
+            results = [None] * len(chunks)
+            for chunk_index, result in pool.imap_unordered(
+                update_df_in_worker, enumerate(chunks)
+            ):
+                results[chunk_index] = result
+        return results
+
+
+class DaskExecutor:
+    """
+    Executor that runs the chunks on a local dask cluster.
+
+    The dask workers can spill their data to disk, so this
+    can help for very large exposure models.
+    Dask is not a requirement for deus, so we import it only
+    if we need it.
+    """
+
+    def __init__(self, workers=None):
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        self.workers = workers
+
+    def map_updater(self, updater, chunks):
+        """Run the update for all of the chunks."""
+        try:
+            from dask.distributed import Client, LocalCluster
+        except ImportError:
+            raise Exception(
+                "The dask executor needs dask.distributed to be installed"
+            )
+        with LocalCluster(
+            n_workers=self.workers, threads_per_worker=1, processes=True
+        ) as cluster, Client(cluster) as client:
+            # Again we want to send the updater just once to each worker.
+            scattered_updater = client.scatter(updater, broadcast=True)
+            futures = client.map(
+                update_df_with_updater,
+                chunks,
+                updater=scattered_updater,
+                pure=False,
+            )
+            return client.gather(futures)
+
+
+def ignore_interrupts():
+    """Let the worker process ignore ctrl+c."""
+    signal.signal(signal.SIGINT, signal.SIG_IGN)
+
+
+class PersistentProcessExecutor:
+    """
+    Executor that keeps its multiprocessing pool for all the updates.
+
+    For a long running process (like deus_server) we don't want to
+    start the workers again for every job. As the pool is already
+    running, we can't give the updater to the pool initializer.
+    Instead we pickle the updater once per call into a temporary
+    file & the tasks contain only the name of the file (next to the
+    chunks). Each worker reads the updater only once per call.
+    Call close (or use it as context manager) to stop the workers.
+    The workers ignore ctrl+c, so that the main process can stop them.
+    """
+
+    def __init__(self, workers=None):
+        if workers is None:
+            workers = multiprocessing.cpu_count()
+        self.workers = workers
+        self._pool = None
+        self._call_counter = itertools.count()
+
+    def map_updater(self, updater, chunks):
+        """Run the update for all of the chunks."""
+        if self._pool is None:
+            self._pool = multiprocessing.Pool(
+                self.workers, initializer=ignore_interrupts
+            )
+        updater_key = (os.getpid(), next(self._call_counter))
+        file_descriptor, updater_file = tempfile.mkstemp(
+            prefix="deus_updater_", suffix=".pickle"
+        )
+        try:
+            with os.fdopen(file_descriptor, "wb") as output_file:
+                pickle.dump(
+                    updater, output_file, protocol=pickle.HIGHEST_PROTOCOL
+                )
+            tasks = (
+                (updater_key, updater_file, chunk_index, chunk)
+                for chunk_index, chunk in enumerate(chunks)
+            )
+            results = [None] * len(chunks)
+            for chunk_index, result in self._pool.imap_unordered(
+                update_df_with_pickled_updater, tasks
+            ):
+                results[chunk_index] = result
+        finally:
+            os.unlink(updater_file)
+        return results
+
+    def close(self):
+        """Stop the workers."""
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        self.close()
+
+
+EXECUTORS = {
+    "serial": SerialExecutor,
+    "threads": ThreadExecutor,
+    "processes": ProcessExecutor,
+    "dask": DaskExecutor,
+}
+
+
+def create_executor(name, workers=None):
+    """
+    Create the executor with the given name.
+
+    If the number of workers is not given, we use
+    the number of cpus.
+    """
+    if name not in EXECUTORS.keys():
+        raise Exception("Executor {0} is not supported".format(name))
+    return EXECUTORS[name](workers)
+
+
+def init_worker(updater):
+    """
+    Initializer for the worker processes.
+
+    Stores the updater, so that all the following tasks
+    for this worker can use it.
+    """
+    global WORKER_UPDATER
+    WORKER_UPDATER = updater
+
+
+def update_df_in_worker(indexed_dataframe):
+    """
+    Run the update for the dataframe with the updater of the worker.
+
+    The input is a tuple with the index of the chunk and the dataframe.
+    We give the index back, so that we can bring the results
+    in the right order again.
+    """
+    chunk_index, dataframe = indexed_dataframe
+    return chunk_index, WORKER_UPDATER.update_df(dataframe)
+
+
+def update_df_with_updater(dataframe, updater):
+    """Run the update for the dataframe with the given updater."""
+    return updater.update_df(dataframe)
+
+
+def update_df_with_pickled_updater(task):
+    """
+    Run the update for the dataframe in a worker of the persistent pool.
+
+    The task contains the key & the file with the pickled updater,
+    the index of the chunk and the dataframe. We only read the
+    updater if we didn't do it already for this key.
+    """
+    global WORKER_UPDATER, WORKER_UPDATER_KEY
+    updater_key, updater_file, chunk_index, dataframe = task
+    if WORKER_UPDATER_KEY != updater_key:
+        with open(updater_file, "rb") as input_file:
+            WORKER_UPDATER = pickle.load(input_file)
+        WORKER_UPDATER_KEY = updater_key
+    return chunk_index, WORKER_UPDATER.update_df(dataframe)
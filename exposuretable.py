@@ -0,0 +1,858 @@
+#!/usr/bin/env python3
+
+# Copyright © 2021-2022 Helmholtz Centre Potsdam GFZ German Research Centre for
+# Geosciences, Potsdam, Germany
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+"""
+Module for the columnar exposure update.
+
+Instead of working cell by cell with dicts, the exposure of all cells
+is flattened into one long format table (one row per cell, taxonomy and
+damage state).
+Mapping, damage state updates and the loss computation are then done
+with array operations for all the cells at once.
+
+The results are the very same as the ones of the cell by cell
+implementation in the gpdexposure module (and we take care to keep
+the order of the summations, so that even the floating point values
+are identical).
+"""
+
+import numpy
+
+# If the number of possible keys for a grouping is at most this
+# factor times the number of rows, we group without sorting.
+DENSE_GROUPING_FACTOR = 4
+
+
+class ExposureTable:
+    """
+    Long format table for the exposure.
+
+    All the columns are numpy arrays of the same length.
+    The cells are positions (0, 1, ...) in the chunk of the exposure
+    that we work with, the taxonomies are the ids of the
+    vocabulary (see the vocabulary module).
+
+    The rows are sorted by the cells, and within one cell they
+    keep the order of the input (or the order in which they were created).
+    """
+
+    def __init__(
+        self,
+        cells,
+        taxonomies,
+        damage_states,
+        buildings,
+        population,
+        replcostbdg,
+        vocabulary,
+    ):
+        self.cells = cells
+        self.taxonomies = taxonomies
+        self.damage_states = damage_states
+        self.buildings = buildings
+        self.population = population
+        self.replcostbdg = replcostbdg
+        self.vocabulary = vocabulary
+
+    def __len__(self):
+        return len(self.cells)
+
+    def take(self, indices):
+        """Return a new table with just the rows for the indices."""
+        return ExposureTable(
+            cells=self.cells[indices],
+            taxonomies=self.taxonomies[indices],
+            damage_states=self.damage_states[indices],
+            buildings=self.buildings[indices],
+            population=self.population[indices],
+            replcostbdg=self.replcostbdg[indices],
+            vocabulary=self.vocabulary,
+        )
+
+
+class TransitionTable:
+    """
+    Long format table for the transitions.
+
+    Similar to the ExposureTable, but with from and to damage states.
+    """
+
+    def __init__(
+        self,
+        cells,
+        taxonomies,
+        from_damage_states,
+        to_damage_states,
+        buildings,
+        replcostbdg,
+        vocabulary,
+    ):
+        self.cells = cells
+        self.taxonomies = taxonomies
+        self.from_damage_states = from_damage_states
+        self.to_damage_states = to_damage_states
+        self.buildings = buildings
+        self.replcostbdg = replcostbdg
+        self.vocabulary = vocabulary
+
+    def __len__(self):
+        return len(self.cells)
+
+
+def group_by_first_appearance(*columns):
+    """
+    Group the rows by the given integer columns.
+
+    Returns the group id for each row and the number of groups.
+    The groups are numbered in the order in which they appear first
+    in the rows (so that we can keep the order of the dicts that
+    we used in the cell by cell implementation).
+    """
+    if len(columns[0]) == 0:
+        return numpy.zeros(0, dtype=numpy.int64), 0
+    dims = [int(column.max()) + 1 for column in columns]
+    keys = numpy.ravel_multi_index(columns, dims)
+    n_keys = int(numpy.prod(dims, dtype=numpy.float64))
+    if n_keys <= DENSE_GROUPING_FACTOR * len(keys):
+        # There are not that many possible keys, so we can
+        # use arrays over all of them & don't need to sort.
+        positions = numpy.arange(len(keys))
+        first_index = numpy.empty(n_keys, dtype=numpy.int64)
+        # We go backwards, so that the first rows win.
+        first_index[keys[::-1]] = positions[::-1]
+        first_positions = numpy.flatnonzero(first_index[keys] == positions)
+        group_of_key = numpy.empty(n_keys, dtype=numpy.int64)
+        group_of_key[keys[first_positions]] = numpy.arange(
+            len(first_positions)
+        )
+        return group_of_key[keys], len(first_positions)
+    _, first_index, inverse = numpy.unique(
+        keys, return_index=True, return_inverse=True
+    )
+    inverse = inverse.reshape(-1)
+    order = numpy.argsort(first_index, kind="stable")
+    rank = numpy.empty(len(order), dtype=numpy.int64)
+    rank[order] = numpy.arange(len(order))
+    return rank[inverse], len(order)
+
+
+def first_rows_of_groups(group_ids, n_groups):
+    """Return the index of the first row for each group."""
+    first_rows = numpy.zeros(n_groups, dtype=numpy.int64)
+    # We go backwards, so that the first rows win.
+    reversed_positions = numpy.arange(len(group_ids))[::-1]
+    first_rows[group_ids[::-1]] = reversed_positions
+    return first_rows
+
+
+def sum_by_group(group_ids, n_groups, values):
+    """
+    Sum the values for each group.
+
+    bincount adds the values in the order of the rows, so we get the
+    very same result as adding them up in a python loop.
+    """
+    return numpy.bincount(group_ids, weights=values, minlength=n_groups)
+
+
+def replacement_costs_per_taxonomy(cells, taxonomies, buildings, total_repl):
+    """
+    Compute the weighted mean of the replacement costs per cell & taxonomy.
+
+    Returns the mean value for each of the rows.
+    If there are no buildings for the taxonomy in the cell, the
+    replacement costs are 0.
+    """
+    group_ids, n_groups = group_by_first_appearance(cells, taxonomies)
+    n_buildings_per_tax = sum_by_group(group_ids, n_groups, buildings)
+    total_repl_per_tax = sum_by_group(group_ids, n_groups, total_repl)
+    repl_per_tax = numpy.zeros(n_groups)
+    non_zero = n_buildings_per_tax != 0
+    repl_per_tax[non_zero] = (
+        total_repl_per_tax[non_zero] / n_buildings_per_tax[non_zero]
+    )
+    return repl_per_tax[group_ids]
+
+
+def map_table(table, source_schema, target_schema, schema_mapper):
+    """
+    Map the exposure table to another schema if necessary.
+
+    This is the columnar version of gpdexposure.map_exposure.
+    The mapping between the schemas is one sparse matrix (see
+    schemamapping.CompiledSchemaMapping). Every row of the table gets
+    one row for each of the entries in the matrix row of its
+    taxonomy & damage state, and then we sum them up per cell.
+    """
+    if source_schema == target_schema or len(table) == 0:
+        return table
+
+    pair_ids, n_pairs = group_by_first_appearance(
+        table.taxonomies, table.damage_states
+    )
+    first_rows = first_rows_of_groups(pair_ids, n_pairs)
+
+    vocabulary = table.vocabulary
+
+    compiled_mapping = schema_mapper.compile_mapping(
+        source_schema, target_schema
+    )
+    matrix_rows = compiled_mapping.get_rows(
+        vocabulary.get_taxonomies(table.taxonomies[first_rows]),
+        table.damage_states[first_rows].tolist(),
+    )
+    matrix = compiled_mapping.matrix
+    pair_counts = numpy.diff(matrix.indptr)[matrix_rows]
+    pair_offsets = matrix.indptr[matrix_rows]
+
+    # The target taxonomies are ids in our vocabulary.
+    target_taxonomies = numpy.array(
+        vocabulary.intern_many(
+            target_schema, compiled_mapping.target_taxonomies
+        ),
+        dtype=numpy.int64,
+    )
+    target_damage_states = numpy.array(
+        compiled_mapping.target_damage_states, dtype=numpy.int64
+    )
+
+    # And we expand our rows, so that every input row gets
+    # one row for each of its mapping results.
+    row_counts = pair_counts[pair_ids]
+    source_rows = numpy.repeat(numpy.arange(len(table)), row_counts)
+    row_starts = numpy.zeros(len(table), dtype=numpy.int64)
+    row_starts[1:] = numpy.cumsum(row_counts)[:-1]
+    position_in_pair = numpy.arange(len(source_rows)) - numpy.repeat(
+        row_starts, row_counts
+    )
+    entries = pair_offsets[pair_ids[source_rows]] + position_in_pair
+    target_columns = matrix.indices[entries]
+
+    fractions = matrix.data[entries]
+    cells = table.cells[source_rows]
+    taxonomies = target_taxonomies[target_columns]
+    damage_states = target_damage_states[target_columns]
+    new_buildings = fractions * table.buildings[source_rows]
+    new_population = fractions * table.population[source_rows]
+    new_repl = new_buildings * table.replcostbdg[source_rows]
+
+    # The columns of the matrix are the (taxonomy, damage state)
+    # pairs, so we can group by them (their numbers are much smaller
+    # than the ids of the vocabulary).
+    group_ids, n_groups = group_by_first_appearance(cells, target_columns)
+    first_rows = first_rows_of_groups(group_ids, n_groups)
+
+    _, column_taxonomy_codes = numpy.unique(
+        target_taxonomies, return_inverse=True
+    )
+    repl_per_row = replacement_costs_per_taxonomy(
+        cells,
+        column_taxonomy_codes.reshape(-1)[target_columns],
+        new_buildings,
+        new_repl,
+    )
+
+    return ExposureTable(
+        cells=cells[first_rows],
+        taxonomies=taxonomies[first_rows],
+        damage_states=damage_states[first_rows],
+        buildings=sum_by_group(group_ids, n_groups, new_buildings),
+        population=sum_by_group(group_ids, n_groups, new_population),
+        replcostbdg=repl_per_row[first_rows],
+        vocabulary=vocabulary,
+    )
+
+
+def evaluate_fragility_function(fragility_function, values):
+    """
+    Evaluate the fragility function for an array of intensities.
+
+    The fragility functions work on single values, so we call them
+    once for each distinct intensity value.
+    Only the tabulated functions can work with the whole array.
+    """
+    if hasattr(fragility_function, "evaluate_many"):
+        return fragility_function.evaluate_many(values)
+    unique_values, inverse = numpy.unique(values, return_inverse=True)
+    results = numpy.array(
+        [fragility_function(value) for value in unique_values.tolist()],
+        dtype=numpy.float64,
+    ).reshape(-1)
+    return results[inverse.reshape(-1)]
+
+
+def find_affected_cells(table, intensities, intensity_thresholds, n_cells):
+    """
+    Return a mask with the cells in which buildings can be damaged.
+
+    A cell is affected if any of its taxonomies (with buildings)
+    has an intensity above the threshold (see
+    FragilityProvider.get_intensity_thresholds).
+    """
+    affected = numpy.zeros(n_cells, dtype=bool)
+    rows_with_buildings = numpy.flatnonzero(table.buildings > 0)
+    taxonomies = table.taxonomies[rows_with_buildings]
+    for taxonomy in numpy.unique(taxonomies).tolist():
+        rows = rows_with_buildings[taxonomies == taxonomy]
+        cells = table.cells[rows]
+        taxonomy_name = table.vocabulary.get_taxonomy(taxonomy)
+        if taxonomy_name not in intensity_thresholds.keys():
+            # We don't know anything about this taxonomy,
+            # so we must compute it.
+            affected[cells] = True
+            continue
+        thresholds_by_field = intensity_thresholds[taxonomy_name]
+        for field, threshold in thresholds_by_field.items():
+            values = intensities[field][cells]
+            affected[cells[values > threshold]] = True
+    return affected
+
+
+def get_damage_state_probabilities(
+    table,
+    intensities,
+    units,
+    fragility_provider,
+    sorted_damage_states,
+    affected_cells=None,
+    compiled_fragility=None,
+):
+    """
+    Return the probabilities & the target damage states for the table.
+
+    Both are matrices with one row for each row in the table, and
+    one column for each damage state to care about (sorted by the
+    highest damage state first).
+    Rows that have less damage states to care about are filled up
+    with a probability of 0 and a target damage state of -1.
+
+    If the affected cells are given, we only evaluate the fragility
+    functions for the rows in those cells. All the others get
+    a probability of 0.
+
+    If the compiled fragility model is given (see
+    FragilityProvider.compile), we use it to evaluate all the
+    rows of a taxonomy & damage state at once.
+    """
+    pair_ids, n_pairs = group_by_first_appearance(
+        table.taxonomies, table.damage_states
+    )
+    first_rows = first_rows_of_groups(pair_ids, n_pairs)
+
+    if compiled_fragility is not None:
+        return get_compiled_damage_state_probabilities(
+            table,
+            intensities,
+            units,
+            compiled_fragility,
+            affected_cells,
+            pair_ids,
+            first_rows,
+        )
+
+    damage_states_by_pair = [
+        sorted_damage_states(
+            fragility_provider,
+            table.vocabulary.get_taxonomy(table.taxonomies[row]),
+            int(table.damage_states[row]),
+        )
+        for row in first_rows.tolist()
+    ]
+    n_columns = max(
+        [len(damage_states) for damage_states in damage_states_by_pair],
+        default=0,
+    )
+    probabilities = numpy.zeros((len(table), n_columns))
+    to_damage_states = numpy.full(
+        (len(table), n_columns), -1, dtype=numpy.int64
+    )
+
+    if n_columns == 0:
+        return probabilities, to_damage_states
+
+    order = numpy.argsort(pair_ids, kind="stable")
+    boundaries = numpy.searchsorted(pair_ids[order], numpy.arange(n_pairs + 1))
+
+    for pair_id, damage_states in enumerate(damage_states_by_pair):
+        start = boundaries[pair_id]
+        end = boundaries[pair_id + 1]
+        rows = order[start:end]
+        rows_to_evaluate = rows
+        if affected_cells is not None:
+            rows_to_evaluate = rows[affected_cells[table.cells[rows]]]
+        cells = table.cells[rows_to_evaluate]
+        for column, single_damage_state in enumerate(damage_states):
+            field = single_damage_state.intensity_field
+            if units[field] != single_damage_state.intensity_unit:
+                raise Exception("Not supported unit")
+            if len(rows_to_evaluate) > 0:
+                values = intensities[field][cells]
+                probabilities[
+                    rows_to_evaluate, column
+                ] = evaluate_fragility_function(
+                    single_damage_state.fragility_function, values
+                )
+            to_damage_states[rows, column] = single_damage_state.to_state
+
+    return probabilities, to_damage_states
+
+
+def get_compiled_damage_state_probabilities(
+    table,
+    intensities,
+    units,
+    compiled_fragility,
+    affected_cells,
+    pair_ids,
+    first_rows,
+):
+    """
+    Same as get_damage_state_probabilities, but with the compiled
+    fragility model.
+    """
+    n_pairs = len(first_rows)
+    taxonomy_names = table.vocabulary.get_taxonomies(
+        table.taxonomies[first_rows]
+    )
+    from_states = table.damage_states[first_rows].tolist()
+    to_states_by_pair = [
+        compiled_fragility.get_to_states(taxonomy, from_state)
+        for taxonomy, from_state in zip(taxonomy_names, from_states)
+    ]
+    n_columns = max(
+        [len(to_states) for to_states in to_states_by_pair],
+        default=0,
+    )
+    probabilities = numpy.zeros((len(table), n_columns))
+    to_damage_states = numpy.full(
+        (len(table), n_columns), -1, dtype=numpy.int64
+    )
+
+    if n_columns == 0:
+        return probabilities, to_damage_states
+
+    order = numpy.argsort(pair_ids, kind="stable")
+    boundaries = numpy.searchsorted(pair_ids[order], numpy.arange(n_pairs + 1))
+
+    for pair_id, to_states in enumerate(to_states_by_pair):
+        start = boundaries[pair_id]
+        end = boundaries[pair_id + 1]
+        rows = order[start:end]
+        rows_to_evaluate = rows
+        if affected_cells is not None:
+            rows_to_evaluate = rows[affected_cells[table.cells[rows]]]
+        cells = table.cells[rows_to_evaluate]
+        n_to_states = len(to_states)
+        # We check the units in any case.
+        probabilities[
+            rows_to_evaluate, :n_to_states
+        ] = compiled_fragility.get_probabilities_for_damage_state(
+            taxonomy_names[pair_id],
+            from_states[pair_id],
+            {field: values[cells] for field, values in intensities.items()},
+            units,
+        )
+        to_damage_states[rows, :n_to_states] = to_states
+
+    return probabilities, to_damage_states
+
+
+def update_table(
+    table,
+    intensities,
+    units,
+    fragility_provider,
+    sorted_damage_states,
+    affected_cells=None,
+    compiled_fragility=None,
+    pruning_epsilon=0.0,
+):
+    """
+    Update the exposure table with the given intensities.
+
+    This is the columnar version of
+    gpdexposure.get_updated_exposure_and_transitions.
+
+    The intensities are given as dict with arrays (one value for
+    each cell), the units as dict with the unit for each
+    intensity measure.
+    The sorted_damage_states function returns the damage states that we
+    need to care about (for a taxonomy and a damage state).
+    The optional affected_cells mask tells for which cells we need
+    to evaluate the fragility functions (see find_affected_cells).
+    The optional compiled fragility model allows to evaluate the
+    fragility functions for many intensities at once.
+    With a pruning_epsilon > 0 we drop the entries that are below
+    this share of the buildings of their row (see prune_entries).
+
+    Returns the updated exposure table & the transition table.
+    """
+    # Cells without any buildings can't be updated, so we
+    # keep them as they are.
+    has_buildings = table.buildings > 0
+    cell_has_buildings = (
+        numpy.bincount(
+            table.cells,
+            weights=has_buildings,
+            minlength=int(table.cells.max()) + 1 if len(table) else 0,
+        )
+        > 0
+    )
+    active = cell_has_buildings[table.cells]
+
+    unchanged = table.take(numpy.flatnonzero(~active))
+    to_update = table.take(numpy.flatnonzero(active))
+
+    probabilities, to_damage_states = get_damage_state_probabilities(
+        to_update,
+        intensities,
+        units,
+        fragility_provider,
+        sorted_damage_states,
+        affected_cells,
+        compiled_fragility,
+    )
+    n_rows, n_columns = probabilities.shape
+
+    # We must go over the damage states one after another, as the
+    # buildings that already went into a higher damage state are not
+    # available anymore.
+    buildings = numpy.zeros((n_rows, n_columns + 1))
+    population = numpy.zeros((n_rows, n_columns + 1))
+    n_left = to_update.buildings.copy()
+    n_pop_left = to_update.population.copy()
+    for column in range(n_columns):
+        probability = probabilities[:, column]
+        buildings[:, column] = probability * n_left
+        population[:, column] = probability * n_pop_left
+        n_left = n_left - buildings[:, column]
+        n_pop_left = n_pop_left - population[:, column]
+    # If we have buildings left in the given damage state, than we must
+    # add them as well, but we don't need a transition.
+    buildings[:, n_columns] = n_left
+    population[:, n_columns] = n_pop_left
+
+    damage_states = numpy.empty((n_rows, n_columns + 1), dtype=numpy.int64)
+    damage_states[:, :n_columns] = to_damage_states
+    damage_states[:, n_columns] = to_update.damage_states
+    is_transition = numpy.zeros((n_rows, n_columns + 1), dtype=bool)
+    is_transition[:, :n_columns] = to_damage_states >= 0
+    is_remaining = numpy.zeros((n_rows, n_columns + 1), dtype=bool)
+    is_remaining[:, n_columns] = True
+
+    # We flatten all those matrices so that we have one entry
+    # per row & damage state in the very same order as the cell by cell
+    # implementation would visit them.
+    buildings = buildings.reshape(-1)
+    population = population.reshape(-1)
+    damage_states = damage_states.reshape(-1)
+    is_transition = is_transition.reshape(-1)
+    is_remaining = is_remaining.reshape(-1)
+    source_rows = numpy.repeat(numpy.arange(n_rows), n_columns + 1)
+    keep = (buildings > 0) & (is_transition | is_remaining)
+    if pruning_epsilon > 0:
+        shape = (n_rows, n_columns + 1)
+        buildings, population, keep = prune_entries(
+            buildings.reshape(shape),
+            population.reshape(shape),
+            keep.reshape(shape),
+            to_update.buildings,
+            to_update.population,
+            pruning_epsilon,
+        )
+        buildings = buildings.reshape(-1)
+        population = population.reshape(-1)
+        keep = keep.reshape(-1)
+
+    # The replacement costs are the weighted means of the input data.
+    repl_per_row = replacement_costs_per_taxonomy(
+        to_update.cells,
+        to_update.taxonomies,
+        to_update.buildings,
+        to_update.replcostbdg * to_update.buildings,
+    )
+
+    entries = numpy.flatnonzero(keep)
+    entry_rows = source_rows[entries]
+    entry_cells = to_update.cells[entry_rows]
+    entry_taxonomies = to_update.taxonomies[entry_rows]
+    entry_damage_states = damage_states[entries]
+
+    group_ids, n_groups = group_by_first_appearance(
+        entry_cells, entry_taxonomies, entry_damage_states
+    )
+    first_entries = first_rows_of_groups(group_ids, n_groups)
+    updated = ExposureTable(
+        cells=entry_cells[first_entries],
+        taxonomies=entry_taxonomies[first_entries],
+        damage_states=entry_damage_states[first_entries],
+        buildings=sum_by_group(group_ids, n_groups, buildings[entries]),
+        population=sum_by_group(group_ids, n_groups, population[entries]),
+        replcostbdg=repl_per_row[entry_rows[first_entries]],
+        vocabulary=table.vocabulary,
+    )
+
+    transition_entries = entries[is_transition[entries]]
+    transition_rows = source_rows[transition_entries]
+    transition_cells = to_update.cells[transition_rows]
+    transition_taxonomies = to_update.taxonomies[transition_rows]
+    transition_from = to_update.damage_states[transition_rows]
+    transition_to = damage_states[transition_entries]
+
+    group_ids, n_groups = group_by_first_appearance(
+        transition_cells, transition_taxonomies, transition_from, transition_to
+    )
+    first_entries = first_rows_of_groups(group_ids, n_groups)
+    transitions = TransitionTable(
+        cells=transition_cells[first_entries],
+        taxonomies=transition_taxonomies[first_entries],
+        from_damage_states=transition_from[first_entries],
+        to_damage_states=transition_to[first_entries],
+        buildings=sum_by_group(
+            group_ids, n_groups, buildings[transition_entries]
+        ),
+        replcostbdg=repl_per_row[transition_rows[first_entries]],
+        vocabulary=table.vocabulary,
+    )
+
+    return concat_tables(unchanged, updated), transitions
+
+
+def prune_entries(
+    buildings, population, keep, row_buildings, row_population, pruning_epsilon
+):
+    """
+    Drop the entries with less buildings than the pruning_epsilon
+    (as share of the buildings of their row).
+
+    The buildings, population & keep matrices have one row for every
+    row of the table & one column for every damage state. The largest
+    entry of a row is always kept. In the rows in which we dropped
+    something, we scale the other entries up, so that they have the
+    very same buildings & population as the row.
+
+    This is the columnar version of gpdexposure.prune_parts (and it
+    gives the very same values). Returns the new buildings,
+    population & keep matrices.
+    """
+    n_rows, n_columns = buildings.shape
+    largest = numpy.argmax(numpy.where(keep, buildings, -numpy.inf), axis=1)
+    is_largest = numpy.zeros((n_rows, n_columns), dtype=bool)
+    is_largest[numpy.arange(n_rows), largest] = True
+    threshold = pruning_epsilon * row_buildings
+    pruned = keep & (buildings < threshold[:, numpy.newaxis]) & ~is_largest
+    rows = numpy.flatnonzero(pruned.any(axis=1))
+    if len(rows) == 0:
+        return buildings, population, keep
+
+    keep = keep & ~pruned
+    # We sum up the kept entries column by column, so that we add
+    # them in the very same order as the cell by cell version.
+    kept_buildings = numpy.zeros(len(rows))
+    kept_population = numpy.zeros(len(rows))
+    for column in range(n_columns):
+        kept = keep[rows, column]
+        kept_buildings = kept_buildings + numpy.where(
+            kept, buildings[rows, column], 0.0
+        )
+        kept_population = kept_population + numpy.where(
+            kept, population[rows, column], 0.0
+        )
+
+    building_factors = numpy.ones(len(rows))
+    with_buildings = kept_buildings > 0
+    building_factors[with_buildings] = (
+        row_buildings[rows][with_buildings] / kept_buildings[with_buildings]
+    )
+    population_factors = numpy.ones(len(rows))
+    with_population = kept_population > 0
+    population_factors[with_population] = (
+        row_population[rows][with_population]
+        / kept_population[with_population]
+    )
+
+    buildings = buildings.copy()
+    population = population.copy()
+    buildings[rows] = buildings[rows] * building_factors[:, numpy.newaxis]
+    population[rows] = population[rows] * population_factors[:, numpy.newaxis]
+    return buildings, population, keep
+
+
+def concat_tables(table1, table2):
+    """
+    Concat two exposure tables with the same taxonomy names.
+
+    The result is sorted by the cells again.
+    """
+    cells = numpy.concatenate([table1.cells, table2.cells])
+    order = numpy.argsort(cells, kind="stable")
+    return ExposureTable(
+        cells=cells[order],
+        taxonomies=numpy.concatenate([table1.taxonomies, table2.taxonomies])[
+            order
+        ],
+        damage_states=numpy.concatenate(
+            [table1.damage_states, table2.damage_states]
+        )[order],
+        buildings=numpy.concatenate([table1.buildings, table2.buildings])[
+            order
+        ],
+        population=numpy.concatenate([table1.population, table2.population])[
+            order
+        ],
+        replcostbdg=numpy.concatenate(
+            [table1.replcostbdg, table2.replcostbdg]
+        )[order],
+        vocabulary=table1.vocabulary,
+    )
+
+
+def compute_losses(transitions, loss_provider, schema, n_cells):
+    """
+    Sum up all the loss over all the transitions for each cell.
+
+    This is the columnar version of gpdexposure.compute_loss.
+    If the loss provider gives us the step coefficients & the
+    replacement costs as arrays, we compute all the losses with
+    array operations. Otherwise we ask the loss provider once for each
+    distinct combination of taxonomy, damage states & replacement costs.
+    """
+    if hasattr(loss_provider, "get_step_coefficients"):
+        single_loss_values = get_single_loss_values_from_arrays(
+            transitions, loss_provider, schema
+        )
+    else:
+        single_loss_values = get_single_loss_values(
+            transitions, loss_provider, schema
+        )
+    n_loss_values = single_loss_values * transitions.buildings
+    return numpy.bincount(
+        transitions.cells, weights=n_loss_values, minlength=n_cells
+    )
+
+
+def get_replacement_costs_for_transitions(transitions, fallback_costs):
+    """
+    Return the replacement costs for the transitions.
+
+    We want to use the replacement costs if those are given.
+    If we don't have replacement costs we use the fallback costs
+    (array indexed by the taxonomy ids).
+    """
+    replacement_costs = transitions.replcostbdg.copy()
+    missing = replacement_costs == 0
+    replacement_costs[missing] = fallback_costs[
+        transitions.taxonomies[missing]
+    ]
+    unknown = missing & numpy.isnan(replacement_costs)
+    if unknown.any():
+        taxonomy = transitions.vocabulary.get_taxonomy(
+            transitions.taxonomies[unknown][0]
+        )
+        raise Exception(
+            "no taxonomy candidates found for {0}".format(repr(taxonomy))
+        )
+    return replacement_costs
+
+
+def get_single_loss_values_from_arrays(transitions, loss_provider, schema):
+    """
+    Return the loss for one building for each of the transitions.
+
+    Uses the step coefficient array & the replacement cost array of
+    the loss provider.
+    """
+    if len(transitions) == 0:
+        return numpy.zeros(0)
+
+    step_coefficients = loss_provider.get_step_coefficients(schema)
+    if (transitions.replcostbdg == 0).any():
+        fallback_costs = loss_provider.get_replacement_costs(
+            schema, transitions.vocabulary
+        )
+    else:
+        fallback_costs = numpy.zeros(0)
+    replacement_costs = get_replacement_costs_for_transitions(
+        transitions, fallback_costs
+    )
+
+    # If there is no coefficient for the from damage state, we use 0.
+    # But we need one for the to damage state.
+    to_damage_states = transitions.to_damage_states
+    if to_damage_states.max() >= len(step_coefficients):
+        raise Exception("no loss data for the damage state")
+    coeff_to = step_coefficients[to_damage_states]
+    if numpy.isnan(coeff_to).any():
+        raise Exception("no loss data for the damage state")
+    from_damage_states = transitions.from_damage_states
+    coeff_from = numpy.zeros(len(transitions))
+    known_from = from_damage_states < len(step_coefficients)
+    coeff_from[known_from] = step_coefficients[from_damage_states[known_from]]
+    coeff_from[numpy.isnan(coeff_from)] = 0
+
+    return replacement_costs * (coeff_to - coeff_from)
+
+
+def get_single_loss_values(transitions, loss_provider, schema):
+    """
+    Return the loss for one building for each of the transitions.
+
+    Works with every loss provider that supports get_loss.
+    """
+    replacement_costs = transitions.replcostbdg.copy()
+    # We want to use the replacement costs if those are given.
+    # If we don't have replacement costs we can ask the loss_provider.
+    missing = numpy.flatnonzero(replacement_costs == 0)
+    fallback_costs = {}
+    for row in missing.tolist():
+        taxonomy = transitions.taxonomies[row]
+        if taxonomy not in fallback_costs:
+            fallback_costs[
+                taxonomy
+            ] = loss_provider.get_fallback_replacement_cost(
+                schema=schema,
+                taxonomy=transitions.vocabulary.get_taxonomy(taxonomy),
+            )
+        replacement_costs[row] = fallback_costs[taxonomy]
+
+    # We ask the loss provider once for each distinct combination.
+    unique_repl, repl_codes = numpy.unique(
+        replacement_costs, return_inverse=True
+    )
+    group_ids, n_groups = group_by_first_appearance(
+        transitions.taxonomies,
+        transitions.from_damage_states,
+        transitions.to_damage_states,
+        repl_codes.reshape(-1),
+    )
+    first_rows = first_rows_of_groups(group_ids, n_groups)
+    single_loss_values = numpy.array(
+        [
+            loss_provider.get_loss(
+                schema=schema,
+                taxonomy=transitions.vocabulary.get_taxonomy(
+                    transitions.taxonomies[row]
+                ),
+                from_damage_state=int(transitions.from_damage_states[row]),
+                to_damage_state=int(transitions.to_damage_states[row]),
+                replacement_cost=float(replacement_costs[row]),
+            )
+            for row in first_rows.tolist()
+        ],
+        dtype=numpy.float64,
+    )
+    return single_loss_values[group_ids]
@@ -21,26 +21,150 @@ and the damage states.
 
 import collections
 import json
+import os
 import re
+import tempfile
+import threading
 
 import numpy as np
+from scipy.special import ndtr, ndtri
 from scipy.stats import lognorm, norm
 
 FactoryCacheKey = collections.namedtuple("FactoryCacheKey", ["mean", "stddev"])
+FragilityParameters = collections.namedtuple(
+    "FragilityParameters", ["shape", "mean", "stddev"]
+)
+
+
+# Default number of entries that we keep in the caches.
+FACTORY_CACHE_SIZE = 1024
+FUNCTION_CACHE_SIZE = 4096
+
+CacheStatistics = collections.namedtuple(
+    "CacheStatistics", ["hits", "misses", "evictions", "size", "capacity"]
+)
+
+
+def get_cache_statistics_difference(after, before):
+    """
+    Returns the hits, misses & evictions that were counted
+    between the before & the after statistics.
+
+    The size & the capacity are the ones of after.
+    """
+    return CacheStatistics(
+        hits=after.hits - before.hits,
+        misses=after.misses - before.misses,
+        evictions=after.evictions - before.evictions,
+        size=after.size,
+        capacity=after.capacity,
+    )
+
+
+class LruCache:
+    """
+    Cache that keeps the least recently used entries.
+
+    If the capacity is None, then the cache is unbounded.
+    We count the hits, misses & evictions, so that we can
+    check if the cache pays off.
+    """
+
+    def __init__(self, capacity):
+        self.capacity = capacity
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._entries = collections.OrderedDict()
+        # The fragility functions can be shared between threads.
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # The lock can't be pickled.
+        state = dict(self.__dict__)
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def __contains__(self, key):
+        return key in self._entries
+
+    def get(self, key, compute):
+        """
+        Returns the value for the key.
+
+        If we don't have it yet, we call compute(key)
+        and store the result.
+        """
+        with self._lock:
+            if key in self._entries:
+                self.hits += 1
+                self._entries.move_to_end(key)
+                return self._entries[key]
+            self.misses += 1
+        result = compute(key)
+        self.put(key, result)
+        return result
+
+    def _evict(self):
+        """Removes the least recently used entries (if we have too many)."""
+        if self.capacity is not None:
+            while len(self._entries) > self.capacity:
+                self._entries.popitem(last=False)
+                self.evictions += 1
+
+    def put(self, key, value):
+        """Stores the value (without counting a hit or miss)."""
+        with self._lock:
+            self._entries[key] = value
+            self._entries.move_to_end(key)
+            self._evict()
+
+    def items(self):
+        """Returns the keys & values (least recently used first)."""
+        with self._lock:
+            return list(self._entries.items())
+
+    def get_statistics(self):
+        """Returns the counters of the cache."""
+        return CacheStatistics(
+            hits=self.hits,
+            misses=self.misses,
+            evictions=self.evictions,
+            size=len(self._entries),
+            capacity=self.capacity,
+        )
 
 
 class LogncdfFactory:
     """
     This is function factory for the log normal cdf.
+
+    The created functions are cached (see CachedFunction for the
+    function_cache_size and the quantization).
     """
 
-    def __init__(self):
-        self.cache = {}
+    def __init__(
+        self,
+        cache_size=FACTORY_CACHE_SIZE,
+        function_cache_size=FUNCTION_CACHE_SIZE,
+        quantization=None,
+    ):
+        self.cache = LruCache(cache_size)
+        self.function_cache_size = function_cache_size
+        self.quantization = quantization
 
     def __call__(self, mean, stddev):
-        key = FactoryCacheKey(mean, stddev)
-        if key in self.cache.keys():
-            return self.cache[key]
+        return self.cache.get(FactoryCacheKey(mean, stddev), self._create)
+
+    def _create(self, key):
+        mean, stddev = key
         # For the parameterization see:
         # https://docs.scipy.org/doc/scipy/reference/generated/scipy.stats.lognorm.html
         # "A common parametrization for a lognormal random variable
@@ -50,48 +174,122 @@ class LogncdfFactory:
         # This parametrization corresponds to setting
         # s = sigma and scale = exp(mu)."
         func = lognorm(scale=np.exp(mean), s=stddev)
-        result = CachedFunction(func.cdf)
-
-        self.cache[key] = result
-        return result
+        return CachedFunction(
+            func.cdf,
+            inverse_function=func.ppf,
+            parameters=FragilityParameters("logncdf", mean, stddev),
+            cache_size=self.function_cache_size,
+            quantization=self.quantization,
+        )
 
 
 class NormCdfFactory:
     """This is a function factory for the norm cdf."""
 
-    def __init__(self):
-        self.cache = {}
+    def __init__(
+        self,
+        cache_size=FACTORY_CACHE_SIZE,
+        function_cache_size=FUNCTION_CACHE_SIZE,
+        quantization=None,
+    ):
+        self.cache = LruCache(cache_size)
+        self.function_cache_size = function_cache_size
+        self.quantization = quantization
 
     def __call__(self, mean, stddev):
-        key = FactoryCacheKey(mean, stddev)
-        if key in self.cache.keys():
-            return self.cache[key]
+        return self.cache.get(FactoryCacheKey(mean, stddev), self._create)
+
+    def _create(self, key):
+        mean, stddev = key
         # See
         # https://docs.scipy.org/doc/scipy/reference/generated/scipy.stats.norm.html
         # "The location (loc) keyword specifies the mean.
         # The scale (scale) keyword specifies the standard deviation."
         func = norm(loc=mean, scale=stddev)
-        result = CachedFunction(func.cdf)
-
-        self.cache[key] = result
-        return result
+        return CachedFunction(
+            func.cdf,
+            inverse_function=func.ppf,
+            parameters=FragilityParameters("normcdf", mean, stddev),
+            cache_size=self.function_cache_size,
+            quantization=self.quantization,
+        )
 
 
 class CachedFunction:
     """Class to cache function calls."""
 
-    def __init__(self, inner_function):
-        """Init the instance with the given function."""
+    def __init__(
+        self,
+        inner_function,
+        inverse_function=None,
+        parameters=None,
+        cache_size=FUNCTION_CACHE_SIZE,
+        quantization=None,
+    ):
+        """
+        Init the instance with the given function.
+
+        The inverse function is optional. If given, we can use it
+        to compute the intensity thresholds.
+        The parameters (shape, mean & stddev) are optional too.
+        If given, we can compile the function (see
+        FragilityProvider.compile).
+
+        We keep up to cache_size results (None for no limit).
+        If a quantization is given, we round the values to a multiple
+        of it before we look them up (and evaluate the function
+        for the rounded value). This way close intensities share
+        one cache entry - with an error of up to quantization / 2
+        for the intensity.
+        """
         self.inner_function = inner_function
-        self.cache = {}
+        self.inverse_function = inverse_function
+        self.parameters = parameters
+        self.quantization = quantization
+        self.cache = LruCache(cache_size)
 
     def __call__(self, value):
         """Call the function with the value."""
-        if value in self.cache.keys():
-            return self.cache[value]
-        result = self.inner_function(value)
-        self.cache[value] = result
-        return result
+        if self.quantization is not None:
+            value = float(
+                np.round(value / self.quantization) * self.quantization
+            )
+        return self.cache.get(value, self.inner_function)
+
+
+def logncdf(values, mean, stddev):
+    """
+    Vectorized version of the lognorm cdf.
+
+    We do the very same operations as scipy.stats.lognorm(
+    scale=exp(mean), s=stddev).cdf, so that we get exactly the same
+    results - but without the overhead of the scipy distributions.
+    """
+    scale = np.exp(mean)
+    is_valid = (stddev > 0) & (scale > 0)
+    is_positive = values > 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        result = ndtr(np.log(values / scale) / stddev)
+    result = np.where(is_positive, result, 0.0)
+    return np.where(is_valid & ~np.isnan(values), result, np.nan)
+
+
+def normcdf(values, mean, stddev):
+    """
+    Vectorized version of the norm cdf.
+
+    Same as scipy.stats.norm(loc=mean, scale=stddev).cdf.
+    """
+    is_valid = stddev > 0
+    with np.errstate(divide="ignore", invalid="ignore"):
+        result = ndtr((values - mean) / stddev)
+    return np.where(is_valid, result, np.nan)
+
+
+COMPILED_FRAGILITY_FUNCTIONS = {
+    "logncdf": logncdf,
+    "normcdf": normcdf,
+}
 
 
 SUPPORTED_FRAGILITY_FUNCTION_FACTORIES = {
@@ -99,6 +297,216 @@ SUPPORTED_FRAGILITY_FUNCTION_FACTORIES = {
     "normcdf": NormCdfFactory(),
 }
 
+# The largest number of grid points for a tabulated function.
+MAX_TABULATION_SIZE = 2**20
+
+
+def to_standard_normal_space(shape, values):
+    """
+    Transforms the intensities, so that the cdf is the normal cdf.
+
+    For the lognormal cdf we take the log (all values <= 0
+    are -inf), for the normal cdf we keep the values as they are.
+    """
+    if shape == "logncdf":
+        with np.errstate(divide="ignore", invalid="ignore"):
+            return np.where(values <= 0, -np.inf, np.log(values))
+    return values
+
+
+class TabulatedFunction:
+    """
+    Lookup table for a lognormal or normal cdf.
+
+    We sample the cdf on a grid once & interpolate linearly
+    between the grid points. The grid is dense enough, so that
+    the absolute error is not larger than the max_error.
+    """
+
+    def __init__(self, shape, mean, stddev, grid, values, max_error):
+        self.shape = shape
+        self.mean = mean
+        self.stddev = stddev
+        self.grid = grid
+        self.values = values
+        self.max_error = max_error
+        # We don't give the parameters for the compilation here,
+        # as the compiled functions would ignore the table.
+        self.parameters = None
+
+    @classmethod
+    def build(cls, shape, mean, stddev, max_error):
+        """
+        Creates the table for the cdf.
+
+        The grid is in the space of the normal distribution
+        (see to_standard_normal_space).
+        Below the grid we return 0, above 1, so the grid must start
+        where the cdf reaches the max_error & end where it reaches
+        1 - max_error.
+        We double the number of grid points until the error
+        (checked at 4 points per interval) is small enough.
+        """
+        if not 0 < max_error < 0.5:
+            raise Exception("The max error must be between 0 and 0.5")
+        if not stddev > 0:
+            raise Exception("Can't tabulate a cdf without a positive stddev")
+        lower = mean + stddev * ndtri(max_error)
+        upper = mean + stddev * ndtri(1 - max_error)
+        n_points = 65
+        while True:
+            grid = np.linspace(lower, upper, n_points)
+            values = ndtr((grid - mean) / stddev)
+            check = np.linspace(lower, upper, 4 * (n_points - 1) + 1)
+            error = np.abs(
+                np.interp(check, grid, values) - ndtr((check - mean) / stddev)
+            ).max()
+            if error <= max_error:
+                return cls(shape, mean, stddev, grid, values, max_error)
+            if n_points > MAX_TABULATION_SIZE:
+                raise Exception(
+                    "Can't tabulate the cdf with a max error of "
+                    + str(max_error)
+                )
+            n_points = 2 * (n_points - 1) + 1
+
+    def evaluate_many(self, values):
+        """Returns the cdf values for an array of intensities."""
+        return np.interp(
+            to_standard_normal_space(self.shape, np.asarray(values)),
+            self.grid,
+            self.values,
+            left=0.0,
+            right=1.0,
+        )
+
+    def __call__(self, value):
+        """Returns the cdf value for a single intensity."""
+        return float(self.evaluate_many(np.array([value]))[0])
+
+    def inverse_function(self, probability):
+        """
+        Returns the intensity up to which the tabulated
+        probabilities are not higher than the given one.
+
+        As the table can be higher than the exact cdf by up to the
+        max_error, we use the exact inverse for the lower probability.
+        """
+        probability = max(probability - self.max_error, 0.0)
+        result = self.mean + self.stddev * ndtri(probability)
+        if self.shape == "logncdf":
+            return np.exp(result)
+        return result
+
+
+class TabulatedCdfFactory:
+    """
+    Function factory for the tabulated lognormal & normal cdfs.
+
+    The tables can be saved to a file, so that we don't need to
+    build them again.
+    """
+
+    def __init__(self, shape, max_error):
+        if shape not in COMPILED_FRAGILITY_FUNCTIONS.keys():
+            raise Exception("Not supported shape for a tabulation: " + shape)
+        self.shape = shape
+        self.max_error = max_error
+        self.cache = LruCache(None)
+
+    def __call__(self, mean, stddev):
+        return self.cache.get(FactoryCacheKey(mean, stddev), self._create)
+
+    def _create(self, key):
+        mean, stddev = key
+        if not stddev > 0:
+            # There is nothing to tabulate, so we take the exact
+            # function (that returns nan as scipy does).
+            return SUPPORTED_FRAGILITY_FUNCTION_FACTORIES[self.shape](
+                mean, stddev
+            )
+        return TabulatedFunction.build(
+            self.shape, mean, stddev, self.max_error
+        )
+
+    @classmethod
+    def load_or_create(cls, shape, max_error, file_name=None):
+        """
+        Loads the tables of the file (see from_file) if it exists and
+        has the tables for the same shape & max error. Otherwise
+        we start without any tables.
+        """
+        if file_name is not None and os.path.exists(file_name):
+            result = cls.from_file(file_name)
+            if result.shape == shape and result.max_error == max_error:
+                return result
+        return cls(shape, max_error)
+
+    def get_tables(self):
+        """Returns the keys & the tables (without the exact functions)."""
+        return [
+            (key, function)
+            for key, function in self.cache.items()
+            if isinstance(function, TabulatedFunction)
+        ]
+
+    def to_file(self, file_name):
+        """
+        Saves all the tables in a npz file.
+
+        We write a temporary file first, so that other processes
+        never read a partial file.
+        """
+        tables = self.get_tables()
+        file_descriptor, tmp_file = tempfile.mkstemp(
+            suffix=".tmp.npz", dir=os.path.dirname(os.path.abspath(file_name))
+        )
+        os.close(file_descriptor)
+        try:
+            np.savez(
+                tmp_file,
+                shape=np.array(self.shape),
+                max_error=np.array(self.max_error),
+                means=np.array(
+                    [key.mean for key, _ in tables], dtype=np.float64
+                ),
+                stddevs=np.array(
+                    [key.stddev for key, _ in tables], dtype=np.float64
+                ),
+                sizes=np.array(
+                    [len(f.grid) for _, f in tables], dtype=np.int64
+                ),
+                grids=np.concatenate([f.grid for _, f in tables] + [[]]),
+                values=np.concatenate([f.values for _, f in tables] + [[]]),
+            )
+            os.replace(tmp_file, file_name)
+        finally:
+            if os.path.exists(tmp_file):
+                os.unlink(tmp_file)
+
+    @classmethod
+    def from_file(cls, file_name):
+        """Loads the tables that we saved with to_file."""
+        with np.load(file_name) as data:
+            shape = str(data["shape"])
+            max_error = float(data["max_error"])
+            result = cls(shape, max_error)
+            offsets = np.concatenate([[0], np.cumsum(data["sizes"])])
+            for index, (mean, stddev) in enumerate(
+                zip(data["means"].tolist(), data["stddevs"].tolist())
+            ):
+                start, end = offsets[index], offsets[index + 1]
+                function = TabulatedFunction(
+                    shape,
+                    mean,
+                    stddev,
+                    data["grids"][start:end],
+                    data["values"][start:end],
+                    max_error,
+                )
+                result.cache.put(FactoryCacheKey(mean, stddev), function)
+        return result
+
 
 class DamageState:
     """
@@ -155,14 +563,35 @@ class DamageState:
         This method throws an exception if the unit for the
         fragility function is not the expected one.
         """
-        field = self.intensity_field
-        value = intensity[field]
-        unit = units[field]
+        self.check_unit(units)
+        return self.fragility_function(intensity[self.intensity_field])
 
-        if unit != self.intensity_unit:
+    def check_unit(self, units):
+        """
+        Throws an exception if the unit for the intensity field
+        is not the one that the fragility function expects.
+        """
+        if units[self.intensity_field] != self.intensity_unit:
             raise Exception("Not supported unit")
 
-        return self.fragility_function(value)
+    def get_intensity_threshold(self, epsilon):
+        """
+        Returns the intensity up to which the probability
+        of the damage state is not higher than epsilon.
+
+        If we can't compute it (because we don't know the inverse
+        of the fragility function), we return -inf, so that
+        all the intensities are above this threshold.
+        """
+        inverse_function = getattr(
+            self.fragility_function, "inverse_function", None
+        )
+        if inverse_function is None:
+            return -np.inf
+        threshold = float(inverse_function(epsilon))
+        if np.isnan(threshold):
+            return -np.inf
+        return threshold
 
 
 class Fragility:
@@ -246,19 +675,55 @@ class Fragility:
 
         return FragilityProvider(damage_states_by_taxonomy, schema)
 
-    def to_fragility_provider(self):
+    def to_fragility_provider(
+        self,
+        function_cache_size=FUNCTION_CACHE_SIZE,
+        quantization=None,
+        max_tabulation_error=None,
+        tabulation_file=None,
+    ):
         """
         Transforms the data, so that a
         provider for the supported taxonomies
         and the damage states (with the fragility functions)
         are returned.
+
+        The function_cache_size & the quantization are used for the
+        caches of the fragility functions (see CachedFunction).
+        If the max_tabulation_error is given, we use lookup tables
+        for the cdfs (see TabulatedFunction). With a tabulation_file
+        we load the tables from there (if they are for the same shape
+        & max error) and save them again if we had to build new ones.
         """
         shape = self._data["meta"]["shape"]
         fragility_function = SUPPORTED_FRAGILITY_FUNCTION_FACTORIES[shape]
+        if max_tabulation_error is not None:
+            fragility_function = TabulatedCdfFactory.load_or_create(
+                shape, max_tabulation_error, tabulation_file
+            )
+            n_loaded_tables = len(fragility_function.get_tables())
+        elif (
+            function_cache_size != fragility_function.function_cache_size
+            or quantization != fragility_function.quantization
+        ):
+            # We can't share the functions with the other providers.
+            fragility_function = type(fragility_function)(
+                function_cache_size=function_cache_size,
+                quantization=quantization,
+            )
 
-        return self.to_fragility_provider_with_specified_fragility_function(
-            fragility_function
+        fragility_provider = (
+            self.to_fragility_provider_with_specified_fragility_function(
+                fragility_function
+            )
         )
+        if (
+            max_tabulation_error is not None
+            and tabulation_file is not None
+            and len(fragility_function.get_tables()) > n_loaded_tables
+        ):
+            fragility_function.to_file(tabulation_file)
+        return fragility_provider
 
     @staticmethod
     def _add_damage_states_if_missing(damage_states_by_taxonomy):
@@ -317,6 +782,12 @@ class FragilityProvider:
     def __init__(self, damage_states_by_taxonomy, schema):
         self._damage_states_by_taxonomy = damage_states_by_taxonomy
         self.schema = schema
+        self._compiled = None
+        # The counters of the copies of the provider in other
+        # processes (see add_cache_statistics).
+        self._other_cache_statistics = CacheStatistics(
+            hits=0, misses=0, evictions=0, size=0, capacity=0
+        )
 
     def get_damage_states_for_taxonomy(self, taxonomy):
         """
@@ -330,3 +801,298 @@ class FragilityProvider:
         Returns the taxonomies from the data.
         """
         return self._damage_states_by_taxonomy.keys()
+
+    def get_intensity_thresholds(self, epsilon=0.0):
+        """
+        Returns the intensity thresholds for all of the taxonomies.
+
+        The result is a dict with the taxonomies as keys and dicts
+        with the intensity fields as keys and the thresholds as values.
+        If the intensity for a field is not above the threshold,
+        then all the transition probabilities (for this field) are
+        not higher than epsilon.
+        """
+        thresholds = {}
+        for taxonomy, damage_states in self._damage_states_by_taxonomy.items():
+            thresholds_by_field = {}
+            for damage_state in damage_states:
+                field = damage_state.intensity_field
+                threshold = damage_state.get_intensity_threshold(epsilon)
+                if field in thresholds_by_field.keys():
+                    threshold = min(threshold, thresholds_by_field[field])
+                thresholds_by_field[field] = threshold
+            thresholds[taxonomy] = thresholds_by_field
+        return thresholds
+
+    def get_cache_statistics(self):
+        """
+        Returns the summed up counters of the caches of all
+        the fragility functions.
+
+        Functions that are shared between damage states are
+        counted only once.
+        The counters that we got with add_cache_statistics are
+        included, the size is the largest one of all the processes.
+        """
+        hits, misses, evictions, size, capacity = 0, 0, 0, 0, 0
+        seen = set()
+        for damage_states in self._damage_states_by_taxonomy.values():
+            for damage_state in damage_states:
+                cache = getattr(damage_state.fragility_function, "cache", None)
+                if not isinstance(cache, LruCache) or id(cache) in seen:
+                    continue
+                seen.add(id(cache))
+                statistics = cache.get_statistics()
+                hits += statistics.hits
+                misses += statistics.misses
+                evictions += statistics.evictions
+                size += statistics.size
+                if capacity is not None and statistics.capacity is not None:
+                    capacity += statistics.capacity
+                else:
+                    # One unbounded cache is enough to be unbounded.
+                    capacity = None
+        other = self._other_cache_statistics
+        return CacheStatistics(
+            hits=hits + other.hits,
+            misses=misses + other.misses,
+            evictions=evictions + other.evictions,
+            size=max(size, other.size),
+            capacity=capacity,
+        )
+
+    def add_cache_statistics(self, statistics):
+        """
+        Adds the counters of the caches of a copy of the provider.
+
+        The worker processes evaluate the fragility functions with
+        their own copies, so we give their counters back this way.
+        """
+        other = self._other_cache_statistics
+        self._other_cache_statistics = CacheStatistics(
+            hits=other.hits + statistics.hits,
+            misses=other.misses + statistics.misses,
+            evictions=other.evictions + statistics.evictions,
+            size=max(other.size, statistics.size),
+            capacity=other.capacity,
+        )
+
+    def compile(self):
+        """
+        Returns the compiled fragility model for all of the taxonomies.
+
+        If we don't know the parameters of all of the fragility
+        functions (for example for our own functions in the tests),
+        we can't compile them and return None.
+        """
+        if self._compiled is None:
+            self._compiled = CompiledFragilityModel.from_damage_states(
+                self._damage_states_by_taxonomy
+            )
+        return self._compiled
+
+
+class CompiledTaxonomy:
+    """
+    The damage states of one taxonomy as parameter arrays.
+
+    The damage states are sorted by the from state (lowest first)
+    and the to state (highest first).
+    """
+
+    def __init__(
+        self,
+        from_states,
+        to_states,
+        means,
+        stddevs,
+        shapes,
+        intensity_fields,
+        intensity_units,
+    ):
+        self.from_states = from_states
+        self.to_states = to_states
+        self.means = means
+        self.stddevs = stddevs
+        self.shapes = shapes
+        self.intensity_fields = intensity_fields
+        self.intensity_units = intensity_units
+        self.n_damage_states = (
+            int(max(from_states.max(), to_states.max())) + 1
+            if len(to_states)
+            else 0
+        )
+
+    @classmethod
+    def from_damage_states(cls, damage_states):
+        """
+        Creates the arrays for the list of damage states.
+
+        Returns None if one of the fragility functions has no
+        parameters that we can use.
+        """
+        for damage_state in damage_states:
+            parameters = getattr(
+                damage_state.fragility_function, "parameters", None
+            )
+            if parameters is None:
+                return None
+            if parameters.shape not in COMPILED_FRAGILITY_FUNCTIONS.keys():
+                return None
+            # The compiled functions would ignore the quantization,
+            # so we use the cached functions in this case.
+            quantization = getattr(
+                damage_state.fragility_function, "quantization", None
+            )
+            if quantization is not None:
+                return None
+        # Stable sorting, so that we keep the order of the
+        # damage states that have the same from & to states
+        # (as gpdexposure.get_sorted_damage_states does).
+        damage_states = sorted(
+            damage_states, key=lambda ds: (ds.from_state, -ds.to_state)
+        )
+        parameters = [ds.fragility_function.parameters for ds in damage_states]
+        return cls(
+            from_states=np.array(
+                [ds.from_state for ds in damage_states], dtype=np.int64
+            ),
+            to_states=np.array(
+                [ds.to_state for ds in damage_states], dtype=np.int64
+            ),
+            means=np.array([p.mean for p in parameters], dtype=np.float64),
+            stddevs=np.array([p.stddev for p in parameters], dtype=np.float64),
+            shapes=np.array([p.shape for p in parameters], dtype=object),
+            intensity_fields=np.array(
+                [ds.intensity_field for ds in damage_states], dtype=object
+            ),
+            intensity_units=np.array(
+                [ds.intensity_unit for ds in damage_states], dtype=object
+            ),
+        )
+
+    def get_indices_for_damage_state(self, from_state):
+        """
+        Returns the indices of the damage states that we can reach
+        from the given one (highest to state first).
+        """
+        return np.flatnonzero(
+            (self.from_states == from_state) & (self.to_states > from_state)
+        )
+
+    def check_units(self, units, indices):
+        """
+        Throws an exception if the units don't match the ones that
+        the fragility functions expect.
+        """
+        for field, unit in zip(
+            self.intensity_fields[indices], self.intensity_units[indices]
+        ):
+            if units[field] != unit:
+                raise Exception("Not supported unit")
+
+    def evaluate(self, intensities, indices):
+        """
+        Evaluates the fragility functions for the given indices.
+
+        The intensities are a dict with one array for each
+        intensity field (all with the same length).
+        Returns a matrix with one row for each intensity value and
+        one column for each index.
+        """
+        n_values = len(next(iter(intensities.values()))) if intensities else 0
+        result = np.empty((n_values, len(indices)))
+        for shape in set(self.shapes[indices].tolist()):
+            columns = np.flatnonzero(self.shapes[indices] == shape)
+            selected = indices[columns]
+            values = np.empty((n_values, len(selected)))
+            for column, field in enumerate(self.intensity_fields[selected]):
+                values[:, column] = intensities[field]
+            result[:, columns] = COMPILED_FRAGILITY_FUNCTIONS[shape](
+                values, self.means[selected], self.stddevs[selected]
+            )
+        return result
+
+
+class CompiledFragilityModel:
+    """
+    Compiled version of the fragility functions.
+
+    Instead of calling the scipy distributions value by value, we
+    keep the parameters of the fragility functions in arrays and
+    evaluate them for whole intensity vectors at once.
+    """
+
+    def __init__(self, compiled_by_taxonomy):
+        self._compiled_by_taxonomy = compiled_by_taxonomy
+
+    @classmethod
+    def from_damage_states(cls, damage_states_by_taxonomy):
+        """
+        Compiles the damage states for all of the taxonomies.
+
+        Returns None if we can't compile one of them.
+        """
+        compiled_by_taxonomy = {}
+        for taxonomy, damage_states in damage_states_by_taxonomy.items():
+            compiled = CompiledTaxonomy.from_damage_states(damage_states)
+            if compiled is None:
+                return None
+            compiled_by_taxonomy[taxonomy] = compiled
+        return cls(compiled_by_taxonomy)
+
+    def get_to_states(self, taxonomy, from_state):
+        """
+        Returns the damage states that we can reach from the
+        given damage state (highest first).
+        """
+        if taxonomy not in self._compiled_by_taxonomy.keys():
+            return np.array([], dtype=np.int64)
+        compiled = self._compiled_by_taxonomy[taxonomy]
+        return compiled.to_states[
+            compiled.get_indices_for_damage_state(from_state)
+        ]
+
+    def get_probabilities_for_damage_state(
+        self, taxonomy, from_state, intensities, units
+    ):
+        """
+        Returns the probabilities for all the transitions from the
+        given damage state.
+
+        The result is a matrix with one row for each intensity value
+        and one column for each damage state of get_to_states.
+        The intensities are given as dict with arrays, the units
+        as dict with the unit for each intensity field.
+        """
+        n_values = len(next(iter(intensities.values()))) if intensities else 0
+        if taxonomy not in self._compiled_by_taxonomy.keys():
+            return np.zeros((n_values, 0))
+        compiled = self._compiled_by_taxonomy[taxonomy]
+        indices = compiled.get_indices_for_damage_state(from_state)
+        compiled.check_units(units, indices)
+        return compiled.evaluate(intensities, indices)
+
+    def get_transition_probabilities(self, taxonomy, intensities, units):
+        """
+        Returns the exceedance probabilities for all the transitions
+        of the taxonomy.
+
+        The result is a tensor with the shape
+        (n_values, n_damage_states, n_damage_states), so that
+        result[i, from_state, to_state] is the probability for the
+        i-th intensity value. Transitions without fragility function
+        (and those to lower damage states) have a probability of 0.
+        """
+        n_values = len(next(iter(intensities.values()))) if intensities else 0
+        if taxonomy not in self._compiled_by_taxonomy.keys():
+            return np.zeros((n_values, 0, 0))
+        compiled = self._compiled_by_taxonomy[taxonomy]
+        indices = np.flatnonzero(compiled.to_states > compiled.from_states)
+        compiled.check_units(units, indices)
+        n_damage_states = compiled.n_damage_states
+        result = np.zeros((n_values, n_damage_states, n_damage_states))
+        result[
+            :, compiled.from_states[indices], compiled.to_states[indices]
+        ] = compiled.evaluate(intensities, indices)
+        return result
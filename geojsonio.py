@@ -0,0 +1,360 @@
+#!/usr/bin/env python3
+
+# Copyright © 2021-2022 Helmholtz Centre Potsdam GFZ German Research Centre for
+# Geosciences, Potsdam, Germany
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+"""
+Module to read & write GeoJSON exposure files in batches.
+
+With geopandas.read_file we have to hold the whole exposure in
+memory (and during the update the input and the result at the same
+time). Here we parse the features one by one and give them back in
+batches of a fixed size, so that the memory that we need depends on
+the batch size only.
+The output is written feature by feature as compact json.
+"""
+
+import json
+import os
+
+import geopandas
+import numpy
+import pyproj
+
+try:
+    import orjson
+except ImportError:
+    # orjson is optional, but it makes the writing a lot faster.
+    orjson = None
+
+# Number of characters that we read from the file at once.
+READ_SIZE = 1 << 16
+
+# Names of the crs that are the same as the GeoJSON default.
+# GDAL reads them as EPSG:4326 as well.
+DEFAULT_CRS_NAMES = [
+    "urn:ogc:def:crs:OGC:1.3:CRS84",
+    "urn:ogc:def:crs:OGC::CRS84",
+    "urn:ogc:def:crs:EPSG::4326",
+    "EPSG:4326",
+]
+DEFAULT_CRS = "EPSG:4326"
+
+
+class StreamingJsonReader:
+    """
+    Reads the json values of a file one after another.
+
+    We keep only the part of the file in memory that we
+    didn't parse yet.
+    """
+
+    def __init__(self, input_file):
+        self._input_file = input_file
+        self._buffer = ""
+        self._position = 0
+        self._eof = False
+        self._decoder = json.JSONDecoder()
+
+    def _read_more(self):
+        """Read the next part of the file into the buffer."""
+        # We drop all that we parsed already.
+        position = self._position
+        self._buffer = self._buffer[position:]
+        self._position = 0
+        # If a single value is very large, then we read
+        # larger blocks, so that we don't need to parse it too often.
+        text = self._input_file.read(max(READ_SIZE, len(self._buffer)))
+        if not text:
+            self._eof = True
+        self._buffer += text
+
+    def next_char(self):
+        """
+        Return the next char that is not whitespace (and consume it).
+
+        Returns None at the end of the file.
+        """
+        while True:
+            while self._position < len(self._buffer):
+                char = self._buffer[self._position]
+                self._position += 1
+                if not char.isspace():
+                    return char
+            if self._eof:
+                return None
+            self._read_more()
+
+    def expect(self, expected_chars):
+        """Consume the next char & fail if it is not one of the expected."""
+        char = self.next_char()
+        if char is None or char not in expected_chars:
+            raise Exception(
+                "Invalid json: expected one of {0}, got {1}".format(
+                    expected_chars, char
+                )
+            )
+        return char
+
+    def peek_char(self):
+        """Return the next char that is not whitespace (but keep it)."""
+        char = self.next_char()
+        if char is not None:
+            self._position -= 1
+        return char
+
+    def next_value(self):
+        """Parse the next json value."""
+        self.peek_char()
+        while True:
+            try:
+                value, end = self._decoder.raw_decode(
+                    self._buffer, self._position
+                )
+                # A number could go on in the next part of the file.
+                if end < len(self._buffer) or self._eof:
+                    self._position = end
+                    return value
+            except json.JSONDecodeError:
+                if self._eof:
+                    raise
+            self._read_more()
+
+
+def iter_features(input_file, metadata=None):
+    """
+    Iterate over the features of a GeoJSON feature collection.
+
+    All the other top level members (like the crs) are stored in
+    the metadata dict (if given). Those that come after the features
+    are only there after we went over all the features.
+    """
+    if metadata is None:
+        metadata = {}
+    reader = StreamingJsonReader(input_file)
+    reader.expect("{")
+    if reader.peek_char() == "}":
+        reader.next_char()
+        return
+    while True:
+        key = reader.next_value()
+        reader.expect(":")
+        if key == "features":
+            reader.expect("[")
+            if reader.peek_char() == "]":
+                reader.next_char()
+            else:
+                while True:
+                    yield reader.next_value()
+                    if reader.expect(",]") == "]":
+                        break
+        else:
+            metadata[key] = reader.next_value()
+        if reader.expect(",}") == "}":
+            return
+
+
+def get_crs(metadata):
+    """Return the crs for the metadata of the feature collection."""
+    crs = metadata.get("crs")
+    if crs is None:
+        return DEFAULT_CRS
+    name = crs.get("properties", {}).get("name")
+    if name is None or name in DEFAULT_CRS_NAMES:
+        return DEFAULT_CRS
+    return pyproj.CRS.from_user_input(name)
+
+
+def iter_feature_batches(filename, batch_size):
+    """
+    Iterate over the features of the file in lists of batch_size.
+
+    Yields tuples with the list of features & the crs.
+    """
+    metadata = {}
+    batch = []
+    used_crs = None
+    with open(filename, "rt") as input_file:
+        for feature in iter_features(input_file, metadata):
+            batch.append(feature)
+            if len(batch) >= batch_size:
+                used_crs = get_crs(metadata)
+                yield batch, used_crs
+                batch = []
+    crs = get_crs(metadata)
+    if batch:
+        yield batch, crs
+    # If the crs comes after the features, we may have used the
+    # wrong one for the earlier batches.
+    if used_crs is not None and used_crs != crs:
+        raise Exception(
+            "The crs must be given before the features "
+            + "to read the file in batches"
+        )
+
+
+def features_to_dataframe(features, crs):
+    """
+    Create a geodataframe for the features.
+
+    The columns are in the same order as with geopandas.read_file.
+    """
+    dataframe = geopandas.GeoDataFrame.from_features(features, crs=crs)
+    columns = [c for c in dataframe.columns if c != "geometry"]
+    return dataframe[columns + ["geometry"]]
+
+
+def read_exposure_batches(filename, batch_size):
+    """
+    Read the exposure from the GeoJSON file in batches.
+
+    Yields one geodataframe for each batch.
+    """
+    for features, crs in iter_feature_batches(filename, batch_size):
+        yield features_to_dataframe(features, crs)
+
+
+def to_json_compatible(value):
+    """Convert the values that json can't serialize (like numpy scalars)."""
+    if isinstance(value, numpy.generic):
+        return value.item()
+    if isinstance(value, numpy.ndarray):
+        return value.tolist()
+    raise TypeError(
+        "Object of type {0} is not JSON serializable".format(
+            type(value).__name__
+        )
+    )
+
+
+def dumps_compact(value):
+    """
+    Return the compact json string (without any whitespace).
+
+    We use orjson if it is installed, as it is a lot faster.
+    """
+    if orjson is not None:
+        return orjson.dumps(
+            value,
+            default=to_json_compatible,
+            option=orjson.OPT_SERIALIZE_NUMPY,
+        ).decode("utf-8")
+    return json.dumps(
+        value,
+        separators=(",", ":"),
+        ensure_ascii=False,
+        default=to_json_compatible,
+    )
+
+
+def get_crs_member(crs):
+    """
+    Return the crs member for the GeoJSON output.
+
+    For the default crs we use the same name as GDAL. If we
+    don't have an epsg code for the crs, we don't write one.
+    """
+    if crs is None:
+        return None
+    crs = pyproj.CRS.from_user_input(crs)
+    epsg = crs.to_epsg()
+    if epsg is None:
+        return None
+    if epsg == 4326:
+        name = DEFAULT_CRS_NAMES[0]
+    else:
+        name = "urn:ogc:def:crs:EPSG::" + str(epsg)
+    return {"type": "name", "properties": {"name": name}}
+
+
+class ExposureWriter:
+    """
+    Writes the geodataframes of the batches into one GeoJSON file.
+
+    We write compact json (without any whitespace) feature by
+    feature, so we neither need to hold the whole collection
+    in memory nor to minify it later.
+    The structure of the collection is the same as GDAL writes
+    it (type, name, crs & features).
+    """
+
+    def __init__(self, output_file):
+        self.output_file = output_file
+        self._output = None
+        self._has_features = False
+        self._closed = False
+
+    def _write_header(self, crs):
+        """Write everything up to the start of the features."""
+        self._output = open(self.output_file, "wt", encoding="utf-8")
+        name = os.path.splitext(os.path.basename(self.output_file))[0]
+        self._output.write(
+            '{"type":"FeatureCollection","name":' + dumps_compact(name)
+        )
+        crs_member = get_crs_member(crs)
+        if crs_member is not None:
+            self._output.write(',"crs":' + dumps_compact(crs_member))
+        self._output.write(',"features":[')
+
+    def write(self, dataframe):
+        """Append the features of the dataframe to the file."""
+        if self._output is None:
+            self._write_header(dataframe.crs)
+        for feature in dataframe.iterfeatures(na="null"):
+            # The index is not part of the output.
+            feature.pop("id", None)
+            if self._has_features:
+                self._output.write(",")
+            self._output.write(dumps_compact(feature))
+            self._has_features = True
+
+    def close(self):
+        """
+        Close the output file.
+
+        If there was no batch at all, we write an empty
+        feature collection.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        if self._output is None:
+            self._write_header(None)
+        self._output.write("]}\n")
+        self._output.close()
+
+    def abort(self):
+        """
+        Close the output file & remove it.
+
+        If the run fails halfway, we don't want to leave a well
+        formed collection with only some of the cells.
+        """
+        if self._closed:
+            return
+        self._closed = True
+        if self._output is not None:
+            self._output.close()
+        if os.path.exists(self.output_file):
+            os.unlink(self.output_file)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_value, traceback):
+        if exc_type is not None:
+            self.abort()
+        else:
+            self.close()
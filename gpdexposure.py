@@ -21,24 +21,72 @@ Module for the exposure using a geopandas dataframe.
 
 import collections
 import ctypes
-import multiprocessing
+import itertools
+import os
 
 import geopandas
 import numpy
 import pandas
 
+import arrowio
+import executors
+import exposuretable
+import fragility
+import geojsonio
+import schemamapping
+import vocabulary
 from loss import combine_losses
 
+# Used if no executor is given.
 PARALLEL_PROCESSING = True
 
+# We split the exposure in several chunks per worker, so that
+# a worker that finished a cheap chunk can continue with the next one.
+CHUNKS_PER_CPU = 8
+
+# The columns of the expo with the values (besides the taxonomy).
+EXPO_VALUE_COLUMNS = ["Damage", "Buildings", "Population", "Repl-cost-USD-bdg"]
+
+# The series engine works cell by cell, the columnar engine
+# works with one long format table for all the cells of a chunk.
+ENGINES = ["series", "columnar"]
+
 
 def read_exposure(filename):
     """
     Function to read the exposure from the file.
+
+    GeoParquet & Arrow files are read with arrowio,
+    all the others with geopandas.
     """
+    if arrowio.is_arrow_file(filename):
+        return arrowio.read_exposure(filename)
     return geopandas.read_file(filename)
 
 
+def read_exposure_batches(filename, batch_size):
+    """
+    Read the exposure from the file in batches of batch_size cells.
+
+    Yields one geodataframe for each batch.
+    """
+    if arrowio.is_arrow_file(filename):
+        return arrowio.read_exposure_batches(filename, batch_size)
+    return geojsonio.read_exposure_batches(filename, batch_size)
+
+
+def create_exposure_writer(filename):
+    """
+    Create the writer for the updated exposure.
+
+    GeoParquet & Arrow files are written with arrowio, all the
+    others as compact GeoJSON.
+    """
+    if arrowio.is_arrow_file(filename):
+        return arrowio.ExposureWriter(filename)
+    return geojsonio.ExposureWriter(filename)
+
+
 def str_Dx_to_int(damage_state_with_d_prefix):
     """
     Function to convert damage states.
@@ -124,6 +172,10 @@ def update_exposure_transitions_and_losses(
     intensity_provider,
     fragility_provider,
     loss_provider,
+    engine="series",
+    damage_epsilon=0.0,
+    executor=None,
+    pruning_epsilon=0.0,
 ):
     """
     This is the main function to update the
@@ -133,34 +185,238 @@ def update_exposure_transitions_and_losses(
     doesn't match, then the schema_mapper will be used to map the
     exposure schema to the schema of the fragility functions.
 
+    The engine can be "series" (cell by cell) or "columnar" (all
+    cells of a chunk at once). Both give the same results.
+
+    Cells in which the intensities are too low to give a transition
+    probability higher than the damage_epsilon are passed through
+    without any transitions and without any loss.
+    With a damage_epsilon of 0 this gives the very same results
+    as computing the cells.
+
+    With a pruning_epsilon > 0 we drop the mapping fractions and the
+    parts of the updated expo rows that are below this share of
+    their row. The others are scaled up, so that the numbers of
+    buildings & the population are the same as without pruning.
+    This keeps the number of expo rows & transitions from growing
+    with every run of a chain.
+
+    The executor (see the executors module) runs the update for the
+    chunks of the exposure. If it is not given, we use all the cpus
+    if PARALLEL_PROCESSING is set.
+
     The result is a geopandas dataframe similar to the input dataframe,
     but with updated expo data, as well as fields for transitions
     (also dataframe), losses (aggregated value for all transitions as well
     as units) and the output schema.
     """
+    if engine not in ENGINES:
+        raise Exception("Engine {0} is not supported".format(engine))
+    # We only need the mapping data for our schemas, and we
+    # want to build the matrices before we send them to the
+    # worker processes.
+    schema_mapper = schema_mapper.subset(
+        source_schema=source_schema,
+        target_schema=fragility_provider.schema,
+        pruning_epsilon=pruning_epsilon,
+    )
     updater = Updater(
         source_schema,
         fragility_provider,
         schema_mapper,
         intensity_provider,
         loss_provider,
+        engine,
+        damage_epsilon,
+        pruning_epsilon,
     )
-    # So we use the pandas apply to run our function. I'm not sure if we
-    # can parallize this, but it is one of the fastest ways in python anyway.
-    n_cpus = multiprocessing.cpu_count()
-    splitted_exposure = numpy.array_split(exposure, n_cpus)
-    if PARALLEL_PROCESSING:
-        with multiprocessing.Pool(n_cpus) as pool:
-            dataframe = pandas.concat(
-                pool.map(updater.update_df, splitted_exposure),
-                sort=False,
-            )
-    else:
-        dataframe = pandas.concat(
-            [updater.update_df(x) for x in splitted_exposure],
+    if executor is None:
+        executor = get_default_executor()
+    splitted_exposure = split_for_executor(
+        exposure,
+        needs_mapping=source_schema != fragility_provider.schema,
+        executor=executor,
+    )
+    dataframe = pandas.concat(
+        map_updater_with_cache_statistics(
+            executor, updater, splitted_exposure, fragility_provider
+        ),
+        sort=False,
+    )
+    return dataframe
+
+
+def update_exposure_for_scenarios(
+    exposure,
+    source_schema,
+    schema_mapper,
+    intensity_providers,
+    fragility_provider,
+    loss_provider,
+    engine="series",
+    damage_epsilon=0.0,
+    executor=None,
+    pruning_epsilon=0.0,
+):
+    """
+    Update the exposure for several scenarios (intensity providers).
+
+    This is the same as calling update_exposure_transitions_and_losses
+    for every intensity provider, but we split the exposure only once.
+    With the columnar engine we also map the chunks to the schema of
+    the fragility functions only once & keep the mapped tables for
+    all the scenarios.
+
+    This is a generator that gives the updated exposure for one
+    scenario after the other, so that we never hold the results of
+    all the scenarios in memory. The intensity providers can be
+    a generator as well, so that we read them only when we need them.
+    Use a persistent executor (see executors.PersistentProcessExecutor)
+    to run all the scenarios on the same workers.
+    """
+    if engine not in ENGINES:
+        raise Exception("Engine {0} is not supported".format(engine))
+    schema_mapper = schema_mapper.subset(
+        source_schema=source_schema,
+        target_schema=fragility_provider.schema,
+        pruning_epsilon=pruning_epsilon,
+    )
+    if executor is None:
+        executor = get_default_executor()
+    needs_mapping = source_schema != fragility_provider.schema
+    splitted_exposure = split_for_executor(
+        exposure, needs_mapping=needs_mapping, executor=executor
+    )
+    mapped_chunks = None
+    for intensity_provider in intensity_providers:
+        updater = Updater(
+            source_schema,
+            fragility_provider,
+            schema_mapper,
+            intensity_provider,
+            loss_provider,
+            engine,
+            damage_epsilon,
+            pruning_epsilon,
+        )
+        chunks = splitted_exposure
+        if engine == "columnar" and needs_mapping:
+            if mapped_chunks is None:
+                # The mapping doesn't depend on the intensities, so
+                # we can do it once for all of the scenarios.
+                mapped_chunks = list(
+                    zip(
+                        splitted_exposure,
+                        executor.map_updater(
+                            ChunkMapper(updater), splitted_exposure
+                        ),
+                    )
+                )
+            updater = MappedChunkUpdater(updater)
+            chunks = mapped_chunks
+        yield pandas.concat(
+            map_updater_with_cache_statistics(
+                executor, updater, chunks, fragility_provider
+            ),
             sort=False,
         )
-    return dataframe
+
+
+def map_updater_with_cache_statistics(
+    executor, updater, chunks, fragility_provider
+):
+    """
+    Run the updater for all the chunks with the executor.
+
+    The worker processes use copies of the fragility provider, so
+    we add the counters of their caches to the ones of the provider.
+    This way get_cache_statistics tells us if the caches pay off,
+    no matter which executor we use.
+    """
+    results = []
+    for result, pid, statistics in executor.map_updater(
+        CacheStatisticsUpdater(updater, fragility_provider), chunks
+    ):
+        # The chunks of this process (serial & thread executors)
+        # used the caches of the provider itself.
+        if pid != os.getpid():
+            fragility_provider.add_cache_statistics(statistics)
+        results.append(result)
+    return results
+
+
+def get_default_executor():
+    """
+    Return the executor that we use if there is no other given.
+    """
+    if PARALLEL_PROCESSING:
+        return executors.ProcessExecutor()
+    return executors.SerialExecutor()
+
+
+def split_for_executor(exposure, needs_mapping, executor):
+    """
+    Split the exposure into chunks with similar costs for
+    the workers of the executor.
+    """
+    cell_costs = estimate_cell_costs(exposure, needs_mapping=needs_mapping)
+    return split_by_costs(
+        exposure, cell_costs, executor.workers * CHUNKS_PER_CPU
+    )
+
+
+def estimate_cell_costs(exposure, needs_mapping):
+    """
+    Estimate how expensive the update for each cell is.
+
+    Cells without buildings are cheap, as they return early.
+    For all the others the cost grows with the number of taxonomies
+    and damage states (and we have even more to do if we
+    must map them to another schema).
+    """
+    costs = numpy.ones(len(exposure))
+    for cell, expo in enumerate(exposure["expo"].tolist()):
+        n_rows = len(expo["Taxonomy"])
+        if needs_mapping:
+            costs[cell] += n_rows
+        buildings = expo.get("Buildings", [])
+        if isinstance(buildings, dict):
+            buildings = buildings.values()
+        if any(x > 0 for x in buildings):
+            costs[cell] += n_rows
+    return costs
+
+
+def split_by_costs(exposure, costs, n_chunks):
+    """
+    Split the exposure into up to n_chunks parts with similar costs.
+
+    The chunks are contiguous, so that we can just concat the
+    results to get them in the order of the input.
+    """
+    if len(exposure) == 0:
+        return [exposure]
+    cumulative_costs = numpy.cumsum(costs)
+    targets = (
+        cumulative_costs[-1] * numpy.arange(1, n_chunks) / float(n_chunks)
+    )
+    # We cut where the cumulative costs are the closest to the targets.
+    after = numpy.minimum(
+        numpy.searchsorted(cumulative_costs, targets),
+        len(cumulative_costs) - 1,
+    )
+    before = numpy.maximum(after - 1, 0)
+    take_before = numpy.abs(cumulative_costs[before] - targets) < numpy.abs(
+        cumulative_costs[after] - targets
+    )
+    boundaries = numpy.where(take_before, before, after) + 1
+    boundaries = numpy.unique(
+        numpy.concatenate([[0], boundaries, [len(exposure)]])
+    )
+    return [
+        exposure.iloc[start:end]
+        for start, end in zip(boundaries[:-1], boundaries[1:])
+    ]
 
 
 def map_exposure(expo, source_schema, target_schema, schema_mapper):
@@ -176,35 +432,35 @@ def map_exposure(expo, source_schema, target_schema, schema_mapper):
     n_buildings_per_tax = collections.defaultdict(zero)
     total_repl_per_tax = collections.defaultdict(zero)
 
+    compiled_mapping = schema_mapper.compile_mapping(
+        source_schema, target_schema
+    )
+
     for old_expo_key, old_expo_value in expo.items():
         # One taxonomy with a damage state can map to different other
         # taxonomies and different damage states.
-        mapping_results = schema_mapper.map_schema(
-            source_taxonomy=old_expo_key.taxonomy,
-            source_damage_state=old_expo_key.damage_state,
-            source_schema=source_schema,
-            target_schema=target_schema,
-            # We want to keep it as a number between 0 and 1
-            # so that we are able to map the population as well.
-            n_buildings=1.0,
+        # The fractions are for one building, so that we are able to
+        # map the population as well.
+        targets = compiled_mapping.get_targets(
+            old_expo_key.taxonomy, old_expo_key.damage_state
         )
 
-        for res in mapping_results:
-            expo_key = ExpoKey(res.taxonomy, res.damage_state)
-            # res.n_buildings is now only a number from 0 to 1.
+        for taxonomy, damage_state, fraction in targets:
+            expo_key = ExpoKey(taxonomy, damage_state)
+            # The fraction is only a number from 0 to 1.
             # So we need to do the multiplication ourselves
             # (but we can reuse the mapping value for others...)
             expo_value = result_expo[expo_key]
 
-            new_buildings = res.n_buildings * old_expo_value.buildings
+            new_buildings = fraction * old_expo_value.buildings
             expo_value.buildings += new_buildings
-            n_buildings_per_tax[res.taxonomy] += new_buildings
+            n_buildings_per_tax[taxonomy] += new_buildings
 
-            new_pop = res.n_buildings * old_expo_value.population
+            new_pop = fraction * old_expo_value.population
             expo_value.population += new_pop
 
             new_repl = new_buildings * old_expo_value.replcostbdg
-            total_repl_per_tax[res.taxonomy] += new_repl
+            total_repl_per_tax[taxonomy] += new_repl
 
     for expo_key, expo_value in result_expo.items():
         taxonomy = expo_key.taxonomy
@@ -215,12 +471,68 @@ def map_exposure(expo, source_schema, target_schema, schema_mapper):
     return result_expo
 
 
+def map_exposure_dataframe(
+    exposure, source_schema, target_schema, schema_mapper
+):
+    """
+    Map the expo of all the cells of the exposure to the target schema.
+
+    Returns a copy of the exposure with the mapped expo. Updating
+    it (with the target schema as exposure schema) gives the
+    same results as updating the original exposure.
+    """
+    taxonomy_vocabulary = vocabulary.Vocabulary()
+    mapped_table = exposuretable.map_table(
+        table=expo_table_from_dataframe(
+            exposure, source_schema, taxonomy_vocabulary
+        ),
+        source_schema=source_schema,
+        target_schema=target_schema,
+        schema_mapper=schema_mapper,
+    )
+    mapped_exposure = exposure.copy()
+    mapped_exposure["expo"] = expo_table_to_dicts(mapped_table, len(exposure))
+    return mapped_exposure
+
+
+def can_be_damaged(expo, intensity, intensity_thresholds):
+    """
+    Check if any of the buildings in the cell can be damaged.
+
+    This is the case if any intensity that is relevant for the
+    taxonomies in the cell is above the threshold.
+    """
+    for expo_key, expo_value in expo.items():
+        if expo_value.buildings <= 0:
+            continue
+        if expo_key.taxonomy not in intensity_thresholds.keys():
+            # We don't know anything about this taxonomy,
+            # so we must compute it.
+            return True
+        thresholds_by_field = intensity_thresholds[expo_key.taxonomy]
+        for field, threshold in thresholds_by_field.items():
+            if intensity[field] > threshold:
+                return True
+    return False
+
+
 def get_updated_exposure_and_transitions(
-    geometry, expo, intensity_provider, fragility_provider
+    geometry,
+    expo,
+    intensity_provider,
+    fragility_provider,
+    intensity_thresholds=None,
+    pruning_epsilon=0.0,
 ):
     """
     This function returns the update exposure and all of
     the transitions that happend in this step.
+
+    If the intensity thresholds are given (see
+    FragilityProvider.get_intensity_thresholds), we skip the evaluation
+    of the fragility functions for cells that can't be damaged.
+    With a pruning_epsilon > 0 we drop the parts of the buildings
+    of an expo row that are below this share (see prune_parts).
     """
     # Again, we can't be sure that those columns are there.
     # We use just zeros if they are not.
@@ -236,6 +548,13 @@ def get_updated_exposure_and_transitions(
     lon, lat = centroid.x, centroid.y
     intensity, units = intensity_provider.get_nearest(lon=lon, lat=lat)
 
+    if intensity_thresholds is None:
+        cell_can_be_damaged = True
+    else:
+        cell_can_be_damaged = can_be_damaged(
+            expo, intensity, intensity_thresholds
+        )
+
     result_expo = collections.defaultdict(empty_expo_values)
 
     # Calculate the replacement costs for each taxonomy
@@ -261,11 +580,22 @@ def get_updated_exposure_and_transitions(
         damage_states_to_care = get_sorted_damage_states(
             fragility_provider, taxonomy, old_damage_state
         )
+        # The parts of the buildings as (to damage state, buildings,
+        # population) tuples; the to damage state is None for the
+        # buildings that stay in their damage state.
+        parts = []
 
         for single_damage_state in damage_states_to_care:
-            probability = single_damage_state.get_probability_for_intensity(
-                intensity, units
-            )
+            if cell_can_be_damaged:
+                probability = (
+                    single_damage_state.get_probability_for_intensity(
+                        intensity, units
+                    )
+                )
+            else:
+                # We still want to fail if the units don't match.
+                single_damage_state.check_unit(units)
+                probability = 0.0
             expo_key = ExpoKey(taxonomy, single_damage_state.to_state)
 
             # We care about both the number of buildings and the population.
@@ -275,27 +605,43 @@ def get_updated_exposure_and_transitions(
             n_pop_left -= n_population_in_damage_state
 
             if n_buildings_in_damage_state > 0:
-                expo_value = result_expo[expo_key]
-
-                expo_value.buildings += n_buildings_in_damage_state
-                expo_value.population += n_population_in_damage_state
-
-                transition_key = TransitionKey(
-                    taxonomy,
-                    old_damage_state,
-                    single_damage_state.to_state,
+                parts.append(
+                    (
+                        single_damage_state.to_state,
+                        n_buildings_in_damage_state,
+                        n_population_in_damage_state,
+                    )
                 )
-                result_transitions[
-                    transition_key
-                ].buildings += n_buildings_in_damage_state
 
         # If we have buildings left in the given damage state, than we must
         # add them in the n_buildings as well, but we don't need a transition.
         if n_left > 0:
-            expo_key = ExpoKey(taxonomy, old_damage_state)
+            parts.append((None, n_left, n_pop_left))
+
+        if pruning_epsilon > 0:
+            parts = prune_parts(
+                parts,
+                old_expo_value.buildings,
+                old_expo_value.population,
+                pruning_epsilon,
+            )
+
+        for to_damage_state, n_buildings, n_population in parts:
+            if to_damage_state is None:
+                expo_key = ExpoKey(taxonomy, old_damage_state)
+            else:
+                expo_key = ExpoKey(taxonomy, to_damage_state)
             expo_value = result_expo[expo_key]
-            expo_value.buildings += n_left
-            expo_value.population += n_pop_left
+            expo_value.buildings += n_buildings
+            expo_value.population += n_population
+
+            if to_damage_state is not None:
+                transition_key = TransitionKey(
+                    taxonomy,
+                    old_damage_state,
+                    to_damage_state,
+                )
+                result_transitions[transition_key].buildings += n_buildings
 
     # Replacement costs per building; specific for the taxonomies
     repl_per_tax = collections.defaultdict(zero)
@@ -322,6 +668,36 @@ def get_updated_exposure_and_transitions(
     return result_expo, result_transitions
 
 
+def prune_parts(parts, buildings, population, pruning_epsilon):
+    """
+    Drop the parts with less buildings than the pruning_epsilon
+    (as share of the buildings of the expo row).
+
+    The remaining parts are scaled up, so that they have
+    the very same buildings & population as the row.
+    This is the cell by cell version of exposuretable.prune_entries.
+    """
+    kept = schemamapping.find_entries_to_keep(
+        [n_buildings for _, n_buildings, _ in parts],
+        buildings,
+        pruning_epsilon,
+    )
+    if len(kept) == len(parts):
+        return parts
+    parts = [parts[index] for index in kept]
+    return list(
+        zip(
+            [to_damage_state for to_damage_state, _, _ in parts],
+            schemamapping.renormalize(
+                [n_buildings for _, n_buildings, _ in parts], buildings
+            ),
+            schemamapping.renormalize(
+                [n_population for _, _, n_population in parts], population
+            ),
+        )
+    )
+
+
 def compute_loss(transitions, loss_provider, schema):
     """Sum up all the loss over all the transitions."""
     loss_value = 0
@@ -384,12 +760,30 @@ class Updater:
         schema_mapper,
         intensity_provider,
         loss_provider,
+        engine="series",
+        damage_epsilon=0.0,
+        pruning_epsilon=0.0,
     ):
         self.source_schema = source_schema
         self.fragility_provider = fragility_provider
         self.schema_mapper = schema_mapper
         self.intensity_provider = intensity_provider
         self.loss_provider = loss_provider
+        self.engine = engine
+        self.pruning_epsilon = pruning_epsilon
+        # The columnar engine works with integer ids for the taxonomies.
+        self.vocabulary = vocabulary.Vocabulary()
+        for taxonomy in fragility_provider.get_taxonomies():
+            self.vocabulary.intern(fragility_provider.schema, taxonomy)
+        # This is None if we can't compile the fragility functions.
+        # In this case the columnar engine evaluates them value by value.
+        self.compiled_fragility = fragility_provider.compile()
+        if damage_epsilon is None:
+            self.intensity_thresholds = None
+        else:
+            self.intensity_thresholds = (
+                fragility_provider.get_intensity_thresholds(damage_epsilon)
+            )
 
     def update_df(self, dataframe):
         """
@@ -402,14 +796,163 @@ class Updater:
         # a name, we don't want that.
         if dataframe.empty:
             return None
-        list_of_series = dataframe.apply(self.update_series, axis=1)
-        return geopandas.GeoDataFrame(list_of_series)
+        if self.engine == "columnar":
+            return self.update_df_columnar(dataframe)
+        # We update the cells one by one, but we compute the losses
+        # for the transitions of all the cells at once.
+        rows = [series for _, series in dataframe.iterrows()]
+        updates = [self.update_cell(series) for series in rows]
+        loss_values = exposuretable.compute_losses(
+            transitions=transition_table_from_dicts(
+                [transitions for _, transitions in updates],
+                self.fragility_provider.schema,
+                self.vocabulary,
+            ),
+            loss_provider=self.loss_provider,
+            schema=self.fragility_provider.schema,
+            n_cells=len(rows),
+        ).tolist()
+        list_of_series = pandas.DataFrame(
+            [
+                self.create_output_series(
+                    series, updated_exposure, transitions, loss_value
+                )
+                for series, (updated_exposure, transitions), loss_value in zip(
+                    rows, updates, loss_values
+                )
+            ],
+            index=dataframe.index,
+        )
+        return geopandas.GeoDataFrame(
+            list_of_series, crs=getattr(dataframe, "crs", None)
+        )
+
+    def map_df_columnar(self, dataframe):
+        """
+        Map the cells of the dataframe to the schema of the fragility
+        functions.
+
+        Returns the long format table for the cells.
+        """
+        old_exposure = expo_table_from_dataframe(
+            dataframe, self.source_schema, self.vocabulary
+        )
+        return exposuretable.map_table(
+            table=old_exposure,
+            source_schema=self.source_schema,
+            target_schema=self.fragility_provider.schema,
+            schema_mapper=self.schema_mapper,
+        )
+
+    def update_df_columnar(self, dataframe, mapped_exposure=None):
+        """
+        Runs the update for all the cells of the dataframe at once.
+
+        This gives the very same results as update_series, but works
+        on a long format table for all the cells.
+        If the mapped_exposure is given (see map_df_columnar), we
+        don't need to map the cells again.
+        """
+        n_cells = len(dataframe)
+        if mapped_exposure is None:
+            mapped_exposure = self.map_df_columnar(dataframe)
+        intensities, units = get_intensities_for_cells(
+            geometries=dataframe.geometry,
+            needed=cells_with_buildings(mapped_exposure, n_cells),
+            intensity_provider=self.intensity_provider,
+        )
+        if self.intensity_thresholds is None:
+            affected_cells = None
+        else:
+            affected_cells = exposuretable.find_affected_cells(
+                table=mapped_exposure,
+                intensities=intensities,
+                intensity_thresholds=self.intensity_thresholds,
+                n_cells=n_cells,
+            )
+        updated_exposure, transitions = exposuretable.update_table(
+            table=mapped_exposure,
+            intensities=intensities,
+            units=units,
+            fragility_provider=self.fragility_provider,
+            sorted_damage_states=get_sorted_damage_states,
+            affected_cells=affected_cells,
+            compiled_fragility=self.compiled_fragility,
+            pruning_epsilon=self.pruning_epsilon,
+        )
+        loss_values = exposuretable.compute_losses(
+            transitions=transitions,
+            loss_provider=self.loss_provider,
+            schema=self.fragility_provider.schema,
+            n_cells=n_cells,
+        )
+        loss_unit = self.loss_provider.get_unit()
+
+        if "cum_loss_value" in dataframe.columns:
+            existing_loss_values = dataframe["cum_loss_value"].tolist()
+        else:
+            existing_loss_values = [0.0] * n_cells
+        if "cum_loss_unit" in dataframe.columns:
+            existing_loss_units = dataframe["cum_loss_unit"].tolist()
+        else:
+            existing_loss_units = [None] * n_cells
+
+        combined_losses = [
+            combine_losses(
+                loss_value=loss_value,
+                loss_unit=loss_unit,
+                existing_loss_value=existing_loss_value,
+                existing_loss_unit=existing_loss_unit,
+            )
+            for loss_value, existing_loss_value, existing_loss_unit in zip(
+                loss_values.tolist(),
+                existing_loss_values,
+                existing_loss_units,
+            )
+        ]
+
+        return geopandas.GeoDataFrame(
+            pandas.DataFrame(
+                {
+                    "gid": dataframe["gid"].tolist(),
+                    "geometry": dataframe.geometry.tolist(),
+                    "expo": expo_table_to_dicts(updated_exposure, n_cells),
+                    "schema": [self.fragility_provider.schema] * n_cells,
+                    "transitions": transition_table_to_dicts(
+                        transitions, n_cells
+                    ),
+                    "loss_value": loss_values.tolist(),
+                    "loss_unit": [loss_unit] * n_cells,
+                    "cum_loss_value": [x[0] for x in combined_losses],
+                    "cum_loss_unit": [x[1] for x in combined_losses],
+                },
+                index=dataframe.index,
+            ),
+            crs=getattr(dataframe, "crs", None),
+        )
 
     def update_series(self, series):
         """
         This is the function that should be applied to *every* cell in the
         exposure.
         """
+        updated_exposure, transitions = self.update_cell(series)
+        # After that we can compute the loss of all the transitions in the cell
+        loss_value = compute_loss(
+            transitions=transitions,
+            loss_provider=self.loss_provider,
+            schema=self.fragility_provider.schema,
+        )
+        return self.create_output_series(
+            series, updated_exposure, transitions, loss_value
+        )
+
+    def update_cell(self, series):
+        """
+        Map & update the expo of the cell.
+
+        Returns the updated expo & the transitions (as dicts).
+        """
         # First we prepare our input.
         old_exposure = expo_from_series_to_dict(series.expo)
 
@@ -429,13 +972,18 @@ class Updater:
             expo=mapped_exposure,
             intensity_provider=self.intensity_provider,
             fragility_provider=self.fragility_provider,
+            intensity_thresholds=self.intensity_thresholds,
+            pruning_epsilon=self.pruning_epsilon,
         )
-        # After that we can compute the loss of all the transitions in the cell
-        loss_value = compute_loss(
-            transitions=transitions,
-            loss_provider=self.loss_provider,
-            schema=self.fragility_provider.schema,
-        )
+        return updated_exposure, transitions
+
+    def create_output_series(
+        self, series, updated_exposure, transitions, loss_value
+    ):
+        """
+        Create the output for the cell with the updated expo,
+        the transitions & the loss.
+        """
         loss_unit = self.loss_provider.get_unit()
 
         # Why the cum_loss_value?
@@ -487,6 +1035,63 @@ class Updater:
         )
 
 
+class CacheStatisticsUpdater:
+    """
+    Runs the update of the chunks with another updater & gives
+    back the change of the cache counters of the fragility provider
+    (together with the process id).
+    """
+
+    def __init__(self, updater, fragility_provider):
+        self.updater = updater
+        self.fragility_provider = fragility_provider
+
+    def update_df(self, chunk):
+        """Returns the result, the process id & the cache counters."""
+        before = self.fragility_provider.get_cache_statistics()
+        result = self.updater.update_df(chunk)
+        after = self.fragility_provider.get_cache_statistics()
+        return (
+            result,
+            os.getpid(),
+            fragility.get_cache_statistics_difference(after, before),
+        )
+
+
+class ChunkMapper:
+    """
+    Maps the chunks to the schema of the fragility functions
+    (with the columnar engine) without updating them.
+    """
+
+    def __init__(self, updater):
+        self.updater = updater
+
+    def update_df(self, dataframe):
+        """Return the long format table of the mapped cells."""
+        if dataframe.empty:
+            return None
+        return self.updater.map_df_columnar(dataframe)
+
+
+class MappedChunkUpdater:
+    """
+    Updates the chunks that are mapped already (see ChunkMapper).
+
+    The chunks are tuples of the dataframe & its mapped table.
+    """
+
+    def __init__(self, updater):
+        self.updater = updater
+
+    def update_df(self, chunk):
+        """Runs the update for the dataframe with the mapped table."""
+        dataframe, mapped_exposure = chunk
+        if mapped_exposure is None:
+            return self.updater.update_df(dataframe)
+        return self.updater.update_df_columnar(dataframe, mapped_exposure)
+
+
 def updated_exposure_output_to_dict(updated_exposure):
     """Convert to data to a dict for output."""
     result = {}
@@ -575,3 +1180,263 @@ def get_from_series_expo(column, idx, default):
             return column[idx]
         return default
     return column.get(idx, default)
+
+
+def expo_table_from_lists(expos, schema, vocabulary):
+    """
+    Convert the expo dicts to a long format table without going
+    row by row.
+
+    This only works if all the columns of an expo are lists with the
+    same length & if there is no taxonomy & damage state twice in a
+    cell. Returns None otherwise.
+    """
+    lengths = []
+    for expo in expos:
+        taxonomies = expo["Taxonomy"]
+        if not isinstance(taxonomies, list):
+            return None
+        for column in EXPO_VALUE_COLUMNS:
+            values = expo.get(column)
+            if not isinstance(values, list) or len(values) != len(taxonomies):
+                return None
+        lengths.append(len(taxonomies))
+
+    def concat(column):
+        return list(
+            itertools.chain.from_iterable(expo[column] for expo in expos)
+        )
+
+    taxonomies = concat("Taxonomy")
+    damages = concat("Damage")
+    # We add the taxonomies to the vocabulary in the order in which
+    # they appear (as the row by row version).
+    taxonomy_ids = {
+        taxonomy: vocabulary.intern(schema, taxonomy)
+        for taxonomy in dict.fromkeys(taxonomies)
+    }
+    damage_state_ints = {
+        damage: str_Dx_to_int(damage) for damage in dict.fromkeys(damages)
+    }
+    table = exposuretable.ExposureTable(
+        cells=numpy.repeat(
+            numpy.arange(len(expos), dtype=numpy.int64), lengths
+        ),
+        taxonomies=numpy.array(
+            [taxonomy_ids[taxonomy] for taxonomy in taxonomies],
+            dtype=numpy.int64,
+        ),
+        damage_states=numpy.array(
+            [damage_state_ints[damage] for damage in damages],
+            dtype=numpy.int64,
+        ),
+        buildings=numpy.array(concat("Buildings"), dtype=numpy.float64),
+        population=numpy.array(concat("Population"), dtype=numpy.float64),
+        replcostbdg=numpy.array(
+            concat("Repl-cost-USD-bdg"), dtype=numpy.float64
+        ),
+        vocabulary=vocabulary,
+    )
+    _, n_groups = exposuretable.group_by_first_appearance(
+        table.cells, table.taxonomies, table.damage_states
+    )
+    if n_groups != len(table):
+        return None
+    return table
+
+
+def expo_table_from_dataframe(dataframe, schema, vocabulary):
+    """
+    Convert the expo column of the dataframe to a long format table.
+
+    This is the columnar version of expo_from_series_to_dict.
+    The taxonomies are stored with their ids in the vocabulary.
+    """
+    table = expo_table_from_lists(
+        dataframe["expo"].tolist(), schema, vocabulary
+    )
+    if table is not None:
+        return table
+
+    cells = []
+    taxonomies = []
+    damage_states = []
+    buildings = []
+    population = []
+    replcostbdg = []
+    taxonomy_ids = {}
+
+    for cell, expo in enumerate(dataframe["expo"].tolist()):
+        if isinstance(expo["Taxonomy"], list):
+            idx_generator = range(len(expo["Taxonomy"]))
+        else:
+            idx_generator = expo["Taxonomy"].keys()
+
+        # Same as for the dicts: If we have a taxonomy & damage state
+        # twice, then the last one wins.
+        rows_by_expo_key = {}
+        for idx in idx_generator:
+            taxonomy = get_from_series_expo(expo["Taxonomy"], idx, None)
+            if taxonomy not in taxonomy_ids:
+                taxonomy_ids[taxonomy] = vocabulary.intern(schema, taxonomy)
+            expo_key = ExpoKey(
+                taxonomy_ids[taxonomy],
+                str_Dx_to_int(get_from_series_expo(expo["Damage"], idx, None)),
+            )
+            row = (
+                get_from_series_expo(expo.get("Buildings", []), idx, 0),
+                get_from_series_expo(expo.get("Population", []), idx, 0),
+                get_from_series_expo(
+                    expo.get("Repl-cost-USD-bdg", []), idx, 0
+                ),
+            )
+            rows_by_expo_key[expo_key] = row
+
+        for expo_key, row in rows_by_expo_key.items():
+            cells.append(cell)
+            taxonomies.append(expo_key.taxonomy)
+            damage_states.append(expo_key.damage_state)
+            buildings.append(row[0])
+            population.append(row[1])
+            replcostbdg.append(row[2])
+
+    return exposuretable.ExposureTable(
+        cells=numpy.array(cells, dtype=numpy.int64),
+        taxonomies=numpy.array(taxonomies, dtype=numpy.int64),
+        damage_states=numpy.array(damage_states, dtype=numpy.int64),
+        buildings=numpy.array(buildings, dtype=numpy.float64),
+        population=numpy.array(population, dtype=numpy.float64),
+        replcostbdg=numpy.array(replcostbdg, dtype=numpy.float64),
+        vocabulary=vocabulary,
+    )
+
+
+def transition_table_from_dicts(transitions_by_cell, schema, vocabulary):
+    """
+    Convert the transition dicts (one for each cell) to a long
+    format table.
+
+    This is the columnar version of the transitions of
+    get_updated_exposure_and_transitions, so that we can compute
+    the losses for all the cells at once.
+    """
+    cells = []
+    taxonomies = []
+    from_damage_states = []
+    to_damage_states = []
+    buildings = []
+    replcostbdg = []
+    taxonomy_ids = {}
+
+    for cell, transitions in enumerate(transitions_by_cell):
+        for transition_key, transition_value in transitions.items():
+            taxonomy = transition_key.taxonomy
+            if taxonomy not in taxonomy_ids:
+                taxonomy_ids[taxonomy] = vocabulary.intern(schema, taxonomy)
+            cells.append(cell)
+            taxonomies.append(taxonomy_ids[taxonomy])
+            from_damage_states.append(transition_key.from_damage_state)
+            to_damage_states.append(transition_key.to_damage_state)
+            buildings.append(transition_value.buildings)
+            replcostbdg.append(transition_value.replcostbdg)
+
+    return exposuretable.TransitionTable(
+        cells=numpy.array(cells, dtype=numpy.int64),
+        taxonomies=numpy.array(taxonomies, dtype=numpy.int64),
+        from_damage_states=numpy.array(from_damage_states, dtype=numpy.int64),
+        to_damage_states=numpy.array(to_damage_states, dtype=numpy.int64),
+        buildings=numpy.array(buildings, dtype=numpy.float64),
+        replcostbdg=numpy.array(replcostbdg, dtype=numpy.float64),
+        vocabulary=vocabulary,
+    )
+
+
+def cells_with_buildings(table, n_cells):
+    """Return a boolean array for the cells that have buildings."""
+    return (
+        numpy.bincount(
+            table.cells, weights=table.buildings > 0, minlength=n_cells
+        )
+        > 0
+    )
+
+
+def get_intensities_for_cells(geometries, needed, intensity_provider):
+    """
+    Return the intensities for the centroids of the cells.
+
+    The result is a dict with an array for each intensity measure
+    (containing nan for the cells that we don't need) and a dict
+    with the units.
+
+    We query all the needed cells with one single call of
+    get_nearest_many.
+    """
+    n_cells = len(needed)
+    cell_indices = numpy.flatnonzero(needed)
+    cell_geometries = geometries.tolist()
+    centroids = [cell_geometries[cell].centroid for cell in cell_indices]
+    lons = numpy.array([centroid.x for centroid in centroids])
+    lats = numpy.array([centroid.y for centroid in centroids])
+
+    needed_intensities, units = intensity_provider.get_nearest_many(
+        lons=lons, lats=lats
+    )
+    intensities = {}
+    for column, needed_values in needed_intensities.items():
+        needed_values = numpy.asarray(needed_values)
+        if needed_values.dtype.kind in "biuf":
+            values = numpy.full(n_cells, numpy.nan)
+        else:
+            # The shakemaps can contain string columns too, so we
+            # keep those as object arrays.
+            values = numpy.full(n_cells, numpy.nan, dtype=object)
+        values[cell_indices] = needed_values
+        intensities[column] = values
+    return intensities, units
+
+
+def expo_table_to_dicts(table, n_cells):
+    """Convert the exposure table to one expo dict per cell for output."""
+    taxonomies = table.vocabulary.get_taxonomies(table.taxonomies.tolist())
+    damages = [int_x_to_str_Dx(x) for x in table.damage_states.tolist()]
+    buildings = table.buildings.tolist()
+    population = table.population.tolist()
+    replcostbdg = table.replcostbdg.tolist()
+
+    boundaries = numpy.searchsorted(table.cells, numpy.arange(n_cells + 1))
+    result = []
+    for start, end in zip(boundaries[:-1].tolist(), boundaries[1:].tolist()):
+        result.append(
+            {
+                "Taxonomy": taxonomies[start:end],
+                "Damage": damages[start:end],
+                "Buildings": buildings[start:end],
+                "Population": population[start:end],
+                "Repl-cost-USD-bdg": replcostbdg[start:end],
+            }
+        )
+    return result
+
+
+def transition_table_to_dicts(table, n_cells):
+    """Convert the transition table to one dict per cell for output."""
+    taxonomies = table.vocabulary.get_taxonomies(table.taxonomies.tolist())
+    from_damage_states = table.from_damage_states.tolist()
+    to_damage_states = table.to_damage_states.tolist()
+    buildings = table.buildings.tolist()
+    replcostbdg = table.replcostbdg.tolist()
+
+    boundaries = numpy.searchsorted(table.cells, numpy.arange(n_cells + 1))
+    result = []
+    for start, end in zip(boundaries[:-1].tolist(), boundaries[1:].tolist()):
+        result.append(
+            {
+                "taxonomy": taxonomies[start:end],
+                "from_damage_state": from_damage_states[start:end],
+                "to_damage_state": to_damage_states[start:end],
+                "n_buildings": buildings[start:end],
+                "replacement_costs_usd_bdg": replcostbdg[start:end],
+            }
+        )
+    return result
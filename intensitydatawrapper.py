@@ -38,6 +38,12 @@ The commom protocol is to support the following methods:
   Similar to te get_value_for_column_and_index method,
   but returns the unit. Can ignore the index if it is the
   same for the whole dataset.
+- get_values_for_column(column):
+  Returns all the values of the column (in the same order
+  as the coordinates). Used for the batch queries.
+- get_unit_for_column(column):
+  Returns the unit of the column. The batch queries
+  need one single unit for the whole column.
 """
 
 import re
@@ -108,6 +114,23 @@ class GeopandasDataFrameWrapper:
         series = self._gdf.iloc[index]
         return series[unit_column]
 
+    def get_values_for_column(self, column):
+        """
+        Returns all the values for the column.
+        """
+        value_column = self._prefix_value_columns + column
+        return self._gdf[value_column].values
+
+    def get_unit_for_column(self, column):
+        """
+        Returns the unit for the whole column.
+        """
+        unit_column = self._prefix_unit_columns + column
+        units = self._gdf[unit_column].unique()
+        if len(units) != 1:
+            raise Exception("There is no single unit for the column " + column)
+        return units[0]
+
 
 class GeopandasDataFrameWrapperWithColumnUnit:
     """
@@ -158,6 +181,18 @@ class GeopandasDataFrameWrapperWithColumnUnit:
         """
         return self._unit
 
+    def get_values_for_column(self, column):
+        """
+        Returns all the values for the column.
+        """
+        return self._gdf[self._column].values
+
+    def get_unit_for_column(self, column):
+        """
+        Returns the unit for the whole column.
+        """
+        return self._unit
+
 
 class RasterDataWrapper:
     """
@@ -229,6 +264,18 @@ class RasterDataWrapper:
             column, index
         )
 
+    def get_values_for_column(self, column):
+        """
+        Returns all the values for the column.
+        """
+        return self._inner_data_wrapper.get_values_for_column(column)
+
+    def get_unit_for_column(self, column):
+        """
+        Returns the unit for the whole column.
+        """
+        return self._inner_data_wrapper.get_unit_for_column(column)
+
 
 def raster_to_dataframe(dataset):
     """Helper function to covnert a rasterio dataset to a dataframe."""
@@ -313,3 +360,15 @@ class DictWithListDataWrapper:
         This implementation ignores the index.
         """
         return self._units[column]
+
+    def get_values_for_column(self, column):
+        """
+        Returns all the values for the column.
+        """
+        return self._data[column]
+
+    def get_unit_for_column(self, column):
+        """
+        Returns the unit for the whole column.
+        """
+        return self._units[column]
@@ -22,8 +22,26 @@ This is the module to
 """
 
 import numpy as np
+import scipy
 from scipy.spatial import cKDTree
 
+SCIPY_VERSION = tuple(int(x) for x in scipy.__version__.split(".")[:2])
+
+
+def get_query_kwargs(workers):
+    """
+    Return the keyword arguments for a parallel query of the cKDTree.
+
+    Scipy renamed the n_jobs argument to workers in version 1.6
+    (& dropped n_jobs later), so we pass the one that the installed
+    scipy version knows. -1 means to use all the cpus.
+    """
+    if workers == 1:
+        return {}
+    if SCIPY_VERSION >= (1, 6):
+        return {"workers": workers}
+    return {"n_jobs": workers}
+
 
 class RasterIntensityProvider:
     """
@@ -60,6 +78,27 @@ class RasterIntensityProvider:
 
         return intensities, units
 
+    def get_nearest_many(self, lons, lats):
+        """
+        Returns a dict with arrays of the values and a dict with the
+        units of the intensities for all of the given locations.
+
+        Locations outside of the raster coverage get the na value.
+        """
+        lons = np.asarray(lons, dtype=np.float64)
+        lats = np.asarray(lats, dtype=np.float64)
+        in_bbox = self._raster_wrapper.are_locations_in_bbox(lons, lats)
+
+        values = np.full(len(lons), self._na_value, dtype=np.float64)
+        values[in_bbox] = self._raster_wrapper.get_samples(
+            lons[in_bbox], lats[in_bbox], self._na_value
+        )
+
+        intensities = {self._kind: values}
+        units = {self._kind: self._unit}
+
+        return intensities, units
+
 
 class IntensityProvider:
     """
@@ -67,11 +106,16 @@ class IntensityProvider:
     a location.
     """
 
-    def __init__(self, intensity_data, na_value=0.0):
+    def __init__(self, intensity_data, na_value=0.0, workers=1):
         self._intensity_data = intensity_data
         self._na_value = na_value
+        # Number of workers for the batch queries.
+        self._workers = workers
         self._spatial_index = self._build_spatial_index()
         self._max_dist = self._estimate_max_dist()
+        # The columns as arrays for the batch queries.
+        # We read them lazily, as we may not need them.
+        self._columns = None
 
     def _build_spatial_index(self):
         coords = self._get_coords()
@@ -120,6 +164,64 @@ class IntensityProvider:
             units[column] = unit
         return intensities, units
 
+    def get_nearest_many(self, lons, lats):
+        """
+        Returns a dict with arrays of the values and a dict with the
+        units of the intensities for all of the given locations.
+
+        This is the batch version of get_nearest, so we query the
+        spatial index just once for all of the locations.
+        """
+        coords = np.column_stack(
+            [
+                np.asarray(lons, dtype=np.float64),
+                np.asarray(lats, dtype=np.float64),
+            ]
+        )
+        if len(coords) > 0:
+            dists, idxs = self._spatial_index.query(
+                coords, k=1, **get_query_kwargs(self._workers)
+            )
+        else:
+            dists = np.zeros(0)
+            idxs = np.zeros(0, dtype=np.int64)
+        too_far_away = dists > self._max_dist
+
+        if self._columns is None:
+            self._columns = self._read_columns()
+
+        intensities = {}
+        units = {}
+        for column, (all_values, unit) in self._columns.items():
+            values = all_values[idxs]
+            values[too_far_away] = self._na_value
+            intensities[column] = values
+            units[column] = unit
+        return intensities, units
+
+    def _read_columns(self):
+        columns = {}
+        for column in self._intensity_data.get_data_columns():
+            values = to_array(
+                self._intensity_data.get_values_for_column(column)
+            )
+            unit = self._intensity_data.get_unit_for_column(column)
+            columns[column] = (values, unit)
+        return columns
+
+
+def to_array(values):
+    """
+    Convert the values to an array.
+
+    The shakemaps can contain string columns too, so we keep those
+    as object arrays.
+    """
+    try:
+        return np.array(values, dtype=np.float64)
+    except ValueError:
+        return np.array(values, dtype=object)
+
 
 class StackedIntensityProvider:
     """
@@ -151,6 +253,25 @@ class StackedIntensityProvider:
             units.update(sub_units)
         return intensities, units
 
+    def get_nearest_many(self, lons, lats):
+        """
+        Returns a dict with arrays of the values and a dict with the
+        units of the intensities for all of the given locations.
+        """
+        intensities = {}
+        units = {}
+
+        for single_sub_intensity_provider in self._sub_intensity_providers:
+            (
+                sub_intens,
+                sub_units,
+            ) = single_sub_intensity_provider.get_nearest_many(
+                lons=lons, lats=lats
+            )
+            intensities.update(sub_intens)
+            units.update(sub_units)
+        return intensities, units
+
 
 class AliasIntensityProvider:
     """
@@ -177,6 +298,25 @@ class AliasIntensityProvider:
             units,
         ) = self._inner_intensity_provider.get_nearest(lon, lat)
 
+        self._add_aliases(intensities, units)
+
+        return intensities, units
+
+    def get_nearest_many(self, lons, lats):
+        """
+        Returns the base intensities for all of the locations.
+        It also adds intensities under other names.
+        """
+        (
+            intensities,
+            units,
+        ) = self._inner_intensity_provider.get_nearest_many(lons, lats)
+
+        self._add_aliases(intensities, units)
+
+        return intensities, units
+
+    def _add_aliases(self, intensities, units):
         for new_intensity_measure in self._aliases:
             possible_intensity_measures = self._aliases[new_intensity_measure]
             # the current behaviour is that later names can overwrite
@@ -193,8 +333,6 @@ class AliasIntensityProvider:
                             given_intensity_measure
                         ]
 
-        return intensities, units
-
 
 class ConversionIntensityProvider:
     """
@@ -242,3 +380,29 @@ class ConversionIntensityProvider:
                 units[self._as_intensity] = new_unit
 
         return intensities, units
+
+    def get_nearest_many(self, lons, lats):
+        """
+        Adds one intensity measurement with the given conversion function
+        for all of the locations.
+
+        The conversion function gets the array of the intensities
+        and the unit, so it must be able to work with numpy arrays.
+        """
+        (
+            intensities,
+            units,
+        ) = self._inner_intensity_provider.get_nearest_many(lons, lats)
+
+        if self._from_intensity in intensities.keys():
+            if self._as_intensity not in intensities.keys():
+                new_intensity, new_unit = self._fun(
+                    intensities[self._from_intensity],
+                    units[self._from_intensity],
+                )
+                intensities[self._as_intensity] = np.broadcast_to(
+                    new_intensity, (len(intensities[self._from_intensity]),)
+                ).copy()
+                units[self._as_intensity] = new_unit
+
+        return intensities, units
@@ -21,6 +21,64 @@ Module for all the loss related classes.
 
 import json
 
+import numpy
+
+
+class CompiledLossData:
+    """
+    The loss data of one schema as arrays.
+
+    The step coefficients are indexed by the damage state (as integer),
+    the replacement costs by the ids of a vocabulary (see the
+    vocabulary module). Missing values are nan.
+    """
+
+    def __init__(self, data_for_schema):
+        steps = data_for_schema["steps"]
+        damage_states = [int(x) for x in steps.keys()]
+        self.step_coefficients = numpy.full(
+            max(damage_states, default=-1) + 1, numpy.nan
+        )
+        self.step_coefficients[damage_states] = list(steps.values())
+
+        replacement_costs_by_taxonomy = data_for_schema["replacementCosts"]
+        self.taxonomies = list(replacement_costs_by_taxonomy.keys())
+        self.replacement_costs = numpy.array(
+            list(replacement_costs_by_taxonomy.values()), dtype=numpy.float64
+        )
+        # The array for the ids of the last vocabulary that we saw
+        # (as tuple of the vocabulary, its size & the array).
+        self._replacement_costs_by_id = None
+
+    def get_replacement_costs(self, schema, vocabulary):
+        """
+        Return the replacement costs indexed by the ids of the vocabulary.
+
+        We build the array again only if the vocabulary changed.
+        """
+        cached = self._replacement_costs_by_id
+        if (
+            cached is not None
+            and cached[0] is vocabulary
+            and cached[1] == len(vocabulary)
+        ):
+            return cached[2]
+        taxonomy_ids = vocabulary.intern_many(schema, self.taxonomies)
+        replacement_costs = numpy.full(len(vocabulary), numpy.nan)
+        replacement_costs[taxonomy_ids] = self.replacement_costs
+        self._replacement_costs_by_id = (
+            vocabulary,
+            len(vocabulary),
+            replacement_costs,
+        )
+        return replacement_costs
+
+    def __getstate__(self):
+        # We don't need to pickle the vocabulary of the cache.
+        state = self.__dict__.copy()
+        state["_replacement_costs_by_id"] = None
+        return state
+
 
 class LossProvider:
     """
@@ -29,9 +87,31 @@ class LossProvider:
     and to damage states.
     """
 
-    def __init__(self, data, unit=None):
+    def __init__(self, data, unit=None, bundle=None):
         self._data = data
         self._unit = unit
+        # With a bundle (see referencebundle) we read the data
+        # for a schema only when we need it.
+        self._bundle = bundle
+        self._compiled_data = {}
+
+    def _get_data_for_schema(self, schema):
+        """Return the loss data for the schema."""
+        if schema not in self._data and self._bundle is not None:
+            single_data = self._bundle.get_loss_data(schema)
+            if single_data is not None:
+                self._data[schema] = single_data
+        if schema not in self._data:
+            raise Exception("schema is not known for loss computation")
+        return self._data[schema]["data"]
+
+    def compile(self, schema):
+        """Return the (cached) CompiledLossData for the schema."""
+        if schema not in self._compiled_data:
+            self._compiled_data[schema] = CompiledLossData(
+                self._get_data_for_schema(schema)
+            )
+        return self._compiled_data[schema]
 
     def get_fallback_replacement_cost(self, schema, taxonomy):
         """
@@ -41,9 +121,7 @@ class LossProvider:
         we already have in case that the exposure model itself
         does't provide a replacement cost.
         """
-        if schema not in self._data:
-            raise Exception("schema is not known for loss computation")
-        data_for_schema = self._data[schema]["data"]
+        data_for_schema = self._get_data_for_schema(schema)
         if taxonomy not in data_for_schema["replacementCosts"].keys():
             raise Exception(
                 "no taxonomy candidates found for %s", repr(taxonomy)
@@ -51,6 +129,26 @@ class LossProvider:
 
         return data_for_schema["replacementCosts"][taxonomy]
 
+    def get_replacement_costs(self, schema, vocabulary):
+        """
+        Return an array with the fallback replacement costs.
+
+        The array is indexed by the ids of the vocabulary (see
+        the vocabulary module). All the taxonomies of the schema
+        will be added to the vocabulary. Ids without replacement
+        costs (for example those of other schemas) get nan.
+        """
+        return self.compile(schema).get_replacement_costs(schema, vocabulary)
+
+    def get_step_coefficients(self, schema):
+        """
+        Return an array with the coefficients for the damage states.
+
+        The array is indexed by the damage state (as integer).
+        Damage states without a coefficient get nan.
+        """
+        return self.compile(schema).step_coefficients
+
     def get_loss(
         self,
         schema,
@@ -63,9 +161,7 @@ class LossProvider:
         Returns the loss for the transition.
         """
 
-        if schema not in self._data:
-            raise Exception("schema is not known for loss computation")
-        data_for_schema = self._data[schema]["data"]
+        data_for_schema = self._get_data_for_schema(schema)
         steps = data_for_schema["steps"]
 
         str_from_damage_state = str(from_damage_state)
@@ -99,6 +195,14 @@ class LossProvider:
                 data[schema] = single_data
         return cls(data, unit=unit)
 
+    @classmethod
+    def from_bundle(cls, bundle, unit=None):
+        """
+        Returns a loss provider that reads the data for the schemas
+        lazily from the reference bundle.
+        """
+        return cls({}, unit=unit, bundle=bundle)
+
 
 def combine_losses(
     loss_value, loss_unit, existing_loss_value, existing_loss_unit
@@ -0,0 +1,136 @@
+#!/usr/bin/env python3
+
+# Copyright © 2021-2022 Helmholtz Centre Potsdam GFZ German Research Centre for
+# Geosciences, Potsdam, Germany
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+"""
+Module for the cache of the mapped exposure.
+
+If the schema of the exposure differs from the one of the fragility
+functions, we must map the exposure in every run. The result only
+depends on the exposure, the mapping data and the schemas - not on
+the hazard. So we can store the mapped exposure as Arrow file next to
+the exposure file & reuse it in later runs (tsunami runs for the
+very same exposure model for example).
+
+The name of the cache file contains a hash of the content of the
+exposure file, the mapping data & the schemas, so a changed exposure
+or changed mapping data never reuse an older file.
+"""
+
+import hashlib
+import json
+import os
+import tempfile
+
+import arrowio
+import gpdexposure
+
+# Must be increased if the content of the cache files changes.
+CACHE_VERSION = 1
+
+HASH_BLOCK_SIZE = 1024 * 1024
+
+
+def hash_file(filename):
+    """Return the sha256 hex digest of the content of the file."""
+    digest = hashlib.sha256()
+    with open(filename, "rb") as input_file:
+        for block in iter(lambda: input_file.read(HASH_BLOCK_SIZE), b""):
+            digest.update(block)
+    return digest.hexdigest()
+
+
+def get_cache_file(exposure_file, source_schema, target_schema, schema_mapper):
+    """
+    Return the name of the cache file for the mapped exposure.
+
+    The schema_mapper should be a subset for the schemas (see
+    schemamapping.SchemaMapper.subset), so that we only hash the
+    data that we need for the mapping.
+    """
+    key = hashlib.sha256(
+        json.dumps(
+            [
+                CACHE_VERSION,
+                hash_file(exposure_file),
+                source_schema,
+                target_schema,
+                schema_mapper.get_data_hash(),
+            ]
+        ).encode("utf-8")
+    ).hexdigest()
+    return "{0}.{1}.{2}.mapped.arrow".format(
+        exposure_file, target_schema, key[:16]
+    )
+
+
+def write_exposure(filename, exposure):
+    """
+    Write the exposure to the Arrow file.
+
+    We write into a temporary file (with a unique name) first, so that
+    another run never reads a file that is only half written.
+    """
+    file_descriptor, tmp_file = tempfile.mkstemp(
+        suffix=".tmp.arrow", dir=os.path.dirname(os.path.abspath(filename))
+    )
+    os.close(file_descriptor)
+    try:
+        with arrowio.ExposureWriter(tmp_file) as writer:
+            writer.write(exposure)
+        os.replace(tmp_file, filename)
+    finally:
+        if os.path.exists(tmp_file):
+            os.unlink(tmp_file)
+
+
+def read_or_map_exposure(
+    exposure_file,
+    source_schema,
+    target_schema,
+    schema_mapper,
+    pruning_epsilon=0.0,
+    exposure=None,
+):
+    """
+    Return the exposure of the exposure_file mapped to the
+    target schema.
+
+    If there is a cache file for it, we read the mapped exposure from
+    there (and don't need to read the exposure file at all). Otherwise
+    we map the exposure & write the cache file. The exposure is read
+    from the exposure_file if it is not given.
+    """
+    if source_schema == target_schema:
+        if exposure is None:
+            exposure = gpdexposure.read_exposure(exposure_file)
+        return exposure
+    schema_mapper = schema_mapper.subset(
+        source_schema=source_schema,
+        target_schema=target_schema,
+        pruning_epsilon=pruning_epsilon,
+    )
+    cache_file = get_cache_file(
+        exposure_file, source_schema, target_schema, schema_mapper
+    )
+    if os.path.exists(cache_file):
+        return arrowio.read_exposure(cache_file)
+    if exposure is None:
+        exposure = gpdexposure.read_exposure(exposure_file)
+    mapped_exposure = gpdexposure.map_exposure_dataframe(
+        exposure, source_schema, target_schema, schema_mapper
+    )
+    write_exposure(cache_file, mapped_exposure)
+    return mapped_exposure
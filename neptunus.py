@@ -8,18 +8,33 @@ the deus interface with a specialized intensity provider.
 """
 
 import argparse
-import glob
 import os
 
 import tellus
 
-import fragility
-import gpdexposure
+import executors
 import intensityprovider
-import loss
 import rasterintensityprovider
 
 
+def create_intensity_provider(intensity_file, intensity_name, intensity_unit):
+    """Create the intensity provider for the raster file."""
+    intensity_provider = (
+        rasterintensityprovider.RasterIntensityProvider.from_file(
+            intensity_file,
+            intensity=intensity_name,
+            unit=intensity_unit,
+        )
+    )
+    # ID for inundation (out of the maximum wave height)
+    return intensityprovider.AliasIntensityProvider(
+        intensity_provider,
+        aliases={
+            "ID": ["MWH"],
+        },
+    )
+
+
 def main():
     """
     Runs the main method, which reads from
@@ -36,7 +51,11 @@ def main():
     )
     argparser.add_argument("intensity_name", help="Name of the intensity")
     argparser.add_argument("intensity_unit", help="Unit of the intensity")
-    argparser.add_argument("exposure_file", help="File with the exposure data")
+    argparser.add_argument(
+        "exposure_file",
+        help="File with the exposure data (GeoJSON, or GeoParquet/Arrow "
+        + "for .parquet/.arrow files)",
+    )
     argparser.add_argument(
         "exposure_schema", help="The actual schema for the exposure data"
     )
@@ -46,33 +65,22 @@ def main():
     argparser.add_argument(
         "--merged_output_file",
         default="output_merged.json",
-        help="Filename for the merged output from all others",
+        help="Filename for the merged output from all others "
+        + "(GeoParquet/Arrow for .parquet/.arrow files, GeoJSON otherwise)",
     )
+    tellus.add_common_arguments(argparser)
     current_dir = os.path.dirname(os.path.realpath(__file__))
-    loss_data_dir = os.path.join(current_dir, "loss_data")
-    files = glob.glob(os.path.join(loss_data_dir, "*.json"))
-    loss_provider = loss.LossProvider.from_files(files, "USD")
+    loss_provider = tellus.create_loss_provider(current_dir)
 
     args = argparser.parse_args()
 
-    intensity_provider = (
-        rasterintensityprovider.RasterIntensityProvider.from_file(
-            args.intensity_file,
-            intensity=args.intensity_name,
-            unit=args.intensity_unit,
-        )
+    intensity_provider = create_intensity_provider(
+        args.intensity_file, args.intensity_name, args.intensity_unit
     )
-    # ID for inundation (out of the maximum wave height)
-    intensity_provider = intensityprovider.AliasIntensityProvider(
-        intensity_provider,
-        aliases={
-            "ID": ["MWH"],
-        },
+    fragility_provider = tellus.create_fragility_provider(
+        args.fragilty_file, args
     )
-    fragility_provider = fragility.Fragility.from_file(
-        args.fragilty_file
-    ).to_fragility_provider()
-    old_exposure = gpdexposure.read_exposure(args.exposure_file)
+    old_exposure, exposure_batches = tellus.read_exposure_for_args(args)
 
     worker = tellus.Child(
         intensity_provider,
@@ -81,12 +89,19 @@ def main():
         args.exposure_schema,
         loss_provider,
         args,
+        engine=args.engine,
+        damage_epsilon=args.damage_epsilon,
+        pruning_epsilon=args.pruning_epsilon,
+        executor=executors.create_executor(args.executor, args.workers),
+        exposure_batches=exposure_batches,
+        summary_directory=args.summary_directory,
+        mapping_cache=args.mapping_cache,
     )
     worker.run()
 
 
 if __name__ == "__main__":
-    # Currently we can't pickle the raster intensity, so no parallel
-    # processing is possible.
-    gpdexposure.PARALLEL_PROCESSING = False
+    import multiprocessing
+
+    multiprocessing.set_start_method("spawn")
     main()
@@ -20,9 +20,47 @@ Testfile for testing
 the intensity provider for rasters.
 """
 
+import numpy as np
 import rasterio
 
 
+class AffineIndex:
+    """
+    Computes the row & column indices of the raster
+    for given coordinates.
+
+    It only stores the inverse of the affine transform of
+    the raster, so that it can be pickled (unlike the index
+    method of an open rasterio dataset).
+    """
+
+    def __init__(self, transform):
+        self.inverse_matrix = np.array(tuple(~transform)).reshape(3, 3)
+
+    def __call__(self, x, y):
+        """
+        Returns the row & the column for the coordinates.
+
+        Works with single values & with arrays.
+        """
+        is_scalar = np.isscalar(x) and np.isscalar(y)
+        xs = np.atleast_1d(np.asarray(x, dtype=np.float64))
+        ys = np.atleast_1d(np.asarray(y, dtype=np.float64))
+
+        # Same computation as rasterio.transform.rowcol
+        input_matrix = np.empty((3, len(xs)))
+        input_matrix[0] = xs
+        input_matrix[1] = ys
+        input_matrix[2] = 1
+        cols, rows, _ = self.inverse_matrix.dot(input_matrix)
+        rows = np.floor(rows).astype(np.int64)
+        cols = np.floor(cols).astype(np.int64)
+
+        if is_scalar:
+            return int(rows[0]), int(cols[0])
+        return rows, cols
+
+
 class RasterIntensityProvider:
     """
     A intensity provider that reads from
@@ -30,7 +68,14 @@ class RasterIntensityProvider:
     """
 
     def __init__(
-        self, data, index, intensity, unit, na_value=0.0, no_datavals=[]
+        self,
+        data,
+        index,
+        intensity,
+        unit,
+        na_value=0.0,
+        no_datavals=[],
+        crs=None,
     ):
         self.data = data
         self.index = index
@@ -38,16 +83,17 @@ class RasterIntensityProvider:
         self.unit = unit
         self.na_value = na_value
         self.no_datavals = no_datavals
+        self.crs = crs
 
     def get_nearest(self, lon, lat):
         """
         Samples on the location of lon and lat.
         """
         index = self.index
-        try:
-            x, y = index(lon, lat)
+        x, y = index(lon, lat)
+        if self._is_inside(x, y):
             value = self.data[0, x, y]
-        except IndexError:
+        else:
             # it is outside of the raster
             value = self.na_value
 
@@ -59,17 +105,45 @@ class RasterIntensityProvider:
 
         return intensities, units
 
-    @classmethod
-    def from_file(cls, filename, intensity, unit, na_value=0.0):
-        with rasterio.open(filename) as dataset:
-            data = dataset.read()
+    def get_nearest_many(self, lons, lats):
+        """
+        Samples on all of the locations given by lons and lats.
+        """
+        values = np.full(len(lons), self.na_value, dtype=np.float64)
+        if len(lons) > 0:
+            xs, ys = self.index(np.asarray(lons), np.asarray(lats))
+            xs = np.asarray(xs, dtype=np.int64)
+            ys = np.asarray(ys, dtype=np.int64)
+            inside = self._is_inside(xs, ys)
+            values[inside] = self.data[0, xs[inside], ys[inside]]
+        no_datavals = [x for x in self.no_datavals if x is not None]
+        values[np.isin(values, no_datavals)] = self.na_value
 
-            # This works as it doesn't need to read any
-            # data from the file later.
+        intensities = {self.intensity: values}
+        units = {self.intensity: self.unit}
+
+        return intensities, units
 
-            def index(x, y):
-                return dataset.index(x, y)
+    def _is_inside(self, x, y):
+        # Negative indices are outside of the raster too, even
+        # if numpy would accept them.
+        _, height, width = self.data.shape
+        return (x >= 0) & (x < height) & (y >= 0) & (y < width)
 
+    @classmethod
+    def from_file(cls, filename, intensity, unit, na_value=0.0):
+        """
+        Reads the first band of the raster file.
+
+        The provider only keeps the numpy array, the affine transform,
+        the nodata values and the crs, so it can be pickled to
+        use it in the worker processes.
+        """
+        with rasterio.open(filename) as dataset:
+            # at the moment we only support one band
+            data = dataset.read(1)[np.newaxis, :, :]
+            index = AffineIndex(dataset.transform)
             no_datavals = dataset.get_nodatavals()
+            crs = dataset.crs
 
-        return cls(data, index, intensity, unit, na_value, no_datavals)
+        return cls(data, index, intensity, unit, na_value, no_datavals, crs)
@@ -17,6 +17,9 @@
 
 """This is a module to provide wrappers for raster data."""
 
+import numpy as np
+import rasterio.transform
+
 
 class RasterWrapper:
     """
@@ -55,3 +58,36 @@ class RasterWrapper:
         idx = self._raster_reader.index(lon, lat)
         # at the moment it only supports one band
         return self._data[0, idx[0], idx[1]]
+
+    def are_locations_in_bbox(self, lons, lats):
+        """
+        Tests for arrays of locations if they are in the bounding box of
+        the raster.
+        """
+        bbox = self._raster_reader.bounds
+        return (
+            (lons >= bbox.left)
+            & (lons <= bbox.right)
+            & (lats >= bbox.bottom)
+            & (lats <= bbox.top)
+        )
+
+    def get_samples(self, lons, lats, na_value):
+        """
+        Returns the values at the given locations.
+
+        Locations that are not inside the raster get the na_value.
+        """
+        values = np.full(len(lons), na_value, dtype=np.float64)
+        if len(lons) == 0:
+            return values
+        rows, cols = rasterio.transform.rowcol(
+            self._raster_reader.transform, lons, lats
+        )
+        rows = np.asarray(rows, dtype=np.int64)
+        cols = np.asarray(cols, dtype=np.int64)
+        # at the moment it only supports one band
+        _, height, width = self._data.shape
+        inside = (rows >= 0) & (rows < height) & (cols >= 0) & (cols < width)
+        values[inside] = self._data[0, rows[inside], cols[inside]]
+        return values
@@ -0,0 +1,349 @@
+#!/usr/bin/env python3
+
+# Copyright © 2021-2022 Helmholtz Centre Potsdam GFZ German Research Centre for
+# Geosciences, Potsdam, Germany
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+"""
+Module for the compiled bundle with the reference data.
+
+Without the bundle we read all of the ~2000 json files with the
+schema mappings on every run, even if we only need the mapping
+between two schemas. The bundle is a sqlite file with all the
+taxonomy & damage state mappings and the loss data, indexed by
+the schemas (and the taxonomies), so that we can read only the
+parts that a run needs.
+
+The bundle also stores the sizes & modification times of the json
+files that it was compiled from. If those changed, the bundle is
+out of date & we read the json files as before.
+
+Run this module as script to compile the bundle:
+
+    python3 referencebundle.py
+"""
+
+import argparse
+import glob
+import json
+import os
+import sqlite3
+
+import schemamapping
+
+BUNDLE_FILENAME = "reference_data.sqlite"
+
+TAX_MAPPING_DIR = "schema_mapping_data_tax"
+DS_MAPPING_DIR = "schema_mapping_data_ds"
+LOSS_DATA_DIR = "loss_data"
+
+# Let sqlite map the file into memory (up to this size in bytes).
+MMAP_SIZE = 256 * 1024 * 1024
+
+CREATE_STATEMENTS = [
+    """
+    CREATE TABLE source_files (
+        kind TEXT NOT NULL,
+        path TEXT NOT NULL,
+        size INTEGER NOT NULL,
+        mtime_ns INTEGER NOT NULL,
+        PRIMARY KEY (kind, path)
+    )
+    """,
+    """
+    CREATE TABLE tax_mapping (
+        source_schema TEXT NOT NULL,
+        target_schema TEXT NOT NULL,
+        conv_matrix TEXT NOT NULL,
+        PRIMARY KEY (source_schema, target_schema)
+    )
+    """,
+    """
+    CREATE TABLE ds_mapping (
+        source_schema TEXT NOT NULL,
+        target_schema TEXT NOT NULL,
+        source_taxonomy TEXT NOT NULL,
+        target_taxonomy TEXT NOT NULL,
+        conv_matrix TEXT NOT NULL,
+        PRIMARY KEY (
+            source_schema, target_schema, source_taxonomy, target_taxonomy
+        )
+    )
+    """,
+    """
+    CREATE TABLE loss_data (
+        schema TEXT NOT NULL PRIMARY KEY,
+        data TEXT NOT NULL
+    )
+    """,
+]
+
+
+def get_reference_files(current_dir):
+    """
+    Return the json files with the reference data.
+
+    The result is a dict with the kinds (tax_mapping, ds_mapping,
+    loss_data) as keys and the lists of the files as values.
+    """
+    return {
+        kind: glob.glob(os.path.join(current_dir, directory, "*.json"))
+        for kind, directory in [
+            ("tax_mapping", TAX_MAPPING_DIR),
+            ("ds_mapping", DS_MAPPING_DIR),
+            ("loss_data", LOSS_DATA_DIR),
+        ]
+    }
+
+
+def get_file_stats(bundle_file, files):
+    """
+    Return the (path, size, mtime_ns) for all the files.
+
+    The paths are relative to the directory of the bundle, so that
+    we can move the whole directory.
+    """
+    bundle_dir = os.path.dirname(os.path.abspath(bundle_file))
+    stats = []
+    for filename in files:
+        stat_result = os.stat(filename)
+        stats.append(
+            (
+                os.path.relpath(os.path.abspath(filename), bundle_dir),
+                stat_result.st_size,
+                stat_result.st_mtime_ns,
+            )
+        )
+    return stats
+
+
+def read_json(filename):
+    """Read the json data of the file."""
+    with open(filename, "rt") as input_file:
+        return json.load(input_file)
+
+
+def to_json(data):
+    """Return the compact json text for the data."""
+    return json.dumps(data, separators=(",", ":"))
+
+
+def compile_bundle(bundle_file, reference_files):
+    """
+    Compile the bundle from the json files.
+
+    The reference_files are a dict as the one of get_reference_files.
+    If there are several datasets for the same schemas (and
+    taxonomies), the last one wins - as when we read the json files.
+    """
+    # We write into a temporary file first, so that no other
+    # process reads a bundle that is only half written.
+    tmp_file = bundle_file + ".tmp"
+    if os.path.exists(tmp_file):
+        os.unlink(tmp_file)
+    connection = sqlite3.connect(tmp_file)
+    try:
+        for statement in CREATE_STATEMENTS:
+            connection.execute(statement)
+        for kind, files in reference_files.items():
+            connection.executemany(
+                "INSERT INTO source_files VALUES (?, ?, ?, ?)",
+                [
+                    (kind, path, size, mtime_ns)
+                    for path, size, mtime_ns in get_file_stats(
+                        bundle_file, files
+                    )
+                ],
+            )
+        for filename in reference_files["tax_mapping"]:
+            data = read_json(filename)
+            connection.execute(
+                "INSERT OR REPLACE INTO tax_mapping VALUES (?, ?, ?)",
+                (
+                    data["source_schema"],
+                    data["target_schema"],
+                    to_json(data["conv_matrix"]),
+                ),
+            )
+        for filename in reference_files["ds_mapping"]:
+            data = read_json(filename)
+            # We store the damage state matrices already compiled,
+            # so that we don't need pandas to transpose them in a run.
+            matrix = schemamapping.DamageStateMappingMatrix(
+                data["conv_matrix"]
+            )
+            matrix.compile()
+            connection.execute(
+                "INSERT OR REPLACE INTO ds_mapping VALUES (?, ?, ?, ?, ?)",
+                (
+                    data["source_schema"],
+                    data["target_schema"],
+                    data["source_taxonomy"],
+                    data["target_taxonomy"],
+                    to_json(matrix.conv_matrix),
+                ),
+            )
+        for filename in reference_files["loss_data"]:
+            data = read_json(filename)
+            connection.execute(
+                "INSERT OR REPLACE INTO loss_data VALUES (?, ?)",
+                (data["meta"]["id"], to_json(data)),
+            )
+        connection.commit()
+    finally:
+        connection.close()
+    os.replace(tmp_file, bundle_file)
+
+
+class ReferenceBundle:
+    """
+    Read only access to the compiled reference data.
+
+    The connection is opened lazily, and it is not pickled (so
+    that the processes can open their own connections).
+    """
+
+    def __init__(self, bundle_file):
+        self.bundle_file = bundle_file
+        self._connection = None
+
+    def _get_connection(self):
+        if self._connection is None:
+            uri = "file:{0}?mode=ro".format(os.path.abspath(self.bundle_file))
+            # The bundle is read only, so we can share the
+            # connection with other threads (deus_server for example).
+            self._connection = sqlite3.connect(
+                uri, uri=True, check_same_thread=False
+            )
+            self._connection.execute(
+                "PRAGMA mmap_size = {0}".format(MMAP_SIZE)
+            )
+        return self._connection
+
+    def _query(self, statement, parameters):
+        return self._get_connection().execute(statement, parameters)
+
+    def is_up_to_date(self, kind, files):
+        """
+        Check if the bundle was compiled from exactly those files
+        (with the same sizes & modification times).
+        """
+        stored_stats = set(
+            self._query(
+                "SELECT path, size, mtime_ns FROM source_files WHERE kind = ?",
+                (kind,),
+            )
+        )
+        return stored_stats == set(get_file_stats(self.bundle_file, files))
+
+    def get_tax_mapping(self, source_schema, target_schema):
+        """
+        Return the conv matrix for the taxonomy mapping between
+        the schemas (or None if there is none).
+        """
+        row = self._query(
+            "SELECT conv_matrix FROM tax_mapping "
+            + "WHERE source_schema = ? AND target_schema = ?",
+            (source_schema, target_schema),
+        ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def get_schema_pairs(self):
+        """
+        Return the (source schema, target schema) tuples for which
+        we have taxonomy mappings.
+        """
+        return self._query(
+            "SELECT source_schema, target_schema FROM tax_mapping", ()
+        ).fetchall()
+
+    def get_ds_mappings(self, source_schema, target_schema):
+        """
+        Return the damage state mappings between the schemas.
+
+        Yields tuples with the source taxonomy, the target taxonomy
+        & the compiled conv matrix (with int keys for the damage
+        states, see schemamapping.DamageStateMappingMatrix).
+        """
+        for source_taxonomy, target_taxonomy, conv_matrix in self._query(
+            "SELECT source_taxonomy, target_taxonomy, conv_matrix "
+            + "FROM ds_mapping WHERE source_schema = ? AND target_schema = ?",
+            (source_schema, target_schema),
+        ):
+            yield source_taxonomy, target_taxonomy, dict(
+                schemamapping.convert_dict_to_use_int_keys(
+                    json.loads(conv_matrix)
+                )
+            )
+
+    def get_loss_data(self, schema):
+        """Return the loss data for the schema (or None if there is none)."""
+        row = self._query(
+            "SELECT data FROM loss_data WHERE schema = ?", (schema,)
+        ).fetchone()
+        if row is None:
+            return None
+        return json.loads(row[0])
+
+    def close(self):
+        """Close the connection (if it is open)."""
+        if self._connection is not None:
+            self._connection.close()
+            self._connection = None
+
+    def __getstate__(self):
+        return {"bundle_file": self.bundle_file, "_connection": None}
+
+
+def open_bundle(current_dir, kind, files):
+    """
+    Return the bundle in the directory if it is up to date for
+    the files of that kind.
+
+    Returns None if there is no bundle or if it is outdated.
+    """
+    bundle_file = os.path.join(current_dir, BUNDLE_FILENAME)
+    if not os.path.exists(bundle_file):
+        return None
+    bundle = ReferenceBundle(bundle_file)
+    try:
+        if bundle.is_up_to_date(kind, files):
+            return bundle
+    except sqlite3.Error:
+        # Not a bundle that we can use (for example from an older
+        # version), so we just read the json files.
+        pass
+    bundle.close()
+    return None
+
+
+def main():
+    """Compiles the bundle with the local reference data."""
+    current_dir = os.path.dirname(os.path.realpath(__file__))
+    argparser = argparse.ArgumentParser(
+        description="Compiles the schema mapping & loss data into one file"
+    )
+    argparser.add_argument(
+        "--bundle_file",
+        default=os.path.join(current_dir, BUNDLE_FILENAME),
+        help="Output file for the bundle",
+    )
+    args = argparser.parse_args()
+
+    compile_bundle(args.bundle_file, get_reference_files(current_dir))
+
+
+if __name__ == "__main__":
+    main()
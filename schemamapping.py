@@ -21,9 +21,13 @@ for the mapping of the taxonomies.
 """
 
 import collections
+import hashlib
 import json
+import threading
 
+import numpy
 import pandas as pd
+import scipy.sparse
 
 
 CacheKey = collections.namedtuple(
@@ -36,6 +40,41 @@ CacheKeyTaxonomy = collections.namedtuple(
 )
 
 
+def find_entries_to_keep(values, total, pruning_epsilon):
+    """
+    Return the indices of the values that are not below the
+    pruning_epsilon (as share of the total).
+
+    We always keep the largest value (the first one if there are
+    several), so that we never prune everything.
+    """
+    if not values:
+        return []
+    largest = max(range(len(values)), key=values.__getitem__)
+    threshold = pruning_epsilon * total
+    return [
+        index
+        for index, value in enumerate(values)
+        if value >= threshold or index == largest
+    ]
+
+
+def renormalize(values, total):
+    """
+    Scale the values so that they sum up to the total again.
+
+    If the values sum up to 0 there is nothing we can scale,
+    so we return them as they are.
+    """
+    kept_total = 0.0
+    for value in values:
+        kept_total += value
+    if kept_total <= 0:
+        return list(values)
+    factor = total / kept_total
+    return [value * factor for value in values]
+
+
 def convert_dict_to_use_int_keys(d):
     """
     Takes a dict with string keys that
@@ -66,6 +105,26 @@ class DamageStateMappingMatrix:
         # do the init of the conv matrix lazy
         self.conv_matrix = None
 
+    @classmethod
+    def from_compiled(cls, conv_matrix):
+        """
+        Returns a matrix for the conv matrix that is already
+        compiled (as in the reference bundle).
+        """
+        matrix = cls(None)
+        matrix.conv_matrix = conv_matrix
+        return matrix
+
+    def compile(self):
+        """
+        Builds the conv matrix now (instead of doing it lazy).
+
+        This way we can do it once before we share the matrix
+        with other processes.
+        """
+        if self.conv_matrix is None:
+            self._init_conv_matrix()
+
     def _init_conv_matrix(self):
         self.conv_matrix = (
             pd.DataFrame(
@@ -108,6 +167,151 @@ class SchemaMapperResult:
         self.n_buildings = n_buildings
 
 
+class CompiledSchemaMapping:
+    """
+    The mapping from one schema to another as sparse matrix.
+
+    The rows are the source (taxonomy, damage state) pairs, the
+    columns the target (taxonomy, damage state) pairs & the values
+    the fractions of the buildings (as map_schema gives them for
+    one building). Within a row the entries keep the order of the
+    map_schema results.
+
+    We add the rows when we see the source pairs first (as not
+    every combination of taxonomy & damage state can be mapped).
+    The mapping can be shared between threads, so we add the rows
+    & build the matrix under a lock.
+
+    Fractions below the pruning_epsilon (as share of the row) are
+    dropped & the others are scaled up, so that the row still maps
+    the very same number of buildings.
+    """
+
+    def __init__(
+        self, schema_mapper, source_schema, target_schema, pruning_epsilon=0.0
+    ):
+        self.schema_mapper = schema_mapper
+        self.source_schema = source_schema
+        self.target_schema = target_schema
+        self.pruning_epsilon = pruning_epsilon
+        self.source_rows = {}
+        self.target_columns = {}
+        self.target_taxonomies = []
+        self.target_damage_states = []
+        # The targets for each row as list of
+        # (taxonomy, damage state, fraction) tuples.
+        self.row_targets = []
+        self._indptr = [0]
+        self._indices = []
+        self._data = []
+        self._matrix = None
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # The lock can't be pickled.
+        state = self.__dict__.copy()
+        del state["_lock"]
+        return state
+
+    def __setstate__(self, state):
+        self.__dict__.update(state)
+        self._lock = threading.Lock()
+
+    def _add_row(self, source_taxonomy, source_damage_state):
+        mapping_results = self.schema_mapper.map_schema(
+            source_taxonomy=source_taxonomy,
+            source_damage_state=source_damage_state,
+            source_schema=self.source_schema,
+            target_schema=self.target_schema,
+            n_buildings=1.0,
+        )
+        fractions = [res.n_buildings for res in mapping_results]
+        if self.pruning_epsilon > 0:
+            total = 0.0
+            for fraction in fractions:
+                total += fraction
+            kept = find_entries_to_keep(fractions, total, self.pruning_epsilon)
+            if len(kept) < len(fractions):
+                mapping_results = [mapping_results[index] for index in kept]
+                fractions = renormalize(
+                    [fractions[index] for index in kept], total
+                )
+        targets = []
+        for res, fraction in zip(mapping_results, fractions):
+            target_key = (res.taxonomy, res.damage_state)
+            if target_key not in self.target_columns:
+                self.target_columns[target_key] = len(self.target_columns)
+                self.target_taxonomies.append(res.taxonomy)
+                self.target_damage_states.append(res.damage_state)
+            self._indices.append(self.target_columns[target_key])
+            self._data.append(fraction)
+            targets.append((res.taxonomy, res.damage_state, fraction))
+        self._indptr.append(len(self._indices))
+        self.row_targets.append(targets)
+        self._matrix = None
+        row = len(self.source_rows)
+        self.source_rows[(source_taxonomy, source_damage_state)] = row
+        return row
+
+    def get_row(self, source_taxonomy, source_damage_state):
+        """Return the row for the source pair (add it if necessary)."""
+        source_key = (source_taxonomy, source_damage_state)
+        row = self.source_rows.get(source_key)
+        if row is None:
+            with self._lock:
+                row = self.source_rows.get(source_key)
+                if row is None:
+                    row = self._add_row(source_taxonomy, source_damage_state)
+        return row
+
+    def get_targets(self, source_taxonomy, source_damage_state):
+        """
+        Return the list of (taxonomy, damage state, fraction) tuples
+        for the source pair.
+        """
+        return self.row_targets[
+            self.get_row(source_taxonomy, source_damage_state)
+        ]
+
+    def get_rows(self, source_taxonomies, source_damage_states):
+        """Return an array with the rows for the source pairs."""
+        source_keys = list(zip(source_taxonomies, source_damage_states))
+        source_rows = self.source_rows
+        missing_keys = [x for x in source_keys if x not in source_rows]
+        if missing_keys:
+            # We add all the missing rows of the chunk at once.
+            with self._lock:
+                for source_taxonomy, source_damage_state in missing_keys:
+                    if (source_taxonomy, source_damage_state) in source_rows:
+                        continue
+                    self._add_row(source_taxonomy, source_damage_state)
+        return numpy.array(
+            [source_rows[x] for x in source_keys], dtype=numpy.int64
+        )
+
+    @property
+    def matrix(self):
+        """The csr matrix with the rows that we have so far."""
+        matrix = self._matrix
+        if matrix is None:
+            # We must not build it while another thread adds a row.
+            with self._lock:
+                if self._matrix is None:
+                    self._matrix = scipy.sparse.csr_matrix(
+                        (
+                            numpy.array(self._data, dtype=numpy.float64),
+                            numpy.array(self._indices, dtype=numpy.int64),
+                            numpy.array(self._indptr, dtype=numpy.int64),
+                        ),
+                        shape=(
+                            len(self.source_rows),
+                            len(self.target_columns),
+                        ),
+                    )
+                matrix = self._matrix
+        return matrix
+
+
 SourceTargetSchemaTuple = collections.namedtuple(
     "SourceTargetSchemaTuple", "source_schema target_schema"
 )
@@ -123,12 +327,71 @@ class SchemaMapper:
     Mapper class to map from one schema to anohter.
     """
 
-    def __init__(self, tax_mapping_data, ds_mapping_data):
+    def __init__(
+        self,
+        tax_mapping_data,
+        ds_mapping_data,
+        bundle=None,
+        pruning_epsilon=0.0,
+    ):
         self._tax_mapping_data = tax_mapping_data
         self._ds_mapping_data = ds_mapping_data
+        # Fractions below this value are dropped in the compiled
+        # mappings (see CompiledSchemaMapping).
+        self.pruning_epsilon = pruning_epsilon
+        # If we have a bundle (see referencebundle), we read the
+        # mapping data for the schemas only when we need them.
+        self._bundle = bundle
+        self._loaded_schemas = set()
 
         self._cached_mappings = {}
         self._cached_mappings_taxonomy = {}
+        self._compiled_mappings = {}
+        self._schema_paths = {}
+
+    @classmethod
+    def from_bundle(cls, bundle):
+        """
+        Returns a schema mapper that reads the data for the
+        schemas lazily from the reference bundle.
+        """
+        return cls({}, {}, bundle=bundle)
+
+    def _load_schemas(self, source_schema, target_schema):
+        """
+        Read the mapping data for the schemas from the bundle
+        (if we have one & didn't read it before).
+        """
+        if self._bundle is None:
+            return
+        source_target_schema_tuple = SourceTargetSchemaTuple(
+            source_schema=source_schema,
+            target_schema=target_schema,
+        )
+        if source_target_schema_tuple in self._loaded_schemas:
+            return
+        self._loaded_schemas.add(source_target_schema_tuple)
+
+        conv_matrix = self._bundle.get_tax_mapping(
+            source_schema, target_schema
+        )
+        if conv_matrix is not None:
+            self._tax_mapping_data[source_target_schema_tuple] = conv_matrix
+
+        for (
+            source_taxonomy,
+            target_taxonomy,
+            conv_matrix,
+        ) in self._bundle.get_ds_mappings(source_schema, target_schema):
+            setting_tuple = SourceTargetSchemaTaxonomyTuple(
+                source_schema=source_schema,
+                target_schema=target_schema,
+                source_taxonomy=source_taxonomy,
+                target_taxonomy=target_taxonomy,
+            )
+            self._ds_mapping_data[
+                setting_tuple
+            ] = DamageStateMappingMatrix.from_compiled(conv_matrix)
 
     @classmethod
     def from_taxonomy_and_damage_state_conversion_files(
@@ -205,6 +468,163 @@ class SchemaMapper:
             ds_mapping_data_by_taxonomies[setting_tuple] = conv_matrix
         return cls(tax_mapping_data_by_schemas, ds_mapping_data_by_taxonomies)
 
+    def get_schema_pairs(self):
+        """
+        Returns the set of (source schema, target schema) tuples
+        for which we have taxonomy mapping data.
+        """
+        schema_pairs = set(self._tax_mapping_data.keys())
+        if self._bundle is not None:
+            for (
+                source_schema,
+                target_schema,
+            ) in self._bundle.get_schema_pairs():
+                schema_pairs.add(
+                    SourceTargetSchemaTuple(
+                        source_schema=source_schema,
+                        target_schema=target_schema,
+                    )
+                )
+        return schema_pairs
+
+    def find_schema_path(self, source_schema, target_schema):
+        """
+        Returns the list of schemas to map from the source schema
+        to the target schema (including both).
+
+        If there is no direct mapping, we search the path with the
+        fewest steps over the other schemas (the schemas are
+        searched in alphabetical order, so that the path is always
+        the same). Returns None if there is no path at all.
+        """
+        key = SourceTargetSchemaTuple(
+            source_schema=source_schema,
+            target_schema=target_schema,
+        )
+        if key in self._schema_paths:
+            return self._schema_paths[key]
+
+        next_schemas = collections.defaultdict(list)
+        for schema_pair in sorted(self.get_schema_pairs()):
+            next_schemas[schema_pair.source_schema].append(
+                schema_pair.target_schema
+            )
+
+        # Breadth first search, so we get the shortest path.
+        previous_schemas = {source_schema: None}
+        queue = collections.deque([source_schema])
+        while queue and target_schema not in previous_schemas:
+            schema = queue.popleft()
+            for next_schema in next_schemas[schema]:
+                if next_schema not in previous_schemas:
+                    previous_schemas[next_schema] = schema
+                    queue.append(next_schema)
+
+        path = None
+        if (
+            target_schema in previous_schemas
+            and source_schema != target_schema
+        ):
+            path = [target_schema]
+            while path[-1] != source_schema:
+                path.append(previous_schemas[path[-1]])
+            path.reverse()
+        self._schema_paths[key] = path
+        return path
+
+    def subset(self, source_schema, target_schema, pruning_epsilon=0.0):
+        """
+        Returns a schema mapper that only contains the data
+        to map from the source schema to the target schema
+        (for all the steps if there is no direct mapping).
+        The compiled mappings of the subset use the pruning_epsilon.
+
+        All the damage state mapping matrices of the subset are
+        already compiled, so that we don't need to build them
+        in every worker process again.
+        """
+        path = self.find_schema_path(source_schema, target_schema)
+        if path is None:
+            path = [source_schema, target_schema]
+
+        tax_mapping_data = {}
+        ds_mapping_data = {}
+
+        for step_source_schema, step_target_schema in zip(path, path[1:]):
+            self._load_schemas(step_source_schema, step_target_schema)
+
+            source_target_schema_tuple = SourceTargetSchemaTuple(
+                source_schema=step_source_schema,
+                target_schema=step_target_schema,
+            )
+            if source_target_schema_tuple in self._tax_mapping_data.keys():
+                tax_mapping_data[
+                    source_target_schema_tuple
+                ] = self._tax_mapping_data[source_target_schema_tuple]
+
+            for setting_tuple, conv_matrix in self._ds_mapping_data.items():
+                if setting_tuple.source_schema != step_source_schema:
+                    continue
+                if setting_tuple.target_schema != step_target_schema:
+                    continue
+                conv_matrix.compile()
+                ds_mapping_data[setting_tuple] = conv_matrix
+
+        return SchemaMapper(
+            tax_mapping_data,
+            ds_mapping_data,
+            pruning_epsilon=pruning_epsilon,
+        )
+
+    def get_data_hash(self):
+        """
+        Returns a sha256 hex digest of the mapping data (and
+        the pruning_epsilon).
+
+        This is only for the data that we have loaded, so it
+        should be used for a subset.
+        """
+        digest = hashlib.sha256()
+        digest.update(json.dumps(self.pruning_epsilon).encode("utf-8"))
+        for key in sorted(self._tax_mapping_data.keys()):
+            digest.update(
+                json.dumps(
+                    [list(key), self._tax_mapping_data[key]], sort_keys=True
+                ).encode("utf-8")
+            )
+        for key in sorted(self._ds_mapping_data.keys()):
+            conv_matrix = self._ds_mapping_data[key]
+            conv_matrix.compile()
+            digest.update(
+                json.dumps(
+                    [list(key), conv_matrix.conv_matrix], sort_keys=True
+                ).encode("utf-8")
+            )
+        return digest.hexdigest()
+
+    def compile_mapping(self, source_schema, target_schema):
+        """
+        Returns the (cached) CompiledSchemaMapping for the schemas.
+
+        This way we don't need to create the SchemaMapperResult
+        objects again for every cell.
+        """
+        key = SourceTargetSchemaTuple(
+            source_schema=source_schema,
+            target_schema=target_schema,
+        )
+        compiled_mapping = self._compiled_mappings.get(key)
+        if compiled_mapping is None:
+            # With threads we must make sure that all of them
+            # use the very same compiled mapping.
+            compiled_mapping = self._compiled_mappings.setdefault(
+                key,
+                CompiledSchemaMapping(
+                    self, source_schema, target_schema, self.pruning_epsilon
+                ),
+            )
+        return compiled_mapping
+
     def map_schema(
         self,
         source_schema,
@@ -291,6 +711,8 @@ class SchemaMapper:
         self, source_schema, source_taxonomy, target_schema
     ):
 
+        self._load_schemas(source_schema, target_schema)
+
         source_target_schema_tuple = SourceTargetSchemaTuple(
             source_schema=source_schema,
             target_schema=target_schema,
@@ -324,6 +746,12 @@ class SchemaMapper:
         target_schema,
     ):
 
+        path = self.find_schema_path(source_schema, target_schema)
+        if path is not None and len(path) > 2:
+            return self._do_map_schema_path(
+                path, source_taxonomy, source_damage_state
+            )
+
         mapping_results = []
 
         tax_conv_row = self._map_schema_1_just_taxonomy(
@@ -388,3 +816,36 @@ class SchemaMapper:
                     mapping_results.append(single_mapping_result)
 
         return mapping_results
+
+    def _do_map_schema_path(self, path, source_taxonomy, source_damage_state):
+        """
+        Maps one building over all the schemas of the path.
+
+        The fractions of the results of one step are multiplied with
+        the fractions of the next step, and the fractions for the same
+        taxonomy & damage state are summed up.
+        """
+        fractions = {(source_taxonomy, source_damage_state): 1.0}
+        for step_source_schema, step_target_schema in zip(path, path[1:]):
+            next_fractions = collections.defaultdict(float)
+            for (taxonomy, damage_state), fraction in fractions.items():
+                for result in self._map_schema_1(
+                    step_source_schema,
+                    taxonomy,
+                    damage_state,
+                    step_target_schema,
+                ):
+                    next_fractions[(result.taxonomy, result.damage_state)] += (
+                        fraction * result.n_buildings
+                    )
+            fractions = next_fractions
+
+        return [
+            SchemaMapperResult(
+                schema=path[-1],
+                taxonomy=taxonomy,
+                damage_state=damage_state,
+                n_buildings=fraction,
+            )
+            for (taxonomy, damage_state), fraction in fractions.items()
+        ]
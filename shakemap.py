@@ -85,10 +85,13 @@ class EqShakemap:
 
         return float(nominal_lon_spacing), float(nominal_lat_spacing)
 
-    def to_intensity_provider(self):
+    def to_intensity_provider(self, workers=1):
         """
         Returns an instance to access the data point
         that is closest to a given location.
+
+        The workers are used for the batch queries
+        (-1 for all the cpus).
         """
         data, units = read_shakemap_data_and_units(
             grid_fields=self._find_grid_fields(),
@@ -102,7 +105,9 @@ class EqShakemap:
             possible_y_columns=["LAT", "CENTROID_LAT"],
         )
 
-        return intensityprovider.IntensityProvider(intensity_data=wrapped_data)
+        return intensityprovider.IntensityProvider(
+            intensity_data=wrapped_data, workers=workers
+        )
 
 
 class ShakemapGridField:
@@ -22,8 +22,15 @@ Name comes from https://de.wikipedia.org/wiki/Tellus
 import glob
 import json
 import os
+import sys
 
+import create_shapefile
+import executors
+import fragility
 import gpdexposure
+import loss
+import mappingcache
+import referencebundle
 import schemamapping
 
 
@@ -41,13 +48,41 @@ class Child:
         exposure_schema,
         loss_provider,
         args_with_output_paths,
+        engine="series",
+        damage_epsilon=0.0,
+        executor=None,
+        exposure_batches=None,
+        summary_directory=None,
+        pruning_epsilon=0.0,
+        mapping_cache=False,
     ):
+        """
+        Init the child.
+
+        If the exposure_batches are given (an iterable of
+        geodataframes, see gpdexposure.read_exposure_batches),
+        we process them one after another instead of the old_exposure.
+        If the summary_directory is given, we write the summary.shp &
+        the meta_summary.json (see create_shapefile) there as well.
+        With the mapping_cache we store the exposure mapped to the
+        schema of the fragility functions next to the exposure file
+        (see mappingcache), and reuse it in later runs. In this case
+        the old_exposure can be None, as we read the exposure file
+        only if we need it.
+        """
         self.intensity_provider = intensity_provider
         self.fragility_provider = fragility_provider
         self.old_exposure = old_exposure
         self.exposure_schema = exposure_schema
         self.loss_provider = loss_provider
         self.args_with_output_paths = args_with_output_paths
+        self.engine = engine
+        self.damage_epsilon = damage_epsilon
+        self.pruning_epsilon = pruning_epsilon
+        self.mapping_cache = mapping_cache
+        self.executor = executor
+        self.exposure_batches = exposure_batches
+        self.summary_directory = summary_directory
 
     def run(self):
         """
@@ -56,18 +91,80 @@ class Child:
         current_dir = os.path.dirname(__file__)
         schema_mapper = create_schema_mapper(current_dir)
 
-        result_exposure = gpdexposure.update_exposure_transitions_and_losses(
-            self.old_exposure,
-            self.exposure_schema,
+        if self.summary_directory is None:
+            summary = None
+        else:
+            summary = create_shapefile.Summary()
+
+        if self.exposure_batches is not None:
+            self.run_in_batches(schema_mapper, summary)
+        else:
+            exposure = self.old_exposure
+            exposure_schema = self.exposure_schema
+            if self.mapping_cache:
+                exposure = mappingcache.read_or_map_exposure(
+                    self.args_with_output_paths.exposure_file,
+                    exposure_schema,
+                    self.fragility_provider.schema,
+                    schema_mapper,
+                    pruning_epsilon=self.pruning_epsilon,
+                    exposure=exposure,
+                )
+                exposure_schema = self.fragility_provider.schema
+            result_exposure = self.update(
+                exposure, schema_mapper, exposure_schema
+            )
+
+            write_result(
+                self.args_with_output_paths.merged_output_file,
+                result_exposure,
+            )
+            if summary is not None:
+                summary.add_dataframe(result_exposure)
+
+        if summary is not None:
+            summary.write(self.summary_directory)
+
+        print_cache_statistics(self.fragility_provider)
+
+    def run_in_batches(self, schema_mapper, summary=None):
+        """
+        Updates & writes the exposure batch by batch.
+
+        We only hold one batch (and its result) in memory.
+        If the summary is given, we add all the results to it.
+        If a batch fails, the writer removes the partial output,
+        so that nobody takes it for a full result.
+        """
+        output_file = self.args_with_output_paths.merged_output_file
+        if os.path.exists(output_file):
+            os.unlink(output_file)
+        with gpdexposure.create_exposure_writer(output_file) as writer:
+            for batch in self.exposure_batches:
+                result_exposure = self.update(batch, schema_mapper)
+                writer.write(result_exposure)
+                if summary is not None:
+                    summary.add_dataframe(result_exposure)
+
+    def update(self, exposure, schema_mapper, exposure_schema=None):
+        """
+        Update the exposure & compute the transitions and losses.
+
+        The exposure_schema is the one of the child if it is not given.
+        """
+        if exposure_schema is None:
+            exposure_schema = self.exposure_schema
+        return gpdexposure.update_exposure_transitions_and_losses(
+            exposure,
+            exposure_schema,
             schema_mapper,
             self.intensity_provider,
             self.fragility_provider,
             self.loss_provider,
-        )
-
-        write_result(
-            self.args_with_output_paths.merged_output_file,
-            result_exposure,
+            engine=self.engine,
+            damage_epsilon=self.damage_epsilon,
+            executor=self.executor,
+            pruning_epsilon=self.pruning_epsilon,
         )
 
 
@@ -75,6 +172,9 @@ def create_schema_mapper(current_dir):
     """
     Creates and returns a schema mapper
     using local mapping files.
+
+    If there is an up to date reference bundle, we use it
+    instead of reading all of the json files.
     """
     pattern_to_search_for_tax_files = os.path.join(
         current_dir, "schema_mapping_data_tax", "*.json"
@@ -86,6 +186,14 @@ def create_schema_mapper(current_dir):
     )
     ds_mapping_files = glob.glob(pattern_to_search_for_ds_files)
 
+    bundle = referencebundle.open_bundle(
+        current_dir, "tax_mapping", tax_mapping_files
+    )
+    if bundle is not None and bundle.is_up_to_date(
+        "ds_mapping", ds_mapping_files
+    ):
+        return schemamapping.SchemaMapper.from_bundle(bundle)
+
     # fmt: off
     return schemamapping. \
         SchemaMapper. \
@@ -95,10 +203,229 @@ def create_schema_mapper(current_dir):
     # fmt: on
 
 
+def create_loss_provider(current_dir):
+    """
+    Creates and returns a loss provider
+    using the local loss data (in USD).
+
+    If there is an up to date reference bundle, we read the
+    data from there.
+    """
+    pattern_to_search_for_loss_files = os.path.join(
+        current_dir, "loss_data", "*.json"
+    )
+    loss_files = glob.glob(pattern_to_search_for_loss_files)
+
+    bundle = referencebundle.open_bundle(current_dir, "loss_data", loss_files)
+    if bundle is not None:
+        return loss.LossProvider.from_bundle(bundle, "USD")
+    return loss.LossProvider.from_files(loss_files, "USD")
+
+
 def write_result(output_file, cells):
     """
     Write the updated exposure.
+
+    The output is compact GeoJSON (see geojsonio.ExposureWriter)
+    or GeoParquet/Arrow (see arrowio.ExposureWriter), depending on
+    the extension of the output file.
     """
     if os.path.exists(output_file):
         os.unlink(output_file)
-    cells.to_file(output_file, "GeoJSON")
+    with gpdexposure.create_exposure_writer(output_file) as writer:
+        writer.write(cells)
+
+
+def create_fragility_provider(fragility_file, args):
+    """
+    Read the fragility file & create the fragility provider
+    with the options of the command line (see get_fragility_options).
+    """
+    return fragility.Fragility.from_file(fragility_file).to_fragility_provider(
+        **get_fragility_options(args)
+    )
+
+
+def get_fragility_options(args):
+    """
+    Return the options of the command line for
+    Fragility.to_fragility_provider.
+
+    A function_cache_size of 0 means that the caches have no limit.
+    """
+    function_cache_size = args.function_cache_size
+    if function_cache_size == 0:
+        function_cache_size = None
+    return {
+        "function_cache_size": function_cache_size,
+        "quantization": args.quantization,
+        "max_tabulation_error": args.max_tabulation_error,
+        "tabulation_file": args.tabulation_file,
+    }
+
+
+def format_cache_statistics(statistics):
+    """Return a line with the counters of the fragility function caches."""
+    if statistics.capacity is None:
+        capacity = "no limit"
+    else:
+        capacity = "capacity {0}".format(statistics.capacity)
+    return (
+        "Fragility function caches: {0} hits, {1} misses, {2} evictions, "
+        + "{3} entries ({4})"
+    ).format(
+        statistics.hits,
+        statistics.misses,
+        statistics.evictions,
+        statistics.size,
+        capacity,
+    )
+
+
+def print_cache_statistics(fragility_provider, prefix=""):
+    """
+    Print the counters of the fragility function caches to stderr,
+    so that we can see if the caches pay off.
+
+    The compiled fragility functions of the columnar engine don't
+    use the caches (unless there is a quantization).
+    """
+    print(
+        prefix
+        + format_cache_statistics(fragility_provider.get_cache_statistics()),
+        file=sys.stderr,
+    )
+
+
+def get_query_workers(args):
+    """
+    Return the number of workers for the batch queries of the
+    intensity providers.
+
+    The serial executor updates all the chunks in the main process,
+    so there the queries can use the workers. The other executors
+    already run the chunks in parallel, so we query with one worker
+    there.
+    """
+    if args.executor != "serial":
+        return 1
+    if args.workers is None:
+        return -1
+    return args.workers
+
+
+def add_common_arguments(argparser, single_run=True):
+    """
+    Add the arguments that all the command line programs share
+    (the engine, the epsilons, the executor & the workers and
+    the options for the fragility functions).
+
+    For the programs with a single run (deus, volcanus & neptunus)
+    we also add the arguments for reading the exposure (see
+    read_exposure_for_args) & for the summary.
+    """
+    argparser.add_argument(
+        "--engine",
+        default="columnar",
+        choices=gpdexposure.ENGINES,
+        help="Engine to update the exposure (cell by cell with series, "
+        + "or all cells at once with columnar)",
+    )
+    argparser.add_argument(
+        "--damage_epsilon",
+        default=0.0,
+        type=float,
+        help="Cells in which no transition probability is higher than "
+        + "this value are passed through without any damage",
+    )
+    argparser.add_argument(
+        "--pruning_epsilon",
+        default=0.0,
+        type=float,
+        help="Parts of the expo rows (and mapping fractions) below this "
+        + "share of their row are dropped & the others scaled up, so "
+        + "that the numbers of buildings & the population stay the same",
+    )
+    argparser.add_argument(
+        "--executor",
+        default="processes",
+        choices=executors.EXECUTORS.keys(),
+        help="How to run the update of the exposure chunks",
+    )
+    argparser.add_argument(
+        "--workers",
+        default=None,
+        type=int,
+        help="Number of workers for the executor (default: number of cpus); "
+        + "with the serial executor for the intensity queries",
+    )
+    argparser.add_argument(
+        "--function_cache_size",
+        default=fragility.FUNCTION_CACHE_SIZE,
+        type=int,
+        help="Number of intensities for which each fragility function "
+        + "caches its values (0 for no limit)",
+    )
+    argparser.add_argument(
+        "--quantization",
+        default=None,
+        type=float,
+        help="If given, round the intensities to a multiple of this value "
+        + "before the cached fragility functions are evaluated (this "
+        + "uses the caches also with the columnar engine)",
+    )
+    argparser.add_argument(
+        "--max_tabulation_error",
+        default=None,
+        type=float,
+        help="If given, evaluate the fragility functions with lookup "
+        + "tables that differ from the exact cdfs by up to this value",
+    )
+    argparser.add_argument(
+        "--tabulation_file",
+        default=None,
+        help="Npz file for the lookup tables of --max_tabulation_error: "
+        + "the tables are read from there & new ones are stored there, "
+        + "so that later runs don't need to build them again",
+    )
+    if not single_run:
+        return
+    argparser.add_argument(
+        "--mapping_cache",
+        action="store_true",
+        help="Store the exposure mapped to the schema of the fragility "
+        + "functions next to the exposure file & reuse it in later runs "
+        + "(not used with --batch_size)",
+    )
+    argparser.add_argument(
+        "--batch_size",
+        default=None,
+        type=int,
+        help="Read & process the exposure in batches of this number of "
+        + "cells, so that the memory usage doesn't depend on the exposure "
+        + "size (default: all cells at once)",
+    )
+    argparser.add_argument(
+        "--summary_directory",
+        default=None,
+        help="If given, write the summary.shp & the meta_summary.json "
+        + "for the visualization into this directory",
+    )
+
+
+def read_exposure_for_args(args):
+    """
+    Read the exposure file of the args.
+
+    Returns the exposure & the exposure batches (see Child), one
+    of them is None. With the mapping cache we don't read the
+    exposure here, as the child reads it only if it is not cached.
+    """
+    if args.batch_size is not None:
+        exposure_batches = gpdexposure.read_exposure_batches(
+            args.exposure_file, args.batch_size
+        )
+        return None, exposure_batches
+    if args.mapping_cache:
+        return None, None
+    return gpdexposure.read_exposure(args.exposure_file), None
@@ -22,16 +22,26 @@ import unittest
 
 # import other test classes
 from test_basics import *
+from test_arrowio import *
 from test_ashfall import *
 from test_cmdexecution import *
+from test_create_shapefile import *
+from test_deus_server import *
+from test_executors import *
+from test_exposuretable import *
 from test_fragility import *
+from test_geojsonio import *
 from test_gpdexposure import *
 from test_intensity import *
 from test_intensitydatawrapper import *
 from test_loss import *
+from test_mappingcache import *
+from test_referencebundle import *
 from test_performance import *
+from test_rasterintensityprovider import *
 from test_schemamapping import *
 from test_shakemap import *
+from test_vocabulary import *
 
 
 if __name__ == "__main__":
@@ -0,0 +1,148 @@
+#!/usr/bin/env python3
+
+# Copyright © 2021-2022 Helmholtz Centre Potsdam GFZ German Research Centre for
+# Geosciences, Potsdam, Germany
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+"""
+Test cases for reading & writing the exposure as GeoParquet/Arrow.
+"""
+
+import os
+import tempfile
+import unittest
+import unittest.mock
+
+import geopandas
+import pandas
+
+import arrowio
+import gpdexposure
+
+
+def read_test_exposure():
+    """
+    Read the exposure of the test inputs.
+
+    The expo has lists (instead of dicts with the row numbers)
+    as in the deus output.
+    """
+    current_dir = os.path.dirname(os.path.abspath(__file__))
+    exposure_file = os.path.join(
+        current_dir, "testinputs", "exposure_from_assetmaster.json"
+    )
+    exposure = gpdexposure.read_exposure(exposure_file)
+    exposure["expo"] = [
+        {key: list(values.values()) for key, values in expo.items()}
+        for expo in exposure["expo"]
+    ]
+    return exposure
+
+
+@unittest.skipIf(arrowio.pyarrow is None, "pyarrow is not installed")
+class TestArrowio(unittest.TestCase):
+    """Test class for the arrowio module."""
+
+    def assert_same_exposure(self, expected, result):
+        """Check that we have the same columns, values & geometries."""
+        self.assertEqual(list(expected.columns), list(result.columns))
+        self.assertEqual(expected.crs, result.crs)
+        for column in expected.columns:
+            if column != "geometry":
+                self.assertEqual(
+                    expected[column].tolist(), result[column].tolist()
+                )
+        self.assertTrue(expected.geom_equals(result).all())
+
+    def test_file_format(self):
+        """The extension decides about the format."""
+        self.assertEqual("parquet", arrowio.get_file_format("a.parquet"))
+        self.assertEqual("arrow", arrowio.get_file_format("a/b.Arrow"))
+        self.assertIsNone(arrowio.get_file_format("a.json"))
+
+    def test_read_and_write(self):
+        """We get the same exposure back (all at once & in batches)."""
+        expected = read_test_exposure()
+        # Not all the cells have all the keys in the expo.
+        expected.loc[1, "expo"]["Region"] = ["north"] * len(
+            expected.loc[1, "expo"]["Taxonomy"]
+        )
+        with tempfile.TemporaryDirectory() as tmpdir:
+            for filename in ["exposure.parquet", "exposure.arrow"]:
+                output_file = os.path.join(tmpdir, filename)
+                with gpdexposure.create_exposure_writer(output_file) as writer:
+                    writer.write(expected.iloc[:2])
+                    writer.write(expected.iloc[2:])
+
+                result = gpdexposure.read_exposure(output_file)
+                self.assert_same_exposure(expected, result)
+
+                batches = list(
+                    gpdexposure.read_exposure_batches(output_file, 2)
+                )
+                self.assertEqual([2, 1], [len(batch) for batch in batches])
+                self.assert_same_exposure(
+                    expected, pandas.concat(batches, ignore_index=True)
+                )
+
+    def test_without_geopandas_wkb_and_projjson(self):
+        """
+        With older geopandas & pyproj versions we use shapely for
+        the WKB and write the crs as WKT.
+        """
+        expected = read_test_exposure()
+        with unittest.mock.patch.multiple(
+            arrowio, HAS_GEOPANDAS_WKB=False, HAS_PROJJSON=False
+        ):
+            with tempfile.TemporaryDirectory() as tmpdir:
+                output_file = os.path.join(tmpdir, "exposure.parquet")
+                with arrowio.ExposureWriter(output_file) as writer:
+                    writer.write(expected)
+                result = arrowio.read_exposure(output_file)
+        self.assert_same_exposure(expected, result)
+
+    def test_pyarrow_version(self):
+        """We tell if pyarrow is too old."""
+        with unittest.mock.patch.object(
+            arrowio.pyarrow, "__version__", "2.0.0"
+        ):
+            with self.assertRaisesRegex(Exception, "pyarrow >= 3.0"):
+                arrowio.check_pyarrow()
+
+    def test_writer_with_different_columns(self):
+        """All the batches must have the same columns."""
+        exposure = read_test_exposure()
+        other = exposure.iloc[2:].copy()
+        other["extra"] = 1
+        with tempfile.TemporaryDirectory() as tmpdir:
+            output_file = os.path.join(tmpdir, "exposure.parquet")
+            with self.assertRaises(Exception):
+                with arrowio.ExposureWriter(output_file) as writer:
+                    writer.write(exposure.iloc[:2])
+                    writer.write(other)
+            # We don't leave a file with only some of the cells.
+            self.assertFalse(os.path.exists(output_file))
+
+    def test_empty_writer(self):
+        """Without any batch we get a file without cells."""
+        with tempfile.TemporaryDirectory() as tmpdir:
+            output_file = os.path.join(tmpdir, "exposure.arrow")
+            with arrowio.ExposureWriter(output_file):
+                pass
+            result = arrowio.read_exposure(output_file)
+            self.assertIsInstance(result, geopandas.GeoDataFrame)
+            self.assertEqual(0, len(result))
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -305,6 +305,19 @@ class TestBasics(unittest.TestCase):
         self.assertLess(15.9, intensity_testdata3)
         self.assertLess(intensity_testdata3, 16.1)
 
+        intensities4, units4 = intensity_provider.get_nearest_many(
+            lons=[15, 13, 16], lats=[51, 50, 51]
+        )
+        self.assertEqual(
+            [
+                intensities["testdata"],
+                intensities2["testdata"],
+                intensities3["testdata"],
+            ],
+            intensities4["testdata"].tolist(),
+        )
+        self.assertEqual(units4["testdata"], "unitless")
+
     def test_read_lahar_data(self):
         """
         Test the intensity provider of the lahar data.
@@ -422,6 +435,10 @@ class MockedIntensityProvider:
         """Also a dummy implementation."""
         return {"PGA": 1}, {"PGA": "g"}
 
+    def get_nearest_many(self, lons, lats):
+        """Also a dummy implementation."""
+        return {"PGA": np.ones(len(lons))}, {"PGA": "g"}
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -17,8 +17,11 @@
 """
 Test classes to run deus as a command line tool.
 """
+import json
 import os
+import shutil
 import subprocess
+import tempfile
 import unittest
 
 import geopandas
@@ -264,6 +267,234 @@ class TestDeusCmdExecution(unittest.TestCase):
             check=True,
         )
 
+    def test_execute_deus_in_batches_with_summary(self):
+        """
+        Runs deus with batches of the exposure & writes
+        the summary for the visualization in the same run.
+        """
+        schema = "SARA_v1.0"
+
+        current_dir = os.path.dirname(os.path.abspath(__file__))
+
+        testinput_dir = os.path.join(current_dir, "testinputs")
+        test_shakemap = os.path.join(testinput_dir, "shakemap.xml")
+        test_exposure_file = os.path.join(
+            testinput_dir, "exposure_from_assetmaster.json"
+        )
+        test_fragility_file = os.path.join(
+            testinput_dir, "fragility_sara.json"
+        )
+
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        output_dir = tmpdir.name
+        summary_dir = os.path.join(output_dir, "summary")
+
+        merged_output_filename = os.path.join(
+            output_dir, "merged_batches.json"
+        )
+
+        os.mkdir(summary_dir)
+
+        subprocess.run(
+            [
+                "python3",
+                "deus.py",
+                "--merged_output_file",
+                merged_output_filename,
+                "--batch_size",
+                "2",
+                "--summary_directory",
+                summary_dir,
+                test_shakemap,
+                test_exposure_file,
+                schema,
+                test_fragility_file,
+            ],
+            check=True,
+        )
+
+        merged = geopandas.read_file(merged_output_filename)
+        summary = geopandas.read_file(os.path.join(summary_dir, "summary.shp"))
+        self.assertEqual(3, len(merged))
+        self.assertEqual(merged["gid"].tolist(), summary["id"].tolist())
+        with open(os.path.join(summary_dir, "meta_summary.json")) as infile:
+            meta_summary = json.load(infile)
+        self.assertAlmostEqual(
+            merged["loss_value"].sum(), meta_summary["total"]["loss_value"]
+        )
+        self.assertEqual("USD", meta_summary["loss_unit"])
+
+    def test_execute_deus_scenarios(self):
+        """
+        Runs deus for several scenarios in one run & writes the
+        statistics of the losses over all the scenarios.
+        """
+        schema = "SARA_v1.0"
+
+        current_dir = os.path.dirname(os.path.abspath(__file__))
+
+        testinput_dir = os.path.join(current_dir, "testinputs")
+        test_shakemap = os.path.join(testinput_dir, "shakemap.xml")
+        test_exposure_file = os.path.join(
+            testinput_dir, "exposure_from_assetmaster.json"
+        )
+        test_fragility_file = os.path.join(
+            testinput_dir, "fragility_sara.json"
+        )
+
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        output_dir = tmpdir.name
+        scenario_dir = os.path.join(output_dir, "scenarios")
+        statistics_filename = os.path.join(output_dir, "statistics.json")
+        single_output_filename = os.path.join(output_dir, "merged_single.json")
+
+        os.mkdir(scenario_dir)
+        # Two scenarios with the very same shakemap.
+        for scenario in ["scenario1", "scenario2"]:
+            shutil.copy(
+                test_shakemap, os.path.join(scenario_dir, scenario + ".xml")
+            )
+
+        subprocess.run(
+            [
+                "python3",
+                "deus.py",
+                "--merged_output_file",
+                single_output_filename,
+                test_shakemap,
+                test_exposure_file,
+                schema,
+                test_fragility_file,
+            ],
+            check=True,
+        )
+        subprocess.run(
+            [
+                "python3",
+                "deus_scenarios.py",
+                "--output_directory",
+                scenario_dir,
+                "--statistics_file",
+                statistics_filename,
+                test_exposure_file,
+                schema,
+                test_fragility_file,
+                os.path.join(scenario_dir, "*.xml"),
+            ],
+            check=True,
+        )
+
+        expected = geopandas.read_file(single_output_filename)
+        for scenario in ["scenario1", "scenario2"]:
+            result = geopandas.read_file(
+                os.path.join(scenario_dir, scenario + "_merged.json")
+            )
+            self.assertEqual(expected["gid"].tolist(), result["gid"].tolist())
+            self.assertEqual(
+                expected["loss_value"].tolist(), result["loss_value"].tolist()
+            )
+        statistics = geopandas.read_file(statistics_filename)
+        self.assertEqual(expected["gid"].tolist(), statistics["gid"].tolist())
+        for column in ["loss_mean", "loss_p5", "loss_p50", "loss_p95"]:
+            self.assertEqual(
+                expected["loss_value"].tolist(), statistics[column].tolist()
+            )
+
+    def test_execute_deus_chain(self):
+        """
+        Runs an earthquake & a tsunami in one run, with the same
+        results as two runs of deus.
+        """
+        schema = "SARA_v1.0"
+
+        current_dir = os.path.dirname(os.path.abspath(__file__))
+
+        testinput_dir = os.path.join(current_dir, "testinputs")
+        test_exposure_file = os.path.join(
+            testinput_dir, "exposure_from_assetmaster.json"
+        )
+        stages = [
+            {
+                "name": "earthquake",
+                "hazard": "shakemap",
+                "intensity_file": os.path.join(testinput_dir, "shakemap.xml"),
+                "fragility_file": os.path.join(
+                    testinput_dir, "fragility_sara.json"
+                ),
+            },
+            {
+                "name": "tsunami",
+                "hazard": "shakemap",
+                "intensity_file": os.path.join(
+                    testinput_dir, "shakemap_tsunami.xml"
+                ),
+                "fragility_file": os.path.join(
+                    testinput_dir, "fragility_suppasri.json"
+                ),
+            },
+        ]
+
+        tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(tmpdir.cleanup)
+        output_dir = tmpdir.name
+        stage_output_dir = os.path.join(output_dir, "stages")
+        stages_filename = os.path.join(output_dir, "stages.json")
+        merged_output_filename = os.path.join(output_dir, "merged_chain.json")
+        step_output_filenames = [
+            os.path.join(output_dir, "merged_step1.json"),
+            os.path.join(output_dir, "merged_step2.json"),
+        ]
+
+        with open(stages_filename, "w") as outfile:
+            json.dump(stages, outfile)
+
+        subprocess.run(
+            [
+                "python3",
+                "deus_chain.py",
+                "--merged_output_file",
+                merged_output_filename,
+                "--stage_output_directory",
+                stage_output_dir,
+                test_exposure_file,
+                schema,
+                stages_filename,
+            ],
+            check=True,
+        )
+        exposure_filename = test_exposure_file
+        for stage, step_output_filename in zip(stages, step_output_filenames):
+            subprocess.run(
+                [
+                    "python3",
+                    "deus.py",
+                    "--merged_output_file",
+                    step_output_filename,
+                    stage["intensity_file"],
+                    exposure_filename,
+                    schema,
+                    stage["fragility_file"],
+                ],
+                check=True,
+            )
+            exposure_filename = step_output_filename
+
+        for result_filename, expected_filename in [
+            (
+                os.path.join(stage_output_dir, "1_earthquake.json"),
+                step_output_filenames[0],
+            ),
+            (merged_output_filename, step_output_filenames[1]),
+        ]:
+            result = geopandas.read_file(result_filename)
+            expected = geopandas.read_file(expected_filename)
+            for column in ["gid", "expo", "loss_value", "cum_loss_value"]:
+                self.assertEqual(
+                    expected[column].tolist(), result[column].tolist()
+                )
+
     def test_execute_deus_in_peru_for_schema_mapping_to_suppasri(
         self,
     ):
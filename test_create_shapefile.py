@@ -0,0 +1,196 @@
+#!/usr/bin/env python3
+
+# Copyright © 2021-2022 Helmholtz Centre Potsdam GFZ German Research Centre for
+# Geosciences, Potsdam, Germany
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+"""
+Test cases for the summary of the updated exposure.
+"""
+
+import json
+import unittest
+
+import geopandas
+import numpy
+import pandas
+import shapely.geometry
+
+import create_shapefile
+
+
+def create_properties(gid, expo, transitions):
+    """Create the properties of an updated cell."""
+    return {
+        "gid": gid,
+        "loss_value": 1.5,
+        "loss_unit": "USD",
+        "cum_loss_value": 2.5,
+        "cum_loss_unit": "USD",
+        "expo": {
+            "Taxonomy": [x[0] for x in expo],
+            "Damage": [x[1] for x in expo],
+            "Buildings": [x[2] for x in expo],
+        },
+        "transitions": {
+            "from_damage_state": [x[0] for x in transitions],
+            "to_damage_state": [x[1] for x in transitions],
+            "n_buildings": [x[2] for x in transitions],
+        },
+    }
+
+
+class TestSummary(unittest.TestCase):
+    """Test the computation of the summary."""
+
+    def test_sums_by_cell(self):
+        """The sums must be (nearly) the same as with numpy.sum per cell."""
+        random = numpy.random.default_rng(42)
+        counts = random.integers(0, 300, 200)
+        cells = numpy.repeat(numpy.arange(len(counts)), counts)
+        values = random.random(len(cells)) * 1000
+
+        sums = create_shapefile.sums_by_cell(cells, len(counts), values)
+
+        self.assertEqual(numpy.float64, sums.dtype)
+        for cell in range(len(counts)):
+            self.assertAlmostEqual(
+                values[cells == cell].sum(), sums[cell], delta=1e-6
+            )
+
+    def test_to_json_numbers(self):
+        """We get the same text as with json.dumps for each number."""
+        values = [1, 2.5, 0.1, 1e-20, 123456789.125, float("nan")]
+        expected = [json.dumps(value) for value in values]
+        for numbers in [
+            values,
+            [numpy.int64(1)] + [numpy.float64(x) for x in values[1:]],
+        ]:
+            self.assertEqual(
+                expected, create_shapefile.to_json_numbers(numbers).tolist()
+            )
+        self.assertEqual(
+            expected[1:],
+            create_shapefile.to_json_numbers(numpy.array(values[1:])).tolist(),
+        )
+        self.assertEqual(
+            ["1", "2"],
+            create_shapefile.to_json_numbers(numpy.array([1, 2])).tolist(),
+        )
+        self.assertEqual(
+            [], create_shapefile.to_json_numbers(numpy.array([])).tolist()
+        )
+
+    def test_summary(self):
+        """Test the columns & the meta summary for some cells."""
+        summary = create_shapefile.Summary()
+        summary.add_feature(
+            create_properties(
+                "a",
+                [("MUR", "D0", 2.0), ("MUR", "D1", 3.0), ("CR", "D0", 5.0)],
+                [(0, 1, 3.0)],
+            ),
+            shapely.geometry.Point(0, 0),
+        )
+        summary.add_feature(
+            create_properties(
+                "b",
+                [("CR", "D2", 1.0), ("CR", "D2", 4.0)],
+                [],
+            ),
+            shapely.geometry.Point(1, 1),
+        )
+
+        columns, meta_summary = summary.compute()
+
+        self.assertEqual(["a", "b"], columns["id"])
+        self.assertEqual([10.0, 4.0], list(columns["buildings"]))
+        self.assertEqual([3.0, 0.0], list(columns["m_tran"]))
+        self.assertEqual([0.3, 2.0], list(columns["w_damage"]))
+        self.assertEqual(
+            {
+                "c1": "Transitions from damage state 0",
+                "c2": "Buildings in MUR per damage state",
+                "c3": "Buildings in CR per damage state",
+            },
+            meta_summary["custom_columns"],
+        )
+        self.assertEqual([json.dumps({"1": 3.0}), None], columns["c1"])
+        # The last value wins for the same taxonomy & damage state.
+        self.assertEqual(
+            [json.dumps({"0": 5.0}), json.dumps({"2": 4.0})], columns["c3"]
+        )
+        self.assertEqual(
+            {
+                "loss_value": 3.0,
+                "cum_loss": 5.0,
+                "transition_matrix_from_damage_state": {0: {1: 3.0}},
+                "buildings_by_damage_state": {0: 7.0, 1: 3.0, 2: 5.0},
+            },
+            meta_summary["total"],
+        )
+
+    def test_summary_in_batches(self):
+        """
+        Adding the cells batch by batch gives the same summary, but
+        we only keep the entries of the current batch.
+        """
+        features = [
+            (
+                create_properties(
+                    "a",
+                    [("MUR", "D0", 2.0), ("CR", "D1", 5.0)],
+                    [(0, 1, 3.0), (0, 2, 1.0)],
+                ),
+                shapely.geometry.Point(0, 0),
+            ),
+            (
+                create_properties("b", [("CR", "D2", 1.0)], [(1, 2, 4.0)]),
+                shapely.geometry.Point(1, 1),
+            ),
+            (
+                create_properties(
+                    "c",
+                    [("W", "D0", 3.0), ("MUR", "D1", 2.5)],
+                    [(0, 1, 0.5)],
+                ),
+                shapely.geometry.Point(2, 2),
+            ),
+        ]
+
+        def to_dataframe(batch):
+            return geopandas.GeoDataFrame(
+                pandas.DataFrame([properties for properties, _ in batch]),
+                geometry=[geometry for _, geometry in batch],
+            )
+
+        expected_summary = create_shapefile.Summary()
+        for properties, geometry in features:
+            expected_summary.add_feature(properties, geometry)
+        expected_columns, expected_meta_summary = expected_summary.compute()
+
+        summary = create_shapefile.Summary()
+        for batch in [features[:2], features[2:]]:
+            summary.add_dataframe(to_dataframe(batch))
+            self.assertEqual([], summary.transition_cells)
+            self.assertEqual([], summary.expo_buildings)
+        columns, meta_summary = summary.compute()
+
+        self.assertEqual(expected_meta_summary, meta_summary)
+        self.assertEqual(expected_columns.keys(), columns.keys())
+        for column, values in expected_columns.items():
+            self.assertEqual(list(values), list(columns[column]))
+
+
+if __name__ == "__main__":
+    unittest.main()
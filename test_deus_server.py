@@ -0,0 +1,189 @@
+#!/usr/bin/env python3
+
+# Copyright © 2021-2022 Helmholtz Centre Potsdam GFZ German Research Centre for
+# Geosciences, Potsdam, Germany
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+"""
+Test cases for the deus server.
+"""
+
+import json
+import os
+import tempfile
+import threading
+import unittest
+import urllib.error
+import urllib.request
+
+import deus
+import deus_server
+import executors
+import fragility
+import gpdexposure
+import tellus
+
+
+def read_without_name(filename):
+    """Read the json output without the name (that is the file name)."""
+    with open(filename) as infile:
+        data = json.load(infile)
+    del data["name"]
+    return data
+
+
+class TestDeusServer(unittest.TestCase):
+    """Test class for the deus server."""
+
+    @classmethod
+    def setUpClass(cls):
+        cls.job_runner = deus_server.JobRunner(executors.SerialExecutor())
+        cls.server = deus_server.create_server(cls.job_runner, port=0)
+        cls.url = "http://127.0.0.1:{0}".format(cls.server.server_address[1])
+        cls.thread = threading.Thread(target=cls.server.serve_forever)
+        cls.thread.start()
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.server.shutdown()
+        cls.server.server_close()
+        cls.thread.join()
+
+    def post_job(self, job):
+        """Post the job & return the status and the response data."""
+        request = urllib.request.Request(
+            self.url + "/jobs",
+            data=json.dumps(job).encode("utf-8"),
+            headers={"Content-Type": "application/json"},
+        )
+        try:
+            with urllib.request.urlopen(request) as response:
+                return response.status, json.load(response)
+        except urllib.error.HTTPError as error:
+            return error.code, json.load(error)
+
+    def test_health(self):
+        """The server tells that it is up."""
+        with urllib.request.urlopen(self.url + "/health") as response:
+            self.assertEqual({"status": "ok"}, json.load(response))
+
+    def test_run_jobs(self):
+        """
+        The jobs give the same result as deus & the fragility
+        data is read only once.
+        """
+        current_dir = os.path.dirname(os.path.abspath(__file__))
+        testinput_dir = os.path.join(current_dir, "testinputs")
+        job = {
+            "intensity_file": os.path.join(testinput_dir, "shakemap.xml"),
+            "exposure_file": os.path.join(
+                testinput_dir, "exposure_from_assetmaster.json"
+            ),
+            "exposure_schema": "SARA_v1.0",
+            "fragility_file": os.path.join(
+                testinput_dir, "fragility_sara.json"
+            ),
+        }
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            expected_file = os.path.join(tmpdir, "expected.json")
+            tellus.write_result(
+                expected_file,
+                gpdexposure.update_exposure_transitions_and_losses(
+                    gpdexposure.read_exposure(job["exposure_file"]),
+                    job["exposure_schema"],
+                    self.job_runner.schema_mapper,
+                    deus.create_intensity_provider(job["intensity_file"]),
+                    fragility.Fragility.from_file(
+                        job["fragility_file"]
+                    ).to_fragility_provider(),
+                    deus.create_loss_provider(),
+                ),
+            )
+            expected = read_without_name(expected_file)
+
+            for i in range(2):
+                job["merged_output_file"] = os.path.join(
+                    tmpdir, "merged{0}.json".format(i)
+                )
+                status, data = self.post_job(job)
+                self.assertEqual(200, status)
+                self.assertEqual(3, data["cells"])
+                self.assertEqual(
+                    expected, read_without_name(job["merged_output_file"])
+                )
+
+        self.assertEqual(1, len(self.job_runner.fragility_providers))
+        # The compiled fragility functions don't use the caches.
+        self.assertEqual(0, data["cache_statistics"]["misses"])
+
+        # With a quantization we use the cached fragility functions
+        # & get their counters for the job.
+        with tempfile.TemporaryDirectory() as tmpdir:
+            job["merged_output_file"] = os.path.join(tmpdir, "merged.json")
+            job["quantization"] = 0.001
+            status, data = self.post_job(job)
+        self.assertEqual(200, status)
+        statistics = data["cache_statistics"]
+        self.assertLess(0, statistics["hits"] + statistics["misses"])
+
+    def test_invalid_jobs(self):
+        """We get an error message for invalid jobs."""
+        status, data = self.post_job({"hazard": "shakemap"})
+        self.assertEqual(400, status)
+        self.assertIn("intensity_file", data["error"])
+
+        status, data = self.post_job(
+            {
+                "hazard": "raster",
+                "intensity_file": "tsunami.tiff",
+                "exposure_file": "exposure.json",
+                "exposure_schema": "SARA_v1.0",
+                "fragility_file": "fragility_suppasri.json",
+                "merged_output_file": "merged.json",
+            }
+        )
+        self.assertEqual(400, status)
+        self.assertIn("intensity_name", data["error"])
+        self.assertIn("intensity_unit", data["error"])
+
+        status, data = self.post_job(["intensity_file"])
+        self.assertEqual(400, status)
+
+        job = {
+            "hazard": "meteor",
+            "intensity_file": "meteor.xml",
+            "exposure_file": "exposure.json",
+            "exposure_schema": "SARA_v1.0",
+            "fragility_file": "fragility_sara.json",
+            "merged_output_file": "merged.json",
+        }
+        status, data = self.post_job(job)
+        self.assertEqual(500, status)
+        self.assertIn("meteor", data["error"])
+
+        # Errors while running the job (here the fragility file
+        # does not exist) are no client errors.
+        job["hazard"] = "shakemap"
+        job["intensity_file"] = os.path.join(
+            os.path.dirname(os.path.abspath(__file__)),
+            "testinputs",
+            "shakemap.xml",
+        )
+        job["fragility_file"] = "does_not_exist.json"
+        status, data = self.post_job(job)
+        self.assertEqual(500, status)
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,120 @@
+#!/usr/bin/env python3
+
+# Copyright © 2021-2022 Helmholtz Centre Potsdam GFZ German Research Centre for
+# Geosciences, Potsdam, Germany
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+"""
+Test cases for the executors.
+"""
+
+
+import glob
+import os
+import tempfile
+import unittest
+
+import executors
+
+
+class Doubler:
+    """Updater that doubles the values."""
+
+    def update_df(self, dataframe):
+        """Return the doubled value."""
+        return dataframe * 2
+
+
+class Multiplier:
+    """Updater that multiplies the values with a factor."""
+
+    def __init__(self, factor):
+        self.factor = factor
+
+    def update_df(self, dataframe):
+        """Return the multiplied value."""
+        return dataframe * self.factor
+
+
+class LoadCounter:
+    """Updater that counts how often it was unpickled in the process."""
+
+    loaded = 0
+
+    def __setstate__(self, state):
+        type(self).loaded += 1
+
+    def update_df(self, dataframe):
+        """Return the process id & how often we unpickled an updater."""
+        return os.getpid(), type(self).loaded
+
+
+class TestExecutors(unittest.TestCase):
+    """Test class for the executors module."""
+
+    def test_executors_keep_the_order(self):
+        """All executors must give the results in the input order."""
+        chunks = list(range(20))
+        expected = [x * 2 for x in chunks]
+        for name in ["serial", "threads", "processes"]:
+            executor = executors.create_executor(name, workers=2)
+            self.assertEqual(expected, executor.map_updater(Doubler(), chunks))
+
+    def test_persistent_executor(self):
+        """The persistent pool can run several updates."""
+        chunks = list(range(20))
+        with executors.PersistentProcessExecutor(workers=2) as executor:
+            self.assertEqual(
+                [x * 2 for x in chunks],
+                executor.map_updater(Doubler(), chunks),
+            )
+            self.assertEqual(
+                [x * 3 for x in chunks],
+                executor.map_updater(Multiplier(3), chunks),
+            )
+
+    def test_persistent_executor_reads_the_updater_once(self):
+        """
+        Every worker reads the updater at most once per call & the
+        temporary file for it is removed afterwards.
+        """
+        chunks = list(range(20))
+        with executors.PersistentProcessExecutor(workers=2) as executor:
+            for call in [1, 2]:
+                results = executor.map_updater(LoadCounter(), chunks)
+                loaded_by_worker = {}
+                for pid, loaded in results:
+                    loaded_by_worker.setdefault(pid, set()).add(loaded)
+                for loaded in loaded_by_worker.values():
+                    self.assertEqual(1, len(loaded))
+                    self.assertLessEqual(max(loaded), call)
+        self.assertEqual(
+            [],
+            glob.glob(os.path.join(tempfile.gettempdir(), "deus_updater_*")),
+        )
+
+    def test_workers(self):
+        """Test the number of workers."""
+        self.assertEqual(1, executors.create_executor("serial", 4).workers)
+        self.assertEqual(4, executors.create_executor("threads", 4).workers)
+        self.assertLess(0, executors.create_executor("processes").workers)
+
+    def test_unknown_executor(self):
+        """We must fail for executors that we don't know."""
+        with self.assertRaises(Exception):
+            executors.create_executor("unknown")
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -0,0 +1,459 @@
+#!/usr/bin/env python3
+
+# Copyright © 2021-2022 Helmholtz Centre Potsdam GFZ German Research Centre for
+# Geosciences, Potsdam, Germany
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+"""
+Test cases for the columnar exposure update.
+"""
+
+import unittest
+
+import numpy
+
+import exposuretable
+import fragility
+import gpdexposure
+import loss
+import schemamapping
+import testimplementations
+import vocabulary
+
+
+def create_table():
+    """
+    Create a table with three cells.
+
+    The first two cells have buildings, the last one has none.
+    """
+    taxonomy_vocabulary = vocabulary.Vocabulary()
+    return exposuretable.ExposureTable(
+        cells=numpy.array([0, 0, 1, 2]),
+        taxonomies=taxonomy_vocabulary.intern_many(
+            "SCHEMA1", ["TAX1", "TAX2", "TAX1", "TAX2"]
+        ),
+        damage_states=numpy.array([0, 0, 1, 0]),
+        buildings=numpy.array([100.0, 50.0, 10.0, 0.0]),
+        population=numpy.array([20.0, 10.0, 5.0, 0.0]),
+        replcostbdg=numpy.array([1000.0, 2000.0, 1000.0, 3000.0]),
+        vocabulary=taxonomy_vocabulary,
+    )
+
+
+class ConstantFunction:
+    """Fragility function that always returns the same value."""
+
+    def __init__(self, mean, stddev):
+        self.mean = mean
+
+    def __call__(self, intensity):
+        return self.mean
+
+
+def create_fragility_provider():
+    """Create a fragility provider with constant probabilities."""
+    fragility_data = {
+        "meta": {"id": "SCHEMA1", "shape": "constant"},
+        "data": [
+            {
+                "imt": "intensity",
+                "imu": "unitless",
+                "D1_mean": 0.5,
+                "D1_stddev": 0,
+                "D2_mean": 0.2,
+                "D2_stddev": 0,
+                "taxonomy": "TAX1",
+            },
+            {
+                "imt": "intensity",
+                "imu": "unitless",
+                "D1_mean": 0.1,
+                "D1_stddev": 0,
+                "D2_mean": 0.0,
+                "D2_stddev": 0,
+                "taxonomy": "TAX2",
+            },
+        ],
+    }
+    return fragility.Fragility(
+        fragility_data
+    ).to_fragility_provider_with_specified_fragility_function(ConstantFunction)
+
+
+class TestExposureTable(unittest.TestCase):
+    """Test class for the exposuretable module."""
+
+    def test_group_by_first_appearance(self):
+        """The groups should be numbered as they appear first."""
+        group_ids, n_groups = exposuretable.group_by_first_appearance(
+            numpy.array([3, 1, 3, 0, 1]),
+        )
+        self.assertEqual(3, n_groups)
+        self.assertEqual([0, 1, 0, 2, 1], group_ids.tolist())
+
+        first_rows = exposuretable.first_rows_of_groups(group_ids, n_groups)
+        self.assertEqual([0, 1, 3], first_rows.tolist())
+
+        # With many possible keys (for the rows) we sort them,
+        # otherwise we don't. Both must give the same groups.
+        rng = numpy.random.default_rng(42)
+        cells = numpy.sort(rng.integers(0, 50, 1000))
+        taxonomies = rng.integers(0, 7, 1000)
+        dense_result = exposuretable.group_by_first_appearance(
+            cells, taxonomies
+        )
+        sparse_result = exposuretable.group_by_first_appearance(
+            cells, taxonomies * 1000
+        )
+        self.assertEqual(dense_result[1], sparse_result[1])
+        self.assertEqual(dense_result[0].tolist(), sparse_result[0].tolist())
+
+    def test_update_table(self):
+        """Test the update of the damage states."""
+        table = create_table()
+        intensities = {"INTENSITY": numpy.array([1.0, 1.0, numpy.nan])}
+        units = {"INTENSITY": "unitless"}
+
+        updated, transitions = exposuretable.update_table(
+            table,
+            intensities,
+            units,
+            create_fragility_provider(),
+            gpdexposure.get_sorted_damage_states,
+        )
+
+        # TAX1 D0 in cell 0: 20 go to D2, 40 go to D1, 40 stay.
+        # TAX2 D0 in cell 0: 0 go to D2, 5 go to D1, 45 stay.
+        # TAX1 D1 in cell 1: 2 go to D2 (the D0 -> D2 function
+        # is reused for D1 -> D2), 8 stay.
+        # Cell 2 has no buildings, so it stays as it is.
+        self.assertEqual([0, 0, 0, 0, 0, 1, 1, 2], updated.cells.tolist())
+        self.assertEqual(
+            [2, 1, 0, 1, 0, 2, 1, 0], updated.damage_states.tolist()
+        )
+        numpy.testing.assert_allclose(
+            [20.0, 40.0, 40.0, 5.0, 45.0, 2.0, 8.0, 0.0], updated.buildings
+        )
+        numpy.testing.assert_allclose(
+            [4.0, 8.0, 8.0, 1.0, 9.0, 1.0, 4.0, 0.0], updated.population
+        )
+        numpy.testing.assert_allclose(
+            [1000.0, 1000.0, 1000.0, 2000.0, 2000.0, 1000.0, 1000.0, 3000.0],
+            updated.replcostbdg,
+        )
+
+        self.assertEqual([0, 0, 0, 1], transitions.cells.tolist())
+        self.assertEqual([0, 0, 0, 1], transitions.from_damage_states.tolist())
+        self.assertEqual([2, 1, 1, 2], transitions.to_damage_states.tolist())
+        numpy.testing.assert_allclose(
+            [20.0, 40.0, 5.0, 2.0], transitions.buildings
+        )
+
+        loss_values = exposuretable.compute_losses(
+            transitions,
+            testimplementations.AlwaysOneDollarPerTransitionLossProvider(),
+            "SCHEMA1",
+            n_cells=3,
+        )
+        numpy.testing.assert_allclose([65.0, 2.0, 0.0], loss_values)
+
+    def test_update_table_with_pruning(self):
+        """
+        Parts below the pruning epsilon are dropped, but the rows
+        keep all their buildings & population.
+        """
+        table = create_table()
+        intensities = {"INTENSITY": numpy.array([1.0, 1.0, numpy.nan])}
+        units = {"INTENSITY": "unitless"}
+
+        updated, transitions = exposuretable.update_table(
+            table,
+            intensities,
+            units,
+            create_fragility_provider(),
+            gpdexposure.get_sorted_damage_states,
+            pruning_epsilon=0.15,
+        )
+
+        # The 5 buildings of TAX2 that would go to D1 are less than
+        # 15% of the 50, so they stay in D0 (all the others are kept).
+        self.assertEqual([0, 0, 0, 0, 1, 1, 2], updated.cells.tolist())
+        self.assertEqual([2, 1, 0, 0, 2, 1, 0], updated.damage_states.tolist())
+        numpy.testing.assert_allclose(
+            [20.0, 40.0, 40.0, 50.0, 2.0, 8.0, 0.0], updated.buildings
+        )
+        numpy.testing.assert_allclose(
+            [4.0, 8.0, 8.0, 10.0, 1.0, 4.0, 0.0], updated.population
+        )
+        self.assertEqual(table.buildings.sum(), updated.buildings.sum())
+        self.assertEqual(table.population.sum(), updated.population.sum())
+
+        self.assertEqual([0, 0, 1], transitions.cells.tolist())
+        self.assertEqual([2, 1, 2], transitions.to_damage_states.tolist())
+        numpy.testing.assert_allclose([20.0, 40.0, 2.0], transitions.buildings)
+
+        # The cell by cell version gives the very same values.
+        self.assertEqual(
+            [(None, 50.0, 10.0)],
+            gpdexposure.prune_parts(
+                [(1, 5.0, 1.0), (None, 45.0, 9.0)], 50.0, 10.0, 0.15
+            ),
+        )
+
+    def test_update_table_with_compiled_fragility(self):
+        """The compiled model must give the same results as scipy."""
+        fragility_data = {
+            "meta": {"id": "SCHEMA1", "shape": "logncdf"},
+            "data": [
+                {
+                    "imt": "intensity",
+                    "imu": "unitless",
+                    "D1_mean": -0.5,
+                    "D1_stddev": 0.5,
+                    "D2_mean": 0.2,
+                    "D2_stddev": 0.3,
+                    "taxonomy": taxonomy,
+                }
+                for taxonomy in ["TAX1", "TAX2"]
+            ],
+        }
+        fragility_provider = fragility.Fragility(
+            fragility_data
+        ).to_fragility_provider()
+        intensities = {"INTENSITY": numpy.array([0.7, 1.3, numpy.nan])}
+        units = {"INTENSITY": "unitless"}
+
+        expected = exposuretable.update_table(
+            create_table(),
+            intensities,
+            units,
+            fragility_provider,
+            gpdexposure.get_sorted_damage_states,
+        )
+        result = exposuretable.update_table(
+            create_table(),
+            intensities,
+            units,
+            fragility_provider,
+            gpdexposure.get_sorted_damage_states,
+            compiled_fragility=fragility_provider.compile(),
+        )
+        for expected_table, table in zip(expected, result):
+            for key, values in vars(expected_table).items():
+                if key != "vocabulary":
+                    numpy.testing.assert_array_equal(values, vars(table)[key])
+
+        # The tabulated functions work on the arrays as well.
+        tabulated = exposuretable.update_table(
+            create_table(),
+            intensities,
+            units,
+            fragility.Fragility(fragility_data).to_fragility_provider(
+                max_tabulation_error=1e-6
+            ),
+            gpdexposure.get_sorted_damage_states,
+        )
+        numpy.testing.assert_allclose(
+            expected[1].buildings, tabulated[1].buildings, atol=1e-3
+        )
+
+    def test_find_affected_cells(self):
+        """Only cells with intensities above the threshold are affected."""
+        table = create_table()
+        intensities = {"INTENSITY": numpy.array([0.5, 1.0, 5.0])}
+        intensity_thresholds = {
+            "TAX1": {"INTENSITY": 0.8},
+            "TAX2": {"INTENSITY": 0.1},
+        }
+
+        affected_cells = exposuretable.find_affected_cells(
+            table, intensities, intensity_thresholds, n_cells=3
+        )
+        # Cell 0 is affected because of TAX2, cell 2 has no buildings.
+        self.assertEqual([True, True, False], affected_cells.tolist())
+
+        intensity_thresholds["TAX2"]["INTENSITY"] = 0.8
+        affected_cells = exposuretable.find_affected_cells(
+            table, intensities, intensity_thresholds, n_cells=3
+        )
+        self.assertEqual([False, True, False], affected_cells.tolist())
+
+        updated, transitions = exposuretable.update_table(
+            table,
+            intensities,
+            {"INTENSITY": "unitless"},
+            create_fragility_provider(),
+            gpdexposure.get_sorted_damage_states,
+            affected_cells=affected_cells,
+        )
+        # No transitions in cell 0 anymore.
+        self.assertEqual([1], transitions.cells.tolist())
+        numpy.testing.assert_allclose(
+            [100.0, 50.0, 2.0, 8.0, 0.0], updated.buildings
+        )
+
+    def test_compute_losses_with_loss_arrays(self):
+        """
+        The losses from the loss arrays must be the same as the ones
+        that we get with get_loss.
+        """
+        loss_data = {
+            "SCHEMA1": {
+                "meta": {"id": "SCHEMA1"},
+                "data": {
+                    "steps": {"1": 0.1, "2": 0.5, "3": 1},
+                    "replacementCosts": {"TAX1": 100.0, "TAX2": 200.0},
+                },
+            }
+        }
+        loss_provider = loss.LossProvider(loss_data, "USD")
+        taxonomy_vocabulary = vocabulary.Vocabulary()
+        transitions = exposuretable.TransitionTable(
+            cells=numpy.array([0, 0, 1, 2]),
+            taxonomies=taxonomy_vocabulary.intern_many(
+                "SCHEMA1", ["TAX1", "TAX2", "TAX2", "TAX1"]
+            ),
+            from_damage_states=numpy.array([0, 1, 0, 2]),
+            to_damage_states=numpy.array([1, 2, 3, 3]),
+            buildings=numpy.array([10.0, 5.0, 2.0, 1.0]),
+            # The 0 values must be replaced by the fallback costs.
+            replcostbdg=numpy.array([1000.0, 0.0, 2000.0, 0.0]),
+            vocabulary=taxonomy_vocabulary,
+        )
+
+        loss_values = exposuretable.compute_losses(
+            transitions, loss_provider, "SCHEMA1", n_cells=4
+        )
+
+        expected = [
+            10.0 * loss_provider.get_loss("SCHEMA1", "TAX1", 0, 1, 1000.0)
+            + 5.0 * loss_provider.get_loss("SCHEMA1", "TAX2", 1, 2, 200.0),
+            2.0 * loss_provider.get_loss("SCHEMA1", "TAX2", 0, 3, 2000.0),
+            1.0 * loss_provider.get_loss("SCHEMA1", "TAX1", 2, 3, 100.0),
+            0.0,
+        ]
+        self.assertEqual(expected, loss_values.tolist())
+
+    def test_compute_losses_without_replacement_costs(self):
+        """We name the taxonomy without any replacement costs."""
+        loss_data = {
+            "SCHEMA1": {
+                "meta": {"id": "SCHEMA1"},
+                "data": {
+                    "steps": {"1": 0.1, "2": 0.5, "3": 1},
+                    "replacementCosts": {"TAX1": 100.0},
+                },
+            }
+        }
+        loss_provider = loss.LossProvider(loss_data, "USD")
+        taxonomy_vocabulary = vocabulary.Vocabulary()
+        transitions = exposuretable.TransitionTable(
+            cells=numpy.array([0]),
+            taxonomies=taxonomy_vocabulary.intern_many("SCHEMA1", ["TAX2"]),
+            from_damage_states=numpy.array([0]),
+            to_damage_states=numpy.array([1]),
+            buildings=numpy.array([10.0]),
+            replcostbdg=numpy.array([0.0]),
+            vocabulary=taxonomy_vocabulary,
+        )
+        with self.assertRaises(Exception) as context:
+            exposuretable.compute_losses(
+                transitions, loss_provider, "SCHEMA1", n_cells=1
+            )
+        self.assertEqual(
+            "no taxonomy candidates found for 'TAX2'", str(context.exception)
+        )
+
+    def test_update_table_with_wrong_unit(self):
+        """We must fail if the units don't match."""
+        table = create_table()
+        intensities = {"INTENSITY": numpy.array([1.0, 1.0, numpy.nan])}
+        units = {"INTENSITY": "g"}
+
+        with self.assertRaises(Exception):
+            exposuretable.update_table(
+                table,
+                intensities,
+                units,
+                create_fragility_provider(),
+                gpdexposure.get_sorted_damage_states,
+            )
+
+    def test_map_table(self):
+        """Test the mapping of the table to another schema."""
+        tax_mapping_data = [
+            {
+                "source_schema": "SCHEMA1",
+                "target_schema": "SCHEMA2",
+                "conv_matrix": {
+                    "TAX1": {"TAX": 1.0},
+                    "TAX2": {"TAX": 0.5, "OTHER": 0.5},
+                },
+            }
+        ]
+        ds_mapping_data = []
+        for source_taxonomy, target_taxonomy in [
+            ("TAX1", "TAX"),
+            ("TAX2", "TAX"),
+            ("TAX2", "OTHER"),
+        ]:
+            ds_mapping_data.append(
+                {
+                    "source_schema": "SCHEMA1",
+                    "target_schema": "SCHEMA2",
+                    "source_taxonomy": source_taxonomy,
+                    "target_taxonomy": target_taxonomy,
+                    "conv_matrix": {
+                        "0": {"0": 1.0, "1": 0.0},
+                        "1": {"0": 0.0, "1": 1.0},
+                    },
+                }
+            )
+        # fmt: off
+        schema_mapper = \
+            schemamapping. \
+            SchemaMapper. \
+            from_taxonomy_and_damage_state_conversion_data(
+                tax_mapping_data, ds_mapping_data
+            )
+        # fmt: on
+
+        mapped = exposuretable.map_table(
+            create_table(), "SCHEMA1", "SCHEMA2", schema_mapper
+        )
+
+        self.assertEqual([0, 0, 1, 2, 2], mapped.cells.tolist())
+        self.assertEqual(
+            ["TAX", "OTHER", "TAX", "TAX", "OTHER"],
+            mapped.vocabulary.get_taxonomies(mapped.taxonomies),
+        )
+        self.assertEqual(
+            "SCHEMA2", mapped.vocabulary.get_schema(mapped.taxonomies[0])
+        )
+        self.assertEqual([0, 0, 1, 0, 0], mapped.damage_states.tolist())
+        numpy.testing.assert_allclose(
+            [125.0, 25.0, 10.0, 0.0, 0.0], mapped.buildings
+        )
+        # TAX in cell 0 is a mix of 100 buildings with 1000
+        # and 25 buildings with 2000.
+        self.assertAlmostEqual(1200.0, mapped.replcostbdg[0])
+        self.assertAlmostEqual(2000.0, mapped.replcostbdg[1])
+        self.assertAlmostEqual(1000.0, mapped.replcostbdg[2])
+        # No buildings, so no replacement costs.
+        self.assertEqual(0.0, mapped.replcostbdg[3])
+
+
+if __name__ == "__main__":
+    unittest.main()
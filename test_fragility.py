@@ -15,7 +15,14 @@
 # License for the specific language governing permissions and limitations under
 # the License.
 
+import glob
+import os
+import pickle
+import tempfile
 import unittest
+import unittest.mock
+
+import numpy as np
 
 import fragility
 
@@ -73,5 +80,372 @@ class TestNormCdfFactory(unittest.TestCase):
         self.assertAlmostEqual(result, 0.10564977366685535)
 
 
+class TestIntensityThresholds(unittest.TestCase):
+    """Test cases for the intensity thresholds."""
+
+    def test_thresholds(self):
+        """
+        Test the thresholds for the log normal & the normal cdf.
+        """
+        fragility_data = {
+            "meta": {"id": "SCHEMA", "shape": "logncdf"},
+            "data": [
+                {
+                    "imt": "pga",
+                    "imu": "g",
+                    "D1_mean": -0.5,
+                    "D1_stddev": 0.5,
+                    "D2_mean": 0.0,
+                    "D2_stddev": 0.5,
+                    "taxonomy": "TAX",
+                }
+            ],
+        }
+        fragility_provider = fragility.Fragility(
+            fragility_data
+        ).to_fragility_provider()
+
+        # The log normal cdf is 0 for all intensities <= 0.
+        thresholds = fragility_provider.get_intensity_thresholds(0.0)
+        self.assertEqual({"TAX": {"PGA": 0.0}}, thresholds)
+
+        thresholds = fragility_provider.get_intensity_thresholds(0.01)
+        threshold = thresholds["TAX"]["PGA"]
+        self.assertLess(0.0, threshold)
+        # The D1 function is the one that gives the highest
+        # probabilities, so it gives the threshold.
+        for damage_state in fragility_provider.get_damage_states_for_taxonomy(
+            "TAX"
+        ):
+            probability = damage_state.get_probability_for_intensity(
+                {"PGA": threshold}, {"PGA": "g"}
+            )
+            self.assertLessEqual(probability, 0.01 + 1e-9)
+        fun = fragility.LogncdfFactory()(-0.5, 0.5)
+        self.assertAlmostEqual(0.01, fun(threshold))
+
+        # The normal cdf is never 0, so we can't skip anything.
+        fragility_data["meta"]["shape"] = "normcdf"
+        fragility_provider = fragility.Fragility(
+            fragility_data
+        ).to_fragility_provider()
+        thresholds = fragility_provider.get_intensity_thresholds(0.0)
+        self.assertEqual(-np.inf, thresholds["TAX"]["PGA"])
+
+
+class TestCaches(unittest.TestCase):
+    """Test class for the caches of the fragility functions."""
+
+    def test_lru_cache(self):
+        """The cache must drop the least recently used entries."""
+        calls = []
+
+        def compute(key):
+            calls.append(key)
+            return key * 2
+
+        cache = fragility.LruCache(2)
+        self.assertEqual(2, cache.get(1, compute))
+        self.assertEqual(4, cache.get(2, compute))
+        self.assertEqual(2, cache.get(1, compute))
+        # 2 is the least recently used one now.
+        self.assertEqual(6, cache.get(3, compute))
+        self.assertIn(1, cache)
+        self.assertNotIn(2, cache)
+        self.assertEqual([1, 2, 3], calls)
+
+        statistics = cache.get_statistics()
+        self.assertEqual(1, statistics.hits)
+        self.assertEqual(3, statistics.misses)
+        self.assertEqual(1, statistics.evictions)
+        self.assertEqual(2, statistics.size)
+
+        restored = pickle.loads(pickle.dumps(cache))
+        self.assertEqual(2, restored.get(1, compute))
+        self.assertEqual(2, restored.get_statistics().hits)
+
+    def test_quantization(self):
+        """Close values share one entry with quantization."""
+        fun = fragility.CachedFunction(lambda x: x, quantization=0.01)
+        self.assertAlmostEqual(0.12, fun(0.1201))
+        self.assertAlmostEqual(0.12, fun(0.1199))
+        self.assertEqual(1, len(fun.cache))
+        self.assertEqual(1, fun.cache.get_statistics().hits)
+        self.assertTrue(np.isnan(fun(np.nan)))
+
+    def test_provider_statistics(self):
+        """The provider sums up the counters of its functions."""
+        fragility_data = {
+            "meta": {"id": "SCHEMA", "shape": "logncdf"},
+            "data": [
+                {
+                    "imt": "pga",
+                    "imu": "g",
+                    "D1_mean": -0.5,
+                    "D1_stddev": 0.5,
+                    "taxonomy": "TAX",
+                }
+            ],
+        }
+        fragility_provider = fragility.Fragility(
+            fragility_data
+        ).to_fragility_provider(function_cache_size=2)
+        (damage_state,) = fragility_provider.get_damage_states_for_taxonomy(
+            "TAX"
+        )
+        for intensity in [0.1, 0.2, 0.1, 0.3]:
+            damage_state.get_probability_for_intensity(
+                {"PGA": intensity}, {"PGA": "g"}
+            )
+        statistics = fragility_provider.get_cache_statistics()
+        self.assertEqual(1, statistics.hits)
+        self.assertEqual(3, statistics.misses)
+        self.assertEqual(1, statistics.evictions)
+        self.assertEqual(2, statistics.capacity)
+
+        # The counters of a copy (in a worker process) can be added.
+        copy = pickle.loads(pickle.dumps(fragility_provider))
+        (damage_state,) = copy.get_damage_states_for_taxonomy("TAX")
+        damage_state.get_probability_for_intensity({"PGA": 0.4}, {"PGA": "g"})
+        fragility_provider.add_cache_statistics(
+            fragility.get_cache_statistics_difference(
+                copy.get_cache_statistics(), statistics
+            )
+        )
+        statistics = fragility_provider.get_cache_statistics()
+        self.assertEqual(1, statistics.hits)
+        self.assertEqual(4, statistics.misses)
+        self.assertEqual(2, statistics.evictions)
+        self.assertEqual(2, statistics.size)
+
+        # The compiled functions would ignore the quantization.
+        self.assertIsNotNone(fragility_provider.compile())
+        fragility_provider = fragility.Fragility(
+            fragility_data
+        ).to_fragility_provider(quantization=0.01)
+        self.assertIsNone(fragility_provider.compile())
+
+
+class TestTabulatedFunctions(unittest.TestCase):
+    """Test class for the tabulated cdfs."""
+
+    def test_error_bound(self):
+        """The tables must not differ more than the max error."""
+        values = np.concatenate(
+            [np.linspace(-1.0, 5.0, 10001), [0.0, np.inf, -np.inf]]
+        )
+        # The compiled functions give the same values as scipy.
+        cdfs = fragility.COMPILED_FRAGILITY_FUNCTIONS
+        for shape, cdf in cdfs.items():
+            for max_error in [1e-3, 1e-6]:
+                tables = fragility.TabulatedCdfFactory(shape, max_error)
+                for mean, stddev in [(-0.5, 0.5), (0.3, 0.05), (1.2, 1.1)]:
+                    table = tables(mean, stddev)
+                    expected = cdf(values, mean, stddev)
+                    error = np.abs(table.evaluate_many(values) - expected)
+                    self.assertLessEqual(error.max(), max_error)
+                    self.assertEqual(
+                        table.evaluate_many(values[:1])[0], table(values[0])
+                    )
+                    self.assertTrue(np.isnan(table(np.nan)))
+
+    def test_provider_and_serialization(self):
+        """We can use & store the tables for a fragility provider."""
+        fragility_data = {
+            "meta": {"id": "SCHEMA", "shape": "logncdf"},
+            "data": [
+                {
+                    "imt": "pga",
+                    "imu": "g",
+                    "D1_mean": -0.5,
+                    "D1_stddev": 0.5,
+                    "D2_mean": 0.0,
+                    "D2_stddev": 0.0,
+                    "taxonomy": "TAX",
+                }
+            ],
+        }
+        fragility_provider = fragility.Fragility(
+            fragility_data
+        ).to_fragility_provider(max_tabulation_error=1e-4)
+        # We can't compile the tables.
+        self.assertIsNone(fragility_provider.compile())
+        damage_states = {
+            (ds.from_state, ds.to_state): ds
+            for ds in fragility_provider.get_damage_states_for_taxonomy("TAX")
+        }
+        tabulated = damage_states[(0, 1)].fragility_function
+        self.assertIsInstance(tabulated, fragility.TabulatedFunction)
+        # Without a stddev we use the exact function (as for scipy).
+        self.assertTrue(np.isnan(damage_states[(0, 2)].fragility_function(1)))
+
+        # All intensities below the threshold give a probability
+        # of not more than epsilon.
+        thresholds = fragility_provider.get_intensity_thresholds(0.01)
+        self.assertLessEqual(tabulated(thresholds["TAX"]["PGA"]), 0.01)
+
+        factory = fragility.TabulatedCdfFactory("logncdf", 1e-4)
+        factory(-0.5, 0.5)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            file_name = os.path.join(tmpdir, "tables.npz")
+            factory.to_file(file_name)
+            loaded = fragility.TabulatedCdfFactory.from_file(file_name)
+        self.assertEqual(1e-4, loaded.max_error)
+        self.assertEqual(1, len(loaded.cache))
+        np.testing.assert_array_equal(
+            tabulated.values, loaded(-0.5, 0.5).values
+        )
+        self.assertEqual(1, loaded.cache.get_statistics().hits)
+
+    def test_tabulation_file(self):
+        """
+        The provider stores the tables in the tabulation file & reads
+        them from there in later runs.
+        """
+        fragility_data = {
+            "meta": {"id": "SCHEMA", "shape": "logncdf"},
+            "data": [
+                {
+                    "imt": "pga",
+                    "imu": "g",
+                    "D1_mean": -0.5,
+                    "D1_stddev": 0.5,
+                    "D2_mean": 0.3,
+                    "D2_stddev": 0.4,
+                    "taxonomy": "TAX",
+                }
+            ],
+        }
+
+        def get_functions(fragility_provider):
+            return {
+                (ds.from_state, ds.to_state): ds.fragility_function
+                for ds in fragility_provider.get_damage_states_for_taxonomy(
+                    "TAX"
+                )
+            }
+
+        with tempfile.TemporaryDirectory() as tmpdir:
+            file_name = os.path.join(tmpdir, "tables.npz")
+            built = get_functions(
+                fragility.Fragility(fragility_data).to_fragility_provider(
+                    max_tabulation_error=1e-4, tabulation_file=file_name
+                )
+            )
+            self.assertEqual(
+                2,
+                len(fragility.TabulatedCdfFactory.from_file(file_name).cache),
+            )
+            self.assertEqual([file_name], glob.glob(tmpdir + "/*"))
+
+            # Now we don't need to build them again.
+            with unittest.mock.patch.object(
+                fragility.TabulatedFunction, "build", side_effect=Exception
+            ):
+                loaded = get_functions(
+                    fragility.Fragility(fragility_data).to_fragility_provider(
+                        max_tabulation_error=1e-4, tabulation_file=file_name
+                    )
+                )
+            for key, function in built.items():
+                np.testing.assert_array_equal(
+                    function.values, loaded[key].values
+                )
+
+            # For another max error we build & store them again.
+            fragility.Fragility(fragility_data).to_fragility_provider(
+                max_tabulation_error=1e-3, tabulation_file=file_name
+            )
+            self.assertEqual(
+                1e-3,
+                fragility.TabulatedCdfFactory.from_file(file_name).max_error,
+            )
+
+
+class TestCompiledFragilityModel(unittest.TestCase):
+    """Test class for the compiled fragility functions."""
+
+    def test_same_results_as_scipy(self):
+        """The compiled model must give the same values as scipy."""
+        fragility_data = {
+            "meta": {"id": "SCHEMA", "shape": "logncdf"},
+            "data": [
+                {
+                    "imt": "pga",
+                    "imu": "g",
+                    "D1_mean": -0.5,
+                    "D1_stddev": 0.5,
+                    "D2_mean": 0.0,
+                    "D2_stddev": 0.5,
+                    "D3_mean": 0.7,
+                    "D3_stddev": 0.2,
+                    "taxonomy": "TAX",
+                }
+            ],
+        }
+        values = np.array([-1.0, 0.0, 1e-300, 0.3, 1.0, 2.5, np.inf, np.nan])
+        for shape in ["logncdf", "normcdf"]:
+            fragility_data["meta"]["shape"] = shape
+            fragility_provider = fragility.Fragility(
+                fragility_data
+            ).to_fragility_provider()
+            compiled = fragility_provider.compile()
+
+            tensor = compiled.get_transition_probabilities(
+                "TAX", {"PGA": values}, {"PGA": "g"}
+            )
+            self.assertEqual((len(values), 4, 4), tensor.shape)
+            damage_states = fragility_provider.get_damage_states_for_taxonomy(
+                "TAX"
+            )
+            for damage_state in damage_states:
+                if damage_state.to_state <= damage_state.from_state:
+                    continue
+                expected = [
+                    damage_state.get_probability_for_intensity(
+                        {"PGA": value}, {"PGA": "g"}
+                    )
+                    for value in values.tolist()
+                ]
+                np.testing.assert_array_equal(
+                    expected,
+                    tensor[:, damage_state.from_state, damage_state.to_state],
+                )
+            # There is no way back to a lower damage state.
+            self.assertTrue((tensor[:, 2, 1] == 0).all())
+
+            self.assertEqual([3, 2], compiled.get_to_states("TAX", 1).tolist())
+            probabilities = compiled.get_probabilities_for_damage_state(
+                "TAX", 1, {"PGA": values}, {"PGA": "g"}
+            )
+            np.testing.assert_array_equal(tensor[:, 1, [3, 2]], probabilities)
+
+            with self.assertRaises(Exception):
+                compiled.get_probabilities_for_damage_state(
+                    "TAX", 1, {"PGA": values}, {"PGA": "m/s2"}
+                )
+
+    def test_unknown_parameters(self):
+        """We can't compile functions without known parameters."""
+        fragility_data = {
+            "meta": {"id": "SCHEMA", "shape": "constant"},
+            "data": [
+                {
+                    "imt": "pga",
+                    "imu": "g",
+                    "D1_mean": 0.5,
+                    "D1_stddev": 0.0,
+                    "taxonomy": "TAX",
+                }
+            ],
+        }
+        fragility_provider = fragility.Fragility(
+            fragility_data
+        ).to_fragility_provider_with_specified_fragility_function(
+            lambda mean, stddev: (lambda intensity: mean)
+        )
+        self.assertIsNone(fragility_provider.compile())
+
+
 if __name__ == "__main__":
     unittest.main()
@@ -0,0 +1,162 @@
+#!/usr/bin/env python3
+
+# Copyright © 2021-2022 Helmholtz Centre Potsdam GFZ German Research Centre for
+# Geosciences, Potsdam, Germany
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+"""
+Test cases for reading & writing the exposure in batches.
+"""
+
+import io
+import json
+import os
+import tempfile
+import unittest
+
+import geopandas
+import numpy
+import pandas
+
+import geojsonio
+import gpdexposure
+
+
+def create_feature(gid):
+    """Create a feature with a point & a small expo."""
+    return {
+        "type": "Feature",
+        "geometry": {"type": "Point", "coordinates": [gid, -gid]},
+        "properties": {
+            "gid": "cell" + str(gid),
+            "expo": {"Taxonomy": {"0": "TAX"}, "Buildings": {"0": 12.5}},
+        },
+    }
+
+
+class TestGeojsonio(unittest.TestCase):
+    """Test class for the geojsonio module."""
+
+    def setUp(self):
+        # We want to read the file in very small parts.
+        self.read_size = geojsonio.READ_SIZE
+        geojsonio.READ_SIZE = 7
+
+        self.orjson = geojsonio.orjson
+
+    def tearDown(self):
+        geojsonio.READ_SIZE = self.read_size
+        geojsonio.orjson = self.orjson
+
+    def test_iter_features(self):
+        """We must read all the features & the other members."""
+        data = {
+            "type": "FeatureCollection",
+            "features": [create_feature(i) for i in range(5)],
+            "crs": {"type": "name", "properties": {"name": "EPSG:4326"}},
+            "count": 12345,
+        }
+        metadata = {}
+        features = list(
+            geojsonio.iter_features(
+                io.StringIO(json.dumps(data, indent=2)), metadata
+            )
+        )
+        self.assertEqual(data["features"], features)
+        self.assertEqual(12345, metadata["count"])
+        self.assertEqual("FeatureCollection", metadata["type"])
+
+        empty = io.StringIO('{"type": "FeatureCollection", "features": [ ]}')
+        self.assertEqual([], list(geojsonio.iter_features(empty)))
+
+        with self.assertRaises(Exception):
+            list(geojsonio.iter_features(io.StringIO('{"features": [{}}')))
+
+    def test_batches(self):
+        """Reading in batches gives the same as reading all at once."""
+        current_dir = os.path.dirname(os.path.abspath(__file__))
+        exposure_file = os.path.join(
+            current_dir, "testinputs", "exposure_from_assetmaster.json"
+        )
+        expected = gpdexposure.read_exposure(exposure_file)
+        batches = list(geojsonio.read_exposure_batches(exposure_file, 2))
+        self.assertEqual([2, 1], [len(batch) for batch in batches])
+
+        result = pandas.concat(batches, ignore_index=True)
+        self.assertEqual(list(expected.columns), list(result.columns))
+        self.assertEqual(expected.crs, result.crs)
+        self.assertEqual(expected["gid"].tolist(), result["gid"].tolist())
+        self.assertEqual(expected["expo"].tolist(), result["expo"].tolist())
+        self.assertTrue(expected.geom_equals(result).all())
+
+    def test_crs_after_features(self):
+        """We can't change the crs after the first batch."""
+        data = {
+            "type": "FeatureCollection",
+            "features": [create_feature(i) for i in range(3)],
+            "crs": {"type": "name", "properties": {"name": "EPSG:32719"}},
+        }
+        with tempfile.TemporaryDirectory() as tmpdir:
+            input_file = os.path.join(tmpdir, "input.json")
+            with open(input_file, "wt") as output_file:
+                json.dump(data, output_file)
+            # With just one batch it is fine.
+            (batch,) = geojsonio.read_exposure_batches(input_file, 5)
+            self.assertEqual(32719, batch.crs.to_epsg())
+            with self.assertRaises(Exception):
+                list(geojsonio.read_exposure_batches(input_file, 2))
+
+    def test_writer(self):
+        """
+        The writer gives the same data as to_file, but without
+        any whitespace - with & without orjson.
+        """
+        dataframe = geopandas.GeoDataFrame.from_features(
+            [create_feature(i) for i in range(5)], crs="EPSG:4326"
+        )
+        dataframe["cum_loss_value"] = [0.1, 2.5, float("nan"), 1e-17, 3.0]
+        dataframe.loc[2, "expo"]["Buildings"]["0"] = numpy.float64(0.3)
+        with tempfile.TemporaryDirectory() as tmpdir:
+            expected_file = os.path.join(tmpdir, "output.json")
+            dataframe.to_file(expected_file, "GeoJSON")
+            with open(expected_file, "rt") as input_file:
+                expected = json.load(input_file)
+
+            for json_library in [geojsonio.orjson, None]:
+                geojsonio.orjson = json_library
+                os.unlink(expected_file)
+                with geojsonio.ExposureWriter(expected_file) as writer:
+                    writer.write(dataframe.iloc[:2])
+                    writer.write(dataframe.iloc[2:])
+                with open(expected_file, "rt") as input_file:
+                    content = input_file.read()
+                self.assertNotIn(" ", content)
+                self.assertNotIn("\n", content.strip())
+                self.assertEqual(expected, json.loads(content))
+
+            # If there is an error, we remove the partial file.
+            partial_file = os.path.join(tmpdir, "partial.json")
+            with self.assertRaises(ValueError):
+                with geojsonio.ExposureWriter(partial_file) as writer:
+                    writer.write(dataframe.iloc[:2])
+                    raise ValueError("failed in the middle of the run")
+            self.assertFalse(os.path.exists(partial_file))
+
+            empty_file = os.path.join(tmpdir, "empty.json")
+            with geojsonio.ExposureWriter(empty_file):
+                pass
+            self.assertEqual(0, len(geopandas.read_file(empty_file)))
+
+
+if __name__ == "__main__":
+    unittest.main()
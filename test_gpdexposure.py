@@ -28,9 +28,13 @@ import shapely.wkt
 
 import testimplementations
 
+import executors
+import exposuretable
 import gpdexposure
 import fragility
+import loss
 import schemamapping
+import vocabulary
 
 
 class TestGpdExposureDamageStateUpdate(unittest.TestCase):
@@ -466,6 +470,405 @@ class TestGpdExposureDamageStateUpdate(unittest.TestCase):
             39.9, get_transition_n_bdg(transitions, "TAX2", 1, 2), 40.1
         )
 
+    def test_columnar_engine_gives_same_results(self):
+        """
+        Runs both engines with and without schema mapping
+        and compares the results.
+        """
+        for fragility_provider in [
+            self.fake_fragility_provider,
+            self.fake_fragility_provider2,
+        ]:
+            results = []
+            for engine in ["series", "columnar"]:
+                result_exposure = (
+                    gpdexposure.update_exposure_transitions_and_losses(
+                        exposure=self.old_exposure,
+                        source_schema="SCHEMA1",
+                        schema_mapper=self.fake_schema_mapper,
+                        intensity_provider=self.fake_intensity_provider,
+                        fragility_provider=fragility_provider,
+                        loss_provider=self.fake_loss_provider,
+                        engine=engine,
+                    )
+                )
+                results.append(result_exposure)
+            series_result, columnar_result = results
+
+            self.assertEqual(
+                list(series_result.columns), list(columnar_result.columns)
+            )
+            for column in ["expo", "transitions", "loss_value", "schema"]:
+                self.assertEqual(
+                    series_result[column].tolist(),
+                    columnar_result[column].tolist(),
+                )
+
+    def test_update_exposure_for_scenarios(self):
+        """
+        The scenarios give the same results as single runs, and we
+        create the intensity providers only when we need them.
+        """
+        intensities = [1, 2, 1]
+        created = []
+
+        def create_intensity_provider(intensity):
+            return testimplementations.AlwaysTheSameIntensityProvider(
+                "INTENSITY", intensity, "unitless"
+            )
+
+        def create_intensity_providers():
+            for intensity in intensities:
+                created.append(intensity)
+                yield create_intensity_provider(intensity)
+
+        def update(engine, executor, **kwargs):
+            kwargs.update(
+                exposure=self.old_exposure,
+                source_schema="SCHEMA1",
+                schema_mapper=self.fake_schema_mapper,
+                fragility_provider=self.fake_fragility_provider2,
+                loss_provider=self.fake_loss_provider,
+                engine=engine,
+                executor=executor,
+            )
+            if "intensity_providers" in kwargs:
+                return gpdexposure.update_exposure_for_scenarios(**kwargs)
+            return gpdexposure.update_exposure_transitions_and_losses(**kwargs)
+
+        for engine in ["series", "columnar"]:
+            for executor in [
+                executors.SerialExecutor(),
+                executors.PersistentProcessExecutor(workers=2),
+            ]:
+                created.clear()
+                results = update(
+                    engine,
+                    executor,
+                    intensity_providers=create_intensity_providers(),
+                )
+                for scenario, intensity in enumerate(intensities):
+                    result_exposure = next(results)
+                    self.assertEqual(intensities[: scenario + 1], created)
+                    expected = update(
+                        engine,
+                        executors.SerialExecutor(),
+                        intensity_provider=create_intensity_provider(
+                            intensity
+                        ),
+                    )
+                    for column in ["expo", "transitions", "loss_value"]:
+                        self.assertEqual(
+                            expected[column].tolist(),
+                            result_exposure[column].tolist(),
+                        )
+                self.assertEqual([], list(results))
+                if isinstance(executor, executors.PersistentProcessExecutor):
+                    executor.close()
+
+    def test_cells_below_intensity_threshold(self):
+        """
+        Cells with intensities too low for any damage are passed
+        through without transitions & loss.
+        """
+        fragility_data = {
+            "meta": {"id": "SCHEMA1", "shape": "logncdf"},
+            "data": [
+                {
+                    "imt": "intensity",
+                    "imu": "unitless",
+                    "D1_mean": -0.5,
+                    "D1_stddev": 0.5,
+                    "D2_mean": 0.0,
+                    "D2_stddev": 0.5,
+                    "taxonomy": taxonomy,
+                }
+                for taxonomy in ["TAX1", "TAX2"]
+            ],
+        }
+        fragility_provider = fragility.Fragility(
+            fragility_data
+        ).to_fragility_provider()
+
+        for intensity, damage_epsilon in [(0.0, 0.0), (0.1, 0.1)]:
+            intensity_provider = (
+                testimplementations.AlwaysTheSameIntensityProvider(
+                    "INTENSITY", intensity, "unitless"
+                )
+            )
+            results = []
+            for engine in ["series", "columnar"]:
+                for epsilon in [None, damage_epsilon]:
+                    result_exposure = (
+                        gpdexposure.update_exposure_transitions_and_losses(
+                            exposure=self.old_exposure,
+                            source_schema="SCHEMA1",
+                            schema_mapper=self.fake_schema_mapper,
+                            intensity_provider=intensity_provider,
+                            fragility_provider=fragility_provider,
+                            loss_provider=self.fake_loss_provider,
+                            engine=engine,
+                            damage_epsilon=epsilon,
+                        )
+                    )
+                    results.append(result_exposure)
+
+            for result_exposure in results[1::2]:
+                self.assertEqual(0.0, result_exposure["loss_value"].iloc[0])
+                self.assertEqual(
+                    [],
+                    result_exposure["transitions"].iloc[0]["n_buildings"],
+                )
+            if damage_epsilon == 0.0:
+                # This is exact, so we get the same results
+                # as without skipping the cells.
+                for result_exposure in results[1:]:
+                    for column in ["expo", "transitions", "loss_value"]:
+                        self.assertEqual(
+                            results[0][column].tolist(),
+                            result_exposure[column].tolist(),
+                        )
+            else:
+                # Without the epsilon we would get some damage.
+                self.assertLess(0.0, results[0]["loss_value"].iloc[0])
+
+    def test_executors_give_same_results(self):
+        """All the executors must give the same results."""
+        results = []
+        for name in ["serial", "threads", "processes"]:
+            result_exposure = (
+                gpdexposure.update_exposure_transitions_and_losses(
+                    exposure=self.old_exposure,
+                    source_schema="SCHEMA1",
+                    schema_mapper=self.fake_schema_mapper,
+                    intensity_provider=self.fake_intensity_provider,
+                    fragility_provider=self.fake_fragility_provider2,
+                    loss_provider=self.fake_loss_provider,
+                    engine="columnar",
+                    executor=executors.create_executor(name, workers=2),
+                )
+            )
+            results.append(result_exposure)
+        for result_exposure in results[1:]:
+            for column in ["expo", "transitions", "loss_value", "schema"]:
+                self.assertEqual(
+                    results[0][column].tolist(),
+                    result_exposure[column].tolist(),
+                )
+
+    def test_cache_statistics_of_the_workers(self):
+        """
+        The counters of the fragility function caches include
+        the ones of the worker processes.
+        """
+        fragility_data = {
+            "meta": {"id": "SCHEMA1", "shape": "logncdf"},
+            "data": [
+                {
+                    "imt": "intensity",
+                    "imu": "unitless",
+                    "D1_mean": 0.0,
+                    "D1_stddev": 0.5,
+                    "D2_mean": 0.5,
+                    "D2_stddev": 0.5,
+                    "taxonomy": taxonomy,
+                }
+                for taxonomy in ["TAX1", "TAX2"]
+            ],
+        }
+        for engine, quantization in [("series", None), ("columnar", 0.01)]:
+            lookups = []
+            for name in ["serial", "processes"]:
+                fragility_provider = fragility.Fragility(
+                    fragility_data
+                ).to_fragility_provider(
+                    function_cache_size=16, quantization=quantization
+                )
+                gpdexposure.update_exposure_transitions_and_losses(
+                    exposure=self.old_exposure,
+                    source_schema="SCHEMA1",
+                    schema_mapper=self.fake_schema_mapper,
+                    intensity_provider=self.fake_intensity_provider,
+                    fragility_provider=fragility_provider,
+                    loss_provider=self.fake_loss_provider,
+                    engine=engine,
+                    executor=executors.create_executor(name, workers=2),
+                )
+                statistics = fragility_provider.get_cache_statistics()
+                self.assertEqual(16 * 2, statistics.capacity)
+                lookups.append(statistics.hits + statistics.misses)
+            self.assertLess(0, lookups[0])
+            self.assertEqual(lookups[0], lookups[1])
+
+    def test_split_by_costs(self):
+        """
+        The chunks should have similar costs & must keep the order.
+        """
+        expensive_expo = {
+            "Taxonomy": ["TAX1", "TAX1", "TAX2", "TAX2"],
+            "Damage": ["D0", "D1", "D0", "D1"],
+            "Buildings": [1.0, 1.0, 1.0, 1.0],
+        }
+        empty_expo = {
+            "Taxonomy": ["TAX1", "TAX1", "TAX2", "TAX2"],
+            "Damage": ["D0", "D1", "D0", "D1"],
+            "Buildings": [0.0, 0.0, 0.0, 0.0],
+        }
+        exposure = pandas.DataFrame(
+            {
+                "gid": [str(x) for x in range(12)],
+                "expo": [expensive_expo] * 2 + [empty_expo] * 10,
+            }
+        )
+        costs = gpdexposure.estimate_cell_costs(exposure, needs_mapping=True)
+        self.assertEqual([9.0] * 2 + [5.0] * 10, costs.tolist())
+        costs = gpdexposure.estimate_cell_costs(exposure, needs_mapping=False)
+        self.assertEqual([5.0] * 2 + [1.0] * 10, costs.tolist())
+
+        chunks = gpdexposure.split_by_costs(exposure, costs, n_chunks=3)
+        # Costs of 5, 8 and 7.
+        self.assertEqual([1, 4, 7], [len(x) for x in chunks])
+        self.assertEqual(
+            exposure["gid"].tolist(),
+            pandas.concat(chunks)["gid"].tolist(),
+        )
+
+        chunks = gpdexposure.split_by_costs(exposure, costs, n_chunks=100)
+        self.assertEqual(12, len(chunks))
+
+    def test_expo_table_from_dataframe(self):
+        """
+        The expo lists are converted at once, but we get the
+        same table as row by row.
+        """
+        expo = {
+            "Taxonomy": ["TAX1", "TAX2", "TAX1"],
+            "Damage": ["D0", "D0", "D1"],
+            "Buildings": [1.0, 2.0, 3.0],
+            "Population": [4.0, 5.0, 6.0],
+            "Repl-cost-USD-bdg": [7.0, 8.0, 9.0],
+        }
+        # With dicts (as from pandas) we must go row by row.
+        expo_with_dicts = {
+            key: dict(enumerate(values)) for key, values in expo.items()
+        }
+        # The same taxonomy & damage state twice; the last one wins.
+        expo_with_duplicate = {
+            key: values + values[:1] for key, values in expo.items()
+        }
+        expo_with_duplicate["Buildings"][3] = 10.0
+
+        tables = []
+        for expos in [
+            [expo, expo],
+            [expo_with_dicts, expo_with_dicts],
+        ]:
+            exposure = pandas.DataFrame({"expo": expos})
+            tables.append(
+                gpdexposure.expo_table_from_dataframe(
+                    exposure, "SCHEMA1", vocabulary.Vocabulary()
+                )
+            )
+        self.assertIsNotNone(
+            gpdexposure.expo_table_from_lists(
+                [expo], "SCHEMA1", vocabulary.Vocabulary()
+            )
+        )
+        self.assertIsNone(
+            gpdexposure.expo_table_from_lists(
+                [expo_with_dicts], "SCHEMA1", vocabulary.Vocabulary()
+            )
+        )
+        for column in [
+            "cells",
+            "taxonomies",
+            "damage_states",
+            "buildings",
+            "population",
+            "replcostbdg",
+        ]:
+            self.assertEqual(
+                getattr(tables[0], column).tolist(),
+                getattr(tables[1], column).tolist(),
+            )
+
+        self.assertIsNone(
+            gpdexposure.expo_table_from_lists(
+                [expo_with_duplicate], "SCHEMA1", vocabulary.Vocabulary()
+            )
+        )
+        table = gpdexposure.expo_table_from_dataframe(
+            pandas.DataFrame({"expo": [expo_with_duplicate]}),
+            "SCHEMA1",
+            vocabulary.Vocabulary(),
+        )
+        self.assertEqual([10.0, 2.0, 3.0], table.buildings.tolist())
+
+    def test_transition_table_from_dicts(self):
+        """
+        The losses for the transition table of all the cells are
+        the same as those that we compute cell by cell.
+        """
+        loss_provider = loss.LossProvider(
+            {
+                "SCHEMA1": {
+                    "data": {
+                        "steps": {"1": 0.1, "2": 0.5, "3": 1.0},
+                        "replacementCosts": {"TAX1": 100.0, "TAX2": 300.0},
+                    }
+                }
+            }
+        )
+        transitions_by_cell = [
+            {
+                gpdexposure.TransitionKey(
+                    "TAX1", 0, 2
+                ): gpdexposure.TransitionValues(2.0, 0.0),
+                gpdexposure.TransitionKey(
+                    "TAX2", 1, 3
+                ): gpdexposure.TransitionValues(0.5, 1000.0),
+            },
+            {},
+            {
+                gpdexposure.TransitionKey(
+                    "TAX2", 0, 1
+                ): gpdexposure.TransitionValues(3.0, 0.0),
+            },
+        ]
+        table = gpdexposure.transition_table_from_dicts(
+            transitions_by_cell, "SCHEMA1", vocabulary.Vocabulary()
+        )
+        self.assertEqual([0, 0, 2], table.cells.tolist())
+        self.assertEqual([0, 1, 0], table.from_damage_states.tolist())
+        self.assertEqual([2, 3, 1], table.to_damage_states.tolist())
+
+        loss_values = exposuretable.compute_losses(
+            transitions=table,
+            loss_provider=loss_provider,
+            schema="SCHEMA1",
+            n_cells=len(transitions_by_cell),
+        )
+        self.assertEqual(
+            [
+                gpdexposure.compute_loss(transitions, loss_provider, "SCHEMA1")
+                for transitions in transitions_by_cell
+            ],
+            loss_values.tolist(),
+        )
+
+    def test_unknown_engine(self):
+        """Test that we fail for engines that we don't know."""
+        with self.assertRaises(Exception):
+            gpdexposure.update_exposure_transitions_and_losses(
+                exposure=self.old_exposure,
+                source_schema="SCHEMA1",
+                schema_mapper=self.fake_schema_mapper,
+                intensity_provider=self.fake_intensity_provider,
+                fragility_provider=self.fake_fragility_provider,
+                loss_provider=self.fake_loss_provider,
+                engine="unknown",
+            )
+
     def assertBetween(self, lower, x, upper):
         """
         Test that a number is between two others.
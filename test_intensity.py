@@ -21,6 +21,9 @@ Test cases for the intensity classes.
 
 import unittest
 
+import numpy as np
+
+import intensitydatawrapper
 import intensityprovider
 import testimplementations
 
@@ -115,6 +118,97 @@ class TestIntensity(unittest.TestCase):
 
         self.assertEqual(units["PGA/1000"], "g/1000")
 
+        intensities, units = intensity_provider.get_nearest_many(
+            [1, 2], [1, 2]
+        )
+        np.testing.assert_allclose([0.001, 0.001], intensities["PGA/1000"])
+        self.assertEqual(units["PGA/1000"], "g/1000")
+
+    def test_get_nearest_many(self):
+        """
+        The batch query must give the same results as the
+        single queries.
+        """
+        data = {
+            "lon": [0.0, 1.0, 0.0, 1.0],
+            "lat": [0.0, 0.0, 1.0, 1.0],
+            "PGA": [0.1, 0.2, 0.3, 0.4],
+        }
+        units = {"PGA": "g"}
+        intensity_data = intensitydatawrapper.DictWithListDataWrapper(
+            data, units, possible_x_columns=["lon"], possible_y_columns=["lat"]
+        )
+        intensity_provider = intensityprovider.AliasIntensityProvider(
+            intensityprovider.IntensityProvider(intensity_data),
+            aliases={"SA_01": ["PGA"]},
+        )
+
+        # The last one is too far away, so we get the na value.
+        lons = [0.1, 0.9, 0.2, 1.1, 50.0]
+        lats = [0.1, 0.1, 0.8, 0.9, 50.0]
+
+        intensities, units = intensity_provider.get_nearest_many(lons, lats)
+
+        self.assertEqual(set(["PGA", "SA_01"]), set(intensities.keys()))
+        for i, (lon, lat) in enumerate(zip(lons, lats)):
+            (
+                single_intensities,
+                single_units,
+            ) = intensity_provider.get_nearest(lon, lat)
+            for kind, value in single_intensities.items():
+                self.assertEqual(value, intensities[kind][i])
+                self.assertEqual(single_units[kind], units[kind])
+        np.testing.assert_allclose(
+            [0.1, 0.2, 0.3, 0.4, 0.0], intensities["PGA"]
+        )
+
+        # And without any location.
+        intensities, units = intensity_provider.get_nearest_many([], [])
+        self.assertEqual(0, len(intensities["PGA"]))
+
+    def test_get_nearest_many_with_workers(self):
+        """
+        The parallel batch query must give the same results
+        as the one with a single worker.
+        """
+        rng = np.random.default_rng(42)
+        data = {
+            "lon": rng.uniform(-10, 10, 1000).tolist(),
+            "lat": rng.uniform(-10, 10, 1000).tolist(),
+            "PGA": rng.uniform(0, 1, 1000).tolist(),
+        }
+        units = {"PGA": "g"}
+        intensity_data = intensitydatawrapper.DictWithListDataWrapper(
+            data, units, possible_x_columns=["lon"], possible_y_columns=["lat"]
+        )
+        lons = rng.uniform(-12, 12, 5000)
+        lats = rng.uniform(-12, 12, 5000)
+
+        expected, _ = intensityprovider.IntensityProvider(
+            intensity_data
+        ).get_nearest_many(lons, lats)
+        for workers in [2, -1]:
+            intensities, _ = intensityprovider.IntensityProvider(
+                intensity_data, workers=workers
+            ).get_nearest_many(lons, lats)
+            np.testing.assert_array_equal(expected["PGA"], intensities["PGA"])
+
+    def test_get_query_kwargs(self):
+        """We pass the workers as the scipy version expects them."""
+        self.assertEqual({}, intensityprovider.get_query_kwargs(1))
+        old_version = intensityprovider.SCIPY_VERSION
+        try:
+            intensityprovider.SCIPY_VERSION = (1, 3)
+            self.assertEqual(
+                {"n_jobs": 4}, intensityprovider.get_query_kwargs(4)
+            )
+            intensityprovider.SCIPY_VERSION = (1, 6)
+            self.assertEqual(
+                {"workers": -1}, intensityprovider.get_query_kwargs(-1)
+            )
+        finally:
+            intensityprovider.SCIPY_VERSION = old_version
+
 
 if __name__ == "__main__":
     unittest.main()
@@ -23,7 +23,10 @@ import os
 import glob
 import unittest
 
+import numpy
+
 import loss
+import vocabulary
 
 
 class TestLoss(unittest.TestCase):
@@ -95,6 +98,51 @@ class TestLoss(unittest.TestCase):
 
         self.assertEqual(700, loss_value)
 
+    def test_compiled_loss_data(self):
+        """
+        The loss data are compiled once per schema & the replacement
+        costs follow the ids of the vocabulary.
+        """
+        loss_provider = loss.LossProvider(
+            {
+                "SUPPASRI2013_v2.0": {
+                    "data": {
+                        "steps": {"1": 0.25, "3": 1},
+                        "replacementCosts": {"URM": 800, "MIX": 400},
+                    }
+                }
+            }
+        )
+        compiled = loss_provider.compile("SUPPASRI2013_v2.0")
+        self.assertIs(compiled, loss_provider.compile("SUPPASRI2013_v2.0"))
+
+        step_coefficients = compiled.step_coefficients.tolist()
+        self.assertEqual(4, len(step_coefficients))
+        self.assertEqual([0.25, 1.0], step_coefficients[1::2])
+
+        taxonomy_vocabulary = vocabulary.Vocabulary()
+        other_id = taxonomy_vocabulary.intern("OTHER_SCHEMA", "URM")
+        replacement_costs = loss_provider.get_replacement_costs(
+            "SUPPASRI2013_v2.0", taxonomy_vocabulary
+        )
+        self.assertIs(
+            replacement_costs,
+            loss_provider.get_replacement_costs(
+                "SUPPASRI2013_v2.0", taxonomy_vocabulary
+            ),
+        )
+        mix_id = taxonomy_vocabulary.intern("SUPPASRI2013_v2.0", "MIX")
+        self.assertEqual(400, replacement_costs[mix_id])
+        self.assertTrue(numpy.isnan(replacement_costs[other_id]))
+
+        # New ids in the vocabulary give a new array.
+        new_id = taxonomy_vocabulary.intern("OTHER_SCHEMA", "RC")
+        replacement_costs = loss_provider.get_replacement_costs(
+            "SUPPASRI2013_v2.0", taxonomy_vocabulary
+        )
+        self.assertEqual(len(taxonomy_vocabulary), len(replacement_costs))
+        self.assertTrue(numpy.isnan(replacement_costs[new_id]))
+
     def test_combine_losses(self):
         """Test the combine_losses function."""
         test_cases = [
@@ -0,0 +1,150 @@
+#!/usr/bin/env python3
+
+# Copyright © 2021-2022 Helmholtz Centre Potsdam GFZ German Research Centre for
+# Geosciences, Potsdam, Germany
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+"""
+Test cases for the cache of the mapped exposure.
+"""
+
+import glob
+import os
+import shutil
+import tempfile
+import unittest
+
+import deus
+import executors
+import fragility
+import gpdexposure
+import mappingcache
+import tellus
+
+
+class TestMappingCache(unittest.TestCase):
+    """Test class for the mappingcache module."""
+
+    @classmethod
+    def setUpClass(cls):
+        current_dir = os.path.dirname(os.path.abspath(__file__))
+        cls.testinput_dir = os.path.join(current_dir, "testinputs")
+        cls.schema_mapper = tellus.create_schema_mapper(current_dir)
+
+    def test_read_or_map_exposure(self):
+        """
+        The mapped exposure is written once & updating it gives
+        the same results as updating the original exposure.
+        """
+        source_schema = "SARA_v1.0"
+        target_schema = "SUPPASRI2013_v2.0"
+        with tempfile.TemporaryDirectory() as tmpdir:
+            exposure_file = os.path.join(tmpdir, "exposure.json")
+            shutil.copy(
+                os.path.join(
+                    self.testinput_dir, "exposure_from_assetmaster.json"
+                ),
+                exposure_file,
+            )
+            exposure = gpdexposure.read_exposure(exposure_file)
+
+            # Nothing to do if the schemas are the same.
+            self.assertIs(
+                exposure,
+                mappingcache.read_or_map_exposure(
+                    exposure_file,
+                    source_schema,
+                    source_schema,
+                    self.schema_mapper,
+                    exposure=exposure,
+                ),
+            )
+            self.assertEqual([], glob.glob(exposure_file + ".*"))
+
+            # The second time we read it from the cache file.
+            mapped_exposures = [
+                mappingcache.read_or_map_exposure(
+                    exposure_file,
+                    source_schema,
+                    target_schema,
+                    self.schema_mapper,
+                )
+                for _ in range(2)
+            ]
+            cache_files = glob.glob(exposure_file + ".*")
+            self.assertEqual(1, len(cache_files))
+            self.assertIn(target_schema, cache_files[0])
+            self.assertEqual(
+                mapped_exposures[0]["expo"].tolist(),
+                mapped_exposures[1]["expo"].tolist(),
+            )
+
+            # Other mapping data give another cache file.
+            mappingcache.read_or_map_exposure(
+                exposure_file,
+                source_schema,
+                target_schema,
+                self.schema_mapper,
+                pruning_epsilon=0.01,
+                exposure=exposure,
+            )
+            self.assertEqual(2, len(glob.glob(exposure_file + ".*")))
+
+            intensity_provider = deus.create_intensity_provider(
+                os.path.join(self.testinput_dir, "shakemap_tsunami.xml")
+            )
+            fragility_provider = fragility.Fragility.from_file(
+                os.path.join(self.testinput_dir, "fragility_suppasri.json")
+            ).to_fragility_provider()
+            loss_provider = deus.create_loss_provider()
+
+            def update(exposure, exposure_schema):
+                return gpdexposure.update_exposure_transitions_and_losses(
+                    exposure,
+                    exposure_schema,
+                    self.schema_mapper,
+                    intensity_provider,
+                    fragility_provider,
+                    loss_provider,
+                    engine="columnar",
+                    executor=executors.SerialExecutor(),
+                )
+
+            expected = update(exposure, source_schema)
+            result = update(mapped_exposures[1], target_schema)
+            for column in ["expo", "transitions", "loss_value"]:
+                self.assertEqual(
+                    expected[column].tolist(), result[column].tolist()
+                )
+
+    def test_write_exposure(self):
+        """
+        We don't leave the temporary file or a half written cache
+        file if the write fails.
+        """
+        exposure = gpdexposure.read_exposure(
+            os.path.join(self.testinput_dir, "exposure_from_assetmaster.json")
+        )
+        with tempfile.TemporaryDirectory() as tmpdir:
+            cache_file = os.path.join(tmpdir, "exposure.mapped.arrow")
+            mappingcache.write_exposure(cache_file, exposure)
+            self.assertEqual(["exposure.mapped.arrow"], os.listdir(tmpdir))
+
+            other_cache_file = os.path.join(tmpdir, "other.mapped.arrow")
+            with self.assertRaises(Exception):
+                mappingcache.write_exposure(other_cache_file, None)
+            self.assertEqual(["exposure.mapped.arrow"], os.listdir(tmpdir))
+
+
+if __name__ == "__main__":
+    unittest.main()
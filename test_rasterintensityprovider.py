@@ -22,10 +22,21 @@ the intensity provider for rasters.
 
 import collections
 import os
+import pickle
 import unittest
 
+import numpy as np
+import rasterio
+import rasterio.transform
+
 import rasterintensityprovider
 
+TSUNAMI_RASTER_FILE = os.path.join(
+    os.path.dirname(os.path.abspath(__file__)),
+    "testinputs",
+    "tsunami_peru_mwh.tiff",
+)
+
 
 class TestRasterIntensityProvider(unittest.TestCase):
     """
@@ -76,13 +87,69 @@ class TestRasterIntensityProvider(unittest.TestCase):
             self.assertLess(intensities[intensity], check.value + eps)
             self.assertEqual(unit, units[intensity])
 
-    def test_read_tsunami_data(self):
-        """Test with our tsunami dataset."""
+        # And the same with the batch query
+        intensities, units = intensity_provider.get_nearest_many(
+            lons=[check.x for check in checks] + [0.0],
+            lats=[check.y for check in checks] + [0.0],
+        )
+        self.assertEqual(unit, units[intensity])
+        self.assertEqual(len(checks) + 1, len(intensities[intensity]))
+        for check, value in zip(checks, intensities[intensity]):
+            self.assertLess(check.value - eps, value)
+            self.assertLess(value, check.value + eps)
+        # The last one is far outside.
+        self.assertEqual(na_value, intensities[intensity][-1])
+
+    def test_pickle_raster_intensity_provider(self):
+        """
+        The provider must be picklable & must give the
+        same results as rasterio for the indices.
+        """
         raster_file = os.path.join(
             os.path.dirname(os.path.abspath(__file__)),
             "testinputs",
-            "tsunami_peru_mwh.tiff",
+            "fixedDEM_S_VEI_60mio_HYDRO_v10_EROSION_1600_0015_25res"
+            + "_4mom_25000s_MaxPressure_smaller.asc",
+        )
+        intensity_provider = (
+            rasterintensityprovider.RasterIntensityProvider.from_file(
+                raster_file, "pressure", "p", 0.0
+            )
+        )
+        unpickled_provider = pickle.loads(pickle.dumps(intensity_provider))
+
+        with rasterio.open(raster_file) as dataset:
+            bounds = dataset.bounds
+            transform = dataset.transform
+
+        random_state = np.random.RandomState(42)
+        lons = random_state.uniform(bounds.left - 100, bounds.right + 100, 100)
+        lats = random_state.uniform(bounds.bottom - 100, bounds.top + 100, 100)
+
+        expected_rows, expected_cols = rasterio.transform.rowcol(
+            transform, lons, lats
         )
+        rows, cols = unpickled_provider.index(lons, lats)
+        self.assertEqual(list(expected_rows), list(rows))
+        self.assertEqual(list(expected_cols), list(cols))
+
+        expected, _ = intensity_provider.get_nearest_many(lons, lats)
+        result, units = unpickled_provider.get_nearest_many(lons, lats)
+        self.assertEqual(
+            expected["pressure"].tolist(), result["pressure"].tolist()
+        )
+        self.assertEqual("p", units["pressure"])
+
+        for lon, lat, value in zip(lons, lats, result["pressure"]):
+            single_result, _ = unpickled_provider.get_nearest(lon, lat)
+            self.assertEqual(value, single_result["pressure"])
+
+    @unittest.skipUnless(
+        os.path.exists(TSUNAMI_RASTER_FILE), "tsunami dataset is not available"
+    )
+    def test_read_tsunami_data(self):
+        """Test with our tsunami dataset."""
+        raster_file = TSUNAMI_RASTER_FILE
         intensity = "MWH"
         unit = "m"
         na_value = 0.0
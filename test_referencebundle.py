@@ -0,0 +1,127 @@
+#!/usr/bin/env python3
+
+# Copyright © 2021-2022 Helmholtz Centre Potsdam GFZ German Research Centre for
+# Geosciences, Potsdam, Germany
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+"""
+Test cases for the reference bundle.
+"""
+
+import os
+import pickle
+import tempfile
+import unittest
+
+import loss
+import referencebundle
+import schemamapping
+
+
+class TestReferenceBundle(unittest.TestCase):
+    """Test class for the reference bundle."""
+
+    @classmethod
+    def setUpClass(cls):
+        current_dir = os.path.dirname(os.path.abspath(__file__))
+        cls.reference_files = referencebundle.get_reference_files(current_dir)
+        cls.tmpdir = tempfile.TemporaryDirectory()
+        cls.bundle_file = os.path.join(
+            cls.tmpdir.name, referencebundle.BUNDLE_FILENAME
+        )
+        referencebundle.compile_bundle(cls.bundle_file, cls.reference_files)
+
+    @classmethod
+    def tearDownClass(cls):
+        cls.tmpdir.cleanup()
+
+    def test_schema_mapper(self):
+        """We get the same mappings as with the json files."""
+        mapper_class = schemamapping.SchemaMapper
+        expected_mapper = (
+            mapper_class.from_taxonomy_and_damage_state_conversion_files(
+                self.reference_files["tax_mapping"],
+                self.reference_files["ds_mapping"],
+            )
+        )
+        schema_mapper = mapper_class.from_bundle(
+            referencebundle.ReferenceBundle(self.bundle_file)
+        )
+        # We can pickle it (without the connection).
+        schema_mapper = pickle.loads(pickle.dumps(schema_mapper))
+        self.assertEqual(
+            expected_mapper.get_schema_pairs(),
+            schema_mapper.get_schema_pairs(),
+        )
+
+        for damage_state in range(5):
+            expected = expected_mapper.map_schema(
+                "SARA_v1.0", "MUR-H1-3", damage_state, "SUPPASRI2013_v2.0", 3.0
+            )
+            result = schema_mapper.map_schema(
+                "SARA_v1.0", "MUR-H1-3", damage_state, "SUPPASRI2013_v2.0", 3.0
+            )
+            self.assertEqual(
+                [vars(x) for x in expected], [vars(x) for x in result]
+            )
+
+        with self.assertRaises(Exception):
+            schema_mapper.map_schema(
+                "SARA_v1.0", "MUR-H1-3", 0, "UNKNOWN_SCHEMA"
+            )
+
+    def test_loss_provider(self):
+        """We get the same loss data as with the json files."""
+        expected_provider = loss.LossProvider.from_files(
+            self.reference_files["loss_data"], "USD"
+        )
+        loss_provider = loss.LossProvider.from_bundle(
+            referencebundle.ReferenceBundle(self.bundle_file), "USD"
+        )
+        self.assertEqual(
+            expected_provider.get_loss("SARA_v1.0", "MUR-H1-3", 1, 3, 1000.0),
+            loss_provider.get_loss("SARA_v1.0", "MUR-H1-3", 1, 3, 1000.0),
+        )
+        self.assertEqual(
+            expected_provider.get_fallback_replacement_cost(
+                "SARA_v1.0", "MUR-H1-3"
+            ),
+            loss_provider.get_fallback_replacement_cost(
+                "SARA_v1.0", "MUR-H1-3"
+            ),
+        )
+        with self.assertRaises(Exception):
+            loss_provider.get_step_coefficients("UNKNOWN_SCHEMA")
+
+    def test_open_bundle(self):
+        """We only use a bundle that is up to date."""
+        files = self.reference_files["loss_data"]
+        bundle = referencebundle.open_bundle(
+            self.tmpdir.name, "loss_data", files
+        )
+        self.assertIsNotNone(bundle)
+        bundle.close()
+
+        self.assertIsNone(
+            referencebundle.open_bundle(
+                self.tmpdir.name, "loss_data", files[1:]
+            )
+        )
+        with tempfile.TemporaryDirectory() as other_dir:
+            self.assertIsNone(
+                referencebundle.open_bundle(other_dir, "loss_data", files)
+            )
+
+
+if __name__ == "__main__":
+    unittest.main()
@@ -22,6 +22,9 @@ Testcases for the schema mappings.
 import glob
 import json
 import os
+import pickle
+import random
+import threading
 import unittest
 
 import gpdexposure
@@ -430,6 +433,279 @@ class TestSchemaMapping(unittest.TestCase):
         self.assertLess(56.249, b2_2_d2_mapping_result.n_buildings)
         self.assertLess(b2_2_d2_mapping_result.n_buildings, 56.251)
 
+    def test_compile_mapping_with_pruning(self):
+        """
+        Fractions below the pruning epsilon are dropped and the
+        others scaled up, so that we still map all the buildings.
+        """
+        subset = self.schema_mapper.subset(
+            source_schema=self.source_schema,
+            target_schema=self.target_schema,
+            pruning_epsilon=0.1,
+        )
+        compiled_mapping = subset.compile_mapping(
+            self.source_schema, self.target_schema
+        )
+        # Without pruning we have 0.1875, 0.0625, 0.1875 & 0.5625.
+        targets = compiled_mapping.get_targets(self.s1_b2, 1)
+        fractions = {
+            (taxonomy, damage_state): fraction
+            for taxonomy, damage_state, fraction in targets
+        }
+        self.assertEqual(
+            {
+                (self.s2_b2_1, 1),
+                (self.s2_b2_2, 1),
+                (self.s2_b2_2, 2),
+            },
+            set(fractions.keys()),
+        )
+        self.assertAlmostEqual(0.2, fractions[(self.s2_b2_1, 1)])
+        self.assertAlmostEqual(0.2, fractions[(self.s2_b2_2, 1)])
+        self.assertAlmostEqual(0.6, fractions[(self.s2_b2_2, 2)])
+        self.assertAlmostEqual(1.0, sum(fractions.values()))
+
+        # The largest fraction is always kept.
+        self.assertEqual(
+            [2], schemamapping.find_entries_to_keep([0.2, 0.3, 0.5], 1.0, 0.9)
+        )
+
+    def test_subset(self):
+        """
+        The subset must give the same results as the full mapper
+        and it must be picklable for the worker processes.
+        """
+        subset = self.schema_mapper.subset(
+            source_schema=self.source_schema,
+            target_schema=self.target_schema,
+        )
+        subset = pickle.loads(pickle.dumps(subset))
+
+        for source_taxonomy in [self.s1_b1, self.s1_b2]:
+            expected_results = self.schema_mapper.map_schema(
+                source_schema=self.source_schema,
+                source_taxonomy=source_taxonomy,
+                source_damage_state=1,
+                target_schema=self.target_schema,
+                n_buildings=100,
+            )
+            subset_results = subset.map_schema(
+                source_schema=self.source_schema,
+                source_taxonomy=source_taxonomy,
+                source_damage_state=1,
+                target_schema=self.target_schema,
+                n_buildings=100,
+            )
+            self.assertEqual(
+                [vars(x) for x in expected_results],
+                [vars(x) for x in subset_results],
+            )
+
+        # But there is no data for other schemas.
+        with self.assertRaises(Exception):
+            subset.map_schema(
+                source_schema=self.target_schema,
+                source_taxonomy=self.s2_b1,
+                source_damage_state=1,
+                target_schema=self.source_schema,
+            )
+
+    def test_compile_mapping(self):
+        """
+        The compiled mapping has the same fractions as map_schema
+        (in the same order) in its sparse matrix.
+        """
+        compiled_mapping = self.schema_mapper.compile_mapping(
+            self.source_schema, self.target_schema
+        )
+        self.assertIs(
+            compiled_mapping,
+            self.schema_mapper.compile_mapping(
+                self.source_schema, self.target_schema
+            ),
+        )
+
+        source_pairs = [(self.s1_b2, 1), (self.s1_b1, 1), (self.s1_b2, 1)]
+        rows = compiled_mapping.get_rows(
+            [taxonomy for taxonomy, _ in source_pairs],
+            [damage_state for _, damage_state in source_pairs],
+        )
+        self.assertEqual([0, 1, 0], rows.tolist())
+
+        matrix = compiled_mapping.matrix
+        self.assertEqual(2, matrix.shape[0])
+        for row, (source_taxonomy, source_damage_state) in enumerate(
+            source_pairs[:2]
+        ):
+            expected_results = self.schema_mapper.map_schema(
+                source_schema=self.source_schema,
+                source_taxonomy=source_taxonomy,
+                source_damage_state=source_damage_state,
+                target_schema=self.target_schema,
+            )
+            start, end = matrix.indptr[row], matrix.indptr[row + 1]
+            self.assertEqual(
+                [
+                    (x.taxonomy, x.damage_state, x.n_buildings)
+                    for x in expected_results
+                ],
+                [
+                    (
+                        compiled_mapping.target_taxonomies[column],
+                        compiled_mapping.target_damage_states[column],
+                        fraction,
+                    )
+                    for column, fraction in zip(
+                        matrix.indices[start:end].tolist(),
+                        matrix.data[start:end].tolist(),
+                    )
+                ],
+            )
+            self.assertEqual(
+                compiled_mapping.get_targets(
+                    source_taxonomy, source_damage_state
+                ),
+                [
+                    (x.taxonomy, x.damage_state, x.n_buildings)
+                    for x in expected_results
+                ],
+            )
+
+
+def create_ds_mapping_data(source_schema, target_schema, taxonomy_pairs):
+    """
+    Create the damage state mapping data for the taxonomies.
+
+    Damage states 0 and 2 stay the same, 1 goes half to 1 & half to 2.
+    """
+    return [
+        {
+            "source_schema": source_schema,
+            "target_schema": target_schema,
+            "source_taxonomy": source_taxonomy,
+            "target_taxonomy": target_taxonomy,
+            "conv_matrix": {
+                "0": {"0": 1.0, "1": 0.0, "2": 0.0},
+                "1": {"0": 0.0, "1": 0.5, "2": 0.0},
+                "2": {"0": 0.0, "1": 0.5, "2": 1.0},
+            },
+        }
+        for source_taxonomy, target_taxonomy in taxonomy_pairs
+    ]
+
+
+class TestMultiStepSchemaMapping(unittest.TestCase):
+    """
+    Test case for the mapping over several schemas
+    (if there is no direct mapping).
+    """
+
+    def setUp(self):
+        tax_mapping_data = [
+            {
+                "source_schema": "A",
+                "target_schema": "B",
+                "conv_matrix": {"A1": {"B1": 0.25, "B2": 0.75}},
+            },
+            {
+                "source_schema": "B",
+                "target_schema": "C",
+                "conv_matrix": {
+                    "B1": {"C1": 1.0},
+                    "B2": {"C1": 0.5, "C2": 0.5},
+                },
+            },
+            # A longer way that we should not use.
+            {
+                "source_schema": "A",
+                "target_schema": "X",
+                "conv_matrix": {"A1": {"X1": 1.0}},
+            },
+            {
+                "source_schema": "X",
+                "target_schema": "Y",
+                "conv_matrix": {"X1": {"Y1": 1.0}},
+            },
+            {
+                "source_schema": "Y",
+                "target_schema": "C",
+                "conv_matrix": {"Y1": {"C1": 1.0}},
+            },
+        ]
+        ds_mapping_data = (
+            create_ds_mapping_data("A", "B", [("A1", "B1"), ("A1", "B2")])
+            + create_ds_mapping_data(
+                "B", "C", [("B1", "C1"), ("B2", "C1"), ("B2", "C2")]
+            )
+            + create_ds_mapping_data("A", "X", [("A1", "X1")])
+            + create_ds_mapping_data("X", "Y", [("X1", "Y1")])
+            + create_ds_mapping_data("Y", "C", [("Y1", "C1")])
+        )
+        # fmt: off
+        self.schema_mapper = \
+            schemamapping. \
+            SchemaMapper. \
+            from_taxonomy_and_damage_state_conversion_data(
+                tax_mapping_data, ds_mapping_data
+            )
+        # fmt: on
+
+    def test_find_schema_path(self):
+        """We use the shortest path."""
+        self.assertEqual(
+            ["A", "B"], self.schema_mapper.find_schema_path("A", "B")
+        )
+        self.assertEqual(
+            ["A", "B", "C"], self.schema_mapper.find_schema_path("A", "C")
+        )
+        self.assertIsNone(self.schema_mapper.find_schema_path("C", "A"))
+
+    def test_map_schema(self):
+        """
+        The fractions of the steps are multiplied & summed up
+        for the same taxonomy & damage state.
+        """
+        results = self.schema_mapper.map_schema(
+            source_schema="A",
+            source_taxonomy="A1",
+            source_damage_state=1,
+            target_schema="C",
+            n_buildings=8.0,
+        )
+        self.assertEqual(
+            [
+                ("C", "C1", 1, 1.25),
+                ("C", "C1", 2, 3.75),
+                ("C", "C2", 1, 0.75),
+                ("C", "C2", 2, 2.25),
+            ],
+            [
+                (x.schema, x.taxonomy, x.damage_state, x.n_buildings)
+                for x in results
+            ],
+        )
+
+        with self.assertRaises(Exception):
+            self.schema_mapper.map_schema(
+                source_schema="C",
+                source_taxonomy="C1",
+                source_damage_state=1,
+                target_schema="A",
+            )
+
+    def test_subset(self):
+        """The subset has the data for all the steps."""
+        subset = self.schema_mapper.subset("A", "C")
+        subset = pickle.loads(pickle.dumps(subset))
+        self.assertEqual(["A", "B", "C"], subset.find_schema_path("A", "C"))
+
+        compiled_mapping = subset.compile_mapping("A", "C")
+        self.assertEqual(
+            [("C1", 0, 0.625), ("C2", 0, 0.375)],
+            compiled_mapping.get_targets("A1", 0),
+        )
+        self.assertIsNone(subset.find_schema_path("A", "X"))
+
 
 class TestSchemaMappingCoverage(unittest.TestCase):
     """Test the coverage of the schema mapping files."""
@@ -546,6 +822,96 @@ class TestSchemaMappingCoverage(unittest.TestCase):
             self.assertIn(taxonomy, ds_covered_taxonomies)
 
 
+class TestThreadedSchemaMapping(unittest.TestCase):
+    """Share one compiled real world schema mapping between threads."""
+
+    def test_get_rows_in_threads(self):
+        """
+        All the threads must see the same rows & a matrix
+        that fits to them.
+        """
+        current_dir = os.path.dirname(__file__)
+        source_schema = "SARA_v1.0"
+        target_schema = "SUPPASRI2013_v2.0"
+        schema_mapper = tellus.create_schema_mapper(current_dir).subset(
+            source_schema, target_schema
+        )
+        source_pairs = sorted(
+            {
+                (key.source_taxonomy, damage_state)
+                for key in schema_mapper._ds_mapping_data.keys()
+                for damage_state in range(5)
+            }
+        )
+        expected_targets = {
+            source_pair: [
+                (x.taxonomy, x.damage_state, x.n_buildings)
+                for x in schema_mapper.map_schema(
+                    source_schema=source_schema,
+                    source_taxonomy=source_pair[0],
+                    source_damage_state=source_pair[1],
+                    target_schema=target_schema,
+                )
+            ]
+            for source_pair in source_pairs
+        }
+
+        compiled_mapping = schema_mapper.compile_mapping(
+            source_schema, target_schema
+        )
+        n_threads = 8
+        barrier = threading.Barrier(n_threads)
+        errors = []
+
+        def work(seed):
+            pairs = list(source_pairs)
+            random.Random(seed).shuffle(pairs)
+            barrier.wait()
+            try:
+                for start in range(0, len(pairs), 3):
+                    end = start + 3
+                    chunk = pairs[start:end]
+                    rows = compiled_mapping.get_rows(
+                        [taxonomy for taxonomy, _ in chunk],
+                        [damage_state for _, damage_state in chunk],
+                    )
+                    matrix = compiled_mapping.matrix
+                    for row, source_pair in zip(rows.tolist(), chunk):
+                        row_start = matrix.indptr[row]
+                        row_end = matrix.indptr[row + 1]
+                        targets = [
+                            (
+                                compiled_mapping.target_taxonomies[column],
+                                compiled_mapping.target_damage_states[column],
+                                fraction,
+                            )
+                            for column, fraction in zip(
+                                matrix.indices[row_start:row_end].tolist(),
+                                matrix.data[row_start:row_end].tolist(),
+                            )
+                        ]
+                        if targets != expected_targets[source_pair]:
+                            errors.append(source_pair)
+            except Exception as exception:
+                errors.append(exception)
+
+        threads = [
+            threading.Thread(target=work, args=(seed,))
+            for seed in range(n_threads)
+        ]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual([], errors)
+        self.assertEqual(len(source_pairs), len(compiled_mapping.source_rows))
+        self.assertEqual(
+            (len(source_pairs), len(compiled_mapping.target_columns)),
+            compiled_mapping.matrix.shape,
+        )
+
+
 class TestFullSchemaMapping(unittest.TestCase):
     """Run the full schema mapping for exposure files."""
 
@@ -0,0 +1,68 @@
+#!/usr/bin/env python3
+
+# Copyright © 2021-2022 Helmholtz Centre Potsdam GFZ German Research Centre for
+# Geosciences, Potsdam, Germany
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+"""
+Test cases for the vocabulary.
+"""
+
+
+import pickle
+import unittest
+
+import vocabulary
+
+
+class TestVocabulary(unittest.TestCase):
+    """Test class for the vocabulary module."""
+
+    def test_intern(self):
+        """The ids are dense and depend on the schema & taxonomy."""
+        taxonomy_vocabulary = vocabulary.Vocabulary()
+        self.assertEqual(0, taxonomy_vocabulary.intern("SCHEMA1", "TAX1"))
+        self.assertEqual(1, taxonomy_vocabulary.intern("SCHEMA1", "TAX2"))
+        self.assertEqual(2, taxonomy_vocabulary.intern("SCHEMA2", "TAX1"))
+        self.assertEqual(
+            [1, 0, 1],
+            taxonomy_vocabulary.intern_many(
+                "SCHEMA1", ["TAX2", "TAX1", "TAX2"]
+            ).tolist(),
+        )
+        self.assertEqual(3, len(taxonomy_vocabulary))
+
+        self.assertEqual(2, taxonomy_vocabulary.get_id("SCHEMA2", "TAX1"))
+        self.assertEqual(-1, taxonomy_vocabulary.get_id("SCHEMA2", "TAX2"))
+        self.assertEqual("SCHEMA2", taxonomy_vocabulary.get_schema(2))
+        self.assertEqual("TAX2", taxonomy_vocabulary.get_taxonomy(1))
+        self.assertEqual(
+            ["TAX1", "TAX1"], taxonomy_vocabulary.get_taxonomies([0, 2])
+        )
+        self.assertEqual(
+            [0, 1], taxonomy_vocabulary.get_ids_for_schema("SCHEMA1").tolist()
+        )
+
+    def test_pickle(self):
+        """We must be able to send the vocabulary to other processes."""
+        taxonomy_vocabulary = vocabulary.Vocabulary()
+        taxonomy_vocabulary.intern("SCHEMA1", "TAX1")
+
+        unpickled = pickle.loads(pickle.dumps(taxonomy_vocabulary))
+        self.assertEqual(0, unpickled.get_id("SCHEMA1", "TAX1"))
+        self.assertEqual(1, unpickled.intern("SCHEMA1", "TAX2"))
+
+
+if __name__ == "__main__":
+    unittest.main()
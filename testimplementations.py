@@ -21,6 +21,8 @@ some test implementations
 for the classes in the project.
 """
 
+import numpy as np
+
 
 class AlwaysOneDollarPerTransitionLossProvider:
     """
@@ -70,3 +72,14 @@ class AlwaysTheSameIntensityProvider:
         units = {self._kind: self._unit}
 
         return intensities, units
+
+    def get_nearest_many(self, lons, lats):
+        """
+        Returns always the same intensity
+        for all of the locations.
+        """
+
+        intensities = {self._kind: np.full(len(lons), self._value)}
+        units = {self._kind: self._unit}
+
+        return intensities, units
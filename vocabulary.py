@@ -0,0 +1,113 @@
+#!/usr/bin/env python3
+
+# Copyright © 2021-2022 Helmholtz Centre Potsdam GFZ German Research Centre for
+# Geosciences, Potsdam, Germany
+#
+# Licensed under the Apache License, Version 2.0 (the "License"); you may not
+# use this file except in compliance with the License. You may obtain a copy of
+# the License at
+#
+# https://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS, WITHOUT
+# WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied. See the
+# License for the specific language governing permissions and limitations under
+# the License.
+
+"""
+Module for the interning of the taxonomies.
+
+Instead of working with the taxonomy strings (that we would need
+to hash & compare again and again), we give every combination of
+schema & taxonomy a dense integer id. With those ids we can index
+arrays (for example for the replacement costs).
+"""
+
+import collections
+import threading
+
+import numpy
+
+TaxonomyKey = collections.namedtuple("TaxonomyKey", ["schema", "taxonomy"])
+
+
+class Vocabulary:
+    """
+    Gives dense integer ids (0, 1, 2, ...) for the schemas & taxonomies.
+
+    The ids are given in the order in which we see the taxonomies
+    first. An id never changes, so all the arrays that we build
+    for the ids stay valid (but may be too short for ids
+    that we add later).
+    """
+
+    def __init__(self):
+        self._ids = {}
+        self._keys = []
+        # We can share the vocabulary between threads, so
+        # we must make sure that every taxonomy gets just one id.
+        self._lock = threading.Lock()
+
+    def __getstate__(self):
+        # The lock can't be pickled.
+        return {"ids": self._ids, "keys": self._keys}
+
+    def __setstate__(self, state):
+        self._ids = state["ids"]
+        self._keys = state["keys"]
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._keys)
+
+    def intern(self, schema, taxonomy):
+        """Return the id for the taxonomy (and add it if necessary)."""
+        key = TaxonomyKey(schema, taxonomy)
+        taxonomy_id = self._ids.get(key)
+        if taxonomy_id is None:
+            with self._lock:
+                if key not in self._ids:
+                    self._keys.append(key)
+                    self._ids[key] = len(self._keys) - 1
+                taxonomy_id = self._ids[key]
+        return taxonomy_id
+
+    def intern_many(self, schema, taxonomies):
+        """Return an array with the ids of all the taxonomies."""
+        return numpy.array(
+            [self.intern(schema, taxonomy) for taxonomy in taxonomies],
+            dtype=numpy.int64,
+        )
+
+    def get_id(self, schema, taxonomy):
+        """
+        Return the id for the taxonomy.
+
+        Returns -1 if we don't know the taxonomy.
+        """
+        return self._ids.get(TaxonomyKey(schema, taxonomy), -1)
+
+    def get_schema(self, taxonomy_id):
+        """Return the schema for the id."""
+        return self._keys[taxonomy_id].schema
+
+    def get_taxonomy(self, taxonomy_id):
+        """Return the taxonomy string for the id."""
+        return self._keys[taxonomy_id].taxonomy
+
+    def get_taxonomies(self, taxonomy_ids):
+        """Return a list with the taxonomy strings for all of the ids."""
+        keys = self._keys
+        return [keys[x].taxonomy for x in taxonomy_ids]
+
+    def get_ids_for_schema(self, schema):
+        """Return an array with all the ids of the schema."""
+        return numpy.array(
+            [
+                taxonomy_id
+                for taxonomy_id, key in enumerate(self._keys)
+                if key.schema == schema
+            ],
+            dtype=numpy.int64,
+        )
@@ -21,16 +21,20 @@ work with ashfall data.
 """
 
 import argparse
-import glob
 import os
 
 import ashfall
-import fragility
-import gpdexposure
-import loss
+import executors
 import tellus
 
 
+def create_intensity_provider(intensity_file, intensity_column, workers=1):
+    """Create the intensity provider for the ashfall file."""
+    return ashfall.Ashfall.from_file(
+        intensity_file, intensity_column
+    ).to_intensity_provider(workers=workers)
+
+
 def main():
     """
     Runs the main method, which reads from
@@ -46,7 +50,11 @@ def main():
     argparser.add_argument(
         "intensity_column", help="Column in the intensity file"
     )
-    argparser.add_argument("exposure_file", help="File with the exposure data")
+    argparser.add_argument(
+        "exposure_file",
+        help="File with the exposure data (GeoJSON, or GeoParquet/Arrow "
+        + "for .parquet/.arrow files)",
+    )
     argparser.add_argument(
         "exposure_schema",
         help="The actual schema for the exposure data",
@@ -57,22 +65,24 @@ def main():
     argparser.add_argument(
         "--merged_output_file",
         default="output_merged.json",
-        help="Filename for the merged output from all others",
+        help="Filename for the merged output from all others "
+        + "(GeoParquet/Arrow for .parquet/.arrow files, GeoJSON otherwise)",
     )
+    tellus.add_common_arguments(argparser)
     current_dir = os.path.dirname(os.path.realpath(__file__))
-    loss_data_dir = os.path.join(current_dir, "loss_data")
-    files = glob.glob(os.path.join(loss_data_dir, "*.json"))
-    loss_provider = loss.LossProvider.from_files(files, "USD")
+    loss_provider = tellus.create_loss_provider(current_dir)
 
     args = argparser.parse_args()
 
-    intensity_provider = ashfall.Ashfall.from_file(
-        args.intensity_file, args.intensity_column
-    ).to_intensity_provider()
-    fragility_provider = fragility.Fragility.from_file(
-        args.fragilty_file
-    ).to_fragility_provider()
-    old_exposure = gpdexposure.read_exposure(args.exposure_file)
+    intensity_provider = create_intensity_provider(
+        args.intensity_file,
+        args.intensity_column,
+        workers=tellus.get_query_workers(args),
+    )
+    fragility_provider = tellus.create_fragility_provider(
+        args.fragilty_file, args
+    )
+    old_exposure, exposure_batches = tellus.read_exposure_for_args(args)
 
     worker = tellus.Child(
         intensity_provider,
@@ -81,6 +91,13 @@ def main():
         args.exposure_schema,
         loss_provider,
         args,
+        engine=args.engine,
+        damage_epsilon=args.damage_epsilon,
+        pruning_epsilon=args.pruning_epsilon,
+        executor=executors.create_executor(args.executor, args.workers),
+        exposure_batches=exposure_batches,
+        summary_directory=args.summary_directory,
+        mapping_cache=args.mapping_cache,
     )
     worker.run()
 
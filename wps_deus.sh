@@ -22,12 +22,10 @@
 # - the schema (string)
 # - the file with the fragility functions (filename)
 #
-# After it is done it will minify the resulting output with
-# the updated exposure, the transitions & the losses.
-# (Minifying will remove all unnecessary whitespace).
+# The resulting output with the updated exposure, the transitions
+# & the losses is already written without any unnecessary whitespace.
+# The summary.shp & the meta_summary.json are written by the same run.
 
 set -e
 
-python3 deus.py --merged_output_file merged_output.json shakemap_input.xml $@
-python3 minify_json.py merged_output.json
-python3 create_shapefile.py merged_output.json
+python3 deus.py --merged_output_file merged_output.json --summary_directory . shakemap_input.xml $@
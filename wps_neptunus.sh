@@ -22,9 +22,9 @@
 # - the schema (string)
 # - the file with the fragility functions (filename)
 #
-# After it is done it will minify the resulting output with
-# the updated exposure, the transitions & the losses.
-# (Minifying will remove all unnecessary whitespace).
+# The resulting output with the updated exposure, the transitions
+# & the losses is already written without any unnecessary whitespace.
+# The summary.shp & the meta_summary.json are written by the same run.
 #
 # Remember: Deus works with xml shakemaps, while volcanus uses
 # vector data (shapefiles) for the ashfall intensities.
@@ -32,6 +32,4 @@
 
 set -e
 
-python3 neptunus.py --merged_output_file merged_output.json intensities.tiff $@
-python3 minify_json.py merged_output.json
-python3 create_shapefile.py merged_output.json
+python3 neptunus.py --merged_output_file merged_output.json --summary_directory . intensities.tiff $@